@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+bench-transfer.py - compare the media download path against a plain
+shutil.copyfileobj, in throughput and CPU time per GB.
+
+By default a file of --size MB is served over plain HTTP by a local
+`python -m http.server` (in its own process, so its CPU time isn't counted).
+Pass --url to download something real instead, e.g. a large file over HTTPS
+to include TLS.
+
+    python scripts/bench-transfer.py --size 1024 --rounds 5
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+from famly_fetch.storage import LocalStorage
+from famly_fetch.transfer import copy_stream
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def with_copyfileobj(url: str, target: Path) -> int:
+    with urllib.request.urlopen(url) as r, open(target, "wb") as f:
+        shutil.copyfileobj(r, f)
+        return f.tell()
+
+
+def with_copy_stream(url: str, target: Path) -> int:
+    storage = LocalStorage(target.parent)
+    with urllib.request.urlopen(url) as r:
+        length = int(r.getheader("Content-Length") or 0) or None
+        with storage.writer(target.name, size=length) as out:
+            return copy_stream(r, out)
+
+
+METHODS = {"copyfileobj": with_copyfileobj, "copy_stream": with_copy_stream}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(folder: Path) -> tuple[subprocess.Popen, int]:
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "http.server", str(port), "--bind", "127.0.0.1"],
+        cwd=folder,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server, port
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise SystemExit("http.server didn't start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=512, help="MB to serve")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--url", help="download this URL instead")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        server = None
+        url = args.url
+        if url is None:
+            source = tmp_path / "serve"
+            source.mkdir()
+            with open(source / "blob", "wb") as f:
+                for _ in range(args.size):
+                    f.write(os.urandom(1024 * 1024))
+            server, port = serve(source)
+            url = f"http://127.0.0.1:{port}/blob"
+
+        target = tmp_path / "download"
+        target.mkdir()
+        try:
+            for name, method in METHODS.items():
+                method(url, target / "warmup")  # and fill the page cache
+                wall = cpu = 0.0
+                total = 0
+                for _ in range(args.rounds):
+                    (target / name).unlink(missing_ok=True)
+                    start, start_cpu = time.perf_counter(), cpu_seconds()
+                    total += method(url, target / name)
+                    wall += time.perf_counter() - start
+                    cpu += cpu_seconds() - start_cpu
+                gb = total / 1024**3
+                print(
+                    f"{name:>12}: {total / 1024**2 / wall:8.1f} MB/s, "
+                    f"{cpu / gb:6.2f} CPU s/GB"
+                )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,5 +4,22 @@ famly-fetch - A tool to fetch your kid's images from famly.co
 
 from .api_client import ApiClient
 from .downloader import FamlyDownloader
+from .file import File
+from .hooks import DownloadedFile, Hook, HookPipeline
+from .image import BaseImage, Image, SecretImage
+from .media import MediaItem
+from .video import Video
 
-__all__ = ["ApiClient", "FamlyDownloader"]
+__all__ = [
+    "ApiClient",
+    "BaseImage",
+    "DownloadedFile",
+    "FamlyDownloader",
+    "File",
+    "Hook",
+    "HookPipeline",
+    "Image",
+    "MediaItem",
+    "SecretImage",
+    "Video",
+]
@@ -1,11 +1,24 @@
 import hashlib
+import io
 import json
+import threading
+import time
+import urllib.error
 import urllib.parse
-import urllib.request
 import uuid
 
 from importlib_resources import files
 
+from famly_fetch.cassette import (
+    CassettePlayer,
+    CassetteRecorder,
+    endpoint_key,
+    request_key,
+)
+from famly_fetch.compression import ACCEPT_ENCODING, read_body
+from famly_fetch.connection_pool import ConnectionPool
+from famly_fetch.retry import PermanentError, Retrier
+
 
 def get_device_id() -> str:
     """
@@ -30,6 +43,9 @@ class ApiClient:
         base_url: str,
         user_agent: str | None = None,
         access_token: str | None = None,
+        pool: ConnectionPool | None = None,
+        retrier: Retrier | None = None,
+        cassette: CassetteRecorder | CassettePlayer | None = None,
     ):
         """
         Initialize the ApiClient.
@@ -37,11 +53,64 @@ class ApiClient:
         Args:
             user_agent (str): The user agent to use for requests.
             access_token (str): Optional access token to use directly.
+            pool (ConnectionPool): Optional connection pool to share with other
+                clients. A private pool is created if not given.
+            retrier (Retrier): Optional retry policy and circuit breakers to
+                share with media downloads.
+            cassette (CassetteRecorder | CassettePlayer): Optional cassette to
+                record the responses into, or to replay them from instead of
+                sending the requests.
         """
         self._user_agent: str | None = user_agent
         self._device_id = get_device_id()
         self._access_token = access_token
         self._base = base_url
+        self._pool = pool or ConnectionPool()
+        self._retrier = retrier or Retrier()
+        self._cassette = cassette
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+        self.requests = 0
+        self.wire_bytes = 0
+        self.response_bytes = 0
+        self.decode_seconds = 0.0
+
+    @property
+    def last_response_bytes(self) -> int:
+        """Size of the last response body received on the calling thread."""
+        return getattr(self._local, "last_response_bytes", 0)
+
+    @property
+    def last_wire_bytes(self) -> int:
+        """Bytes received for the last response on the calling thread, before
+        decompression."""
+        return getattr(self._local, "last_wire_bytes", 0)
+
+    @property
+    def last_decode_seconds(self) -> float:
+        """Time spent decompressing and parsing the last response on the
+        calling thread."""
+        return getattr(self._local, "last_decode_seconds", 0.0)
+
+    def _record_response(
+        self, response_bytes: int, wire_bytes: int, decode_seconds: float
+    ):
+        self._local.last_response_bytes = response_bytes
+        self._local.last_wire_bytes = wire_bytes
+        self._local.last_decode_seconds = decode_seconds
+        with self._stats_lock:
+            self.requests += 1
+            self.response_bytes += response_bytes
+            self.wire_bytes += wire_bytes
+            self.decode_seconds += decode_seconds
+
+    def summary(self) -> str:
+        return (
+            f"{self.requests} requests, {self.wire_bytes / 1_000_000:.1f} MB "
+            f"received ({self.response_bytes / 1_000_000:.1f} MB decoded), "
+            f"{self.decode_seconds:.2f}s decoding"
+        )
 
     def login(self, email, password):
         """
@@ -52,7 +121,7 @@ class ApiClient:
             password (str): The user's password.
 
         Raises:
-            Exception: If the server returns a non-200 HTTP status code.
+            PermanentError: If the server returns a non-200 HTTP status code.
         """
 
         login_data = self.make_graphql_request(
@@ -110,6 +179,16 @@ class ApiClient:
             body=postBody,
         )
 
+        if not isinstance(data, dict):
+            raise PermanentError(
+                f"GraphQL {method} returned an unexpected response: {str(data)[:200]}"
+            )
+        if not data.get("data") and data.get("errors"):
+            messages = "; ".join(e.get("message", "?") for e in data["errors"])
+            raise PermanentError(f"GraphQL {method} failed: {messages}")
+        if data.get("data") is None:
+            raise PermanentError(f"GraphQL {method} returned no data")
+
         return data["data"]
 
     def make_api_request(self, method, path, body=None, params=None):
@@ -126,15 +205,19 @@ class ApiClient:
             dict: The JSON response from the server.
 
         Raises:
-            urllib.error.HTTPError: If the server couldn't fulfill the request.
-            Exception: If the server returns a non-200 HTTP status code.
+            PermanentError: If the server refused the request, or returned a
+                non-200 HTTP status code.
+            TransientError: If the request still failed after all retries.
         """
 
         b = None
         if body:
             b = json.dumps(body).encode("utf-8")
 
-        headers: dict[str, str] = {"Content-Type": "application/json"}
+        headers: dict[str, str] = {
+            "Content-Type": "application/json",
+            "Accept-Encoding": ACCEPT_ENCODING,
+        }
         if self._user_agent:
             headers["User-Agent"] = self._user_agent
 
@@ -148,21 +231,80 @@ class ApiClient:
             query_string = urllib.parse.urlencode(params)
             url += "?" + query_string
 
-        req = urllib.request.Request(url=url, headers=headers, method=method, data=b)
-        try:
-            with urllib.request.urlopen(req) as f:
-                body = f.read().decode("utf-8")
+        key = endpoint = None
+        if self._cassette is not None:
+            key = request_key(method, path, params, body)
+            endpoint = endpoint_key(method, path)
+        if isinstance(self._cassette, CassettePlayer):
+
+            def replay():
+                data, size = self._cassette.play_api(key, endpoint)
+                self._record_response(size, size, 0.0)
+                return data
+
+            return self._retrier.call(url, replay)
+
+        def request():
+            started = time.perf_counter()
+            try:
+                return read_response(started)
+            except urllib.error.HTTPError as e:
+                if not isinstance(self._cassette, CassetteRecorder):
+                    raise
+                # Record the failure too, so a replay takes the same path
+                error_body = e.read()
+                self._cassette.record_api(
+                    key,
+                    endpoint,
+                    e.code,
+                    None,
+                    len(error_body),
+                    time.perf_counter() - started,
+                    error=error_body.decode("utf-8", errors="replace"),
+                )
+                raise urllib.error.HTTPError(
+                    url, e.code, e.msg, e.hdrs, io.BytesIO(error_body)
+                ) from None
+
+        def read_response(started: float):
+            with self._pool.urlopen(method, url, body=b, headers=headers) as f:
+                try:
+                    raw, wire_bytes, decode_seconds = read_body(f)
+                except ValueError as e:
+                    raise PermanentError(str(e), url, f.status)
                 if f.status != 200:
-                    raise Exception(f"Broken! {body}")
-
+                    body = raw.decode("utf-8", errors="replace")
+                    if isinstance(self._cassette, CassetteRecorder):
+                        self._cassette.record_api(
+                            key,
+                            endpoint,
+                            f.status,
+                            None,
+                            len(raw),
+                            time.perf_counter() - started,
+                            error=body,
+                        )
+                    raise PermanentError(f"Broken! {body}", url, f.status)
+
+                start = time.perf_counter()
                 try:
-                    return json.loads(body)
+                    data = json.loads(raw)
                 except Exception as _e:
-                    return body
-        except urllib.error.HTTPError as e:
-            # The server couldn't fulfill the request
-            print("Error code: ", e.code)
-            print("Response body: ", e.read())
+                    data = raw.decode("utf-8")
+                decode_seconds += time.perf_counter() - start
+                self._record_response(len(raw), wire_bytes, decode_seconds)
+                if isinstance(self._cassette, CassetteRecorder):
+                    self._cassette.record_api(
+                        key,
+                        endpoint,
+                        200,
+                        data,
+                        len(raw),
+                        time.perf_counter() - started - decode_seconds,
+                    )
+                return data
+
+        return self._retrier.call(url, request)
 
     def feed(
         self,
@@ -187,8 +329,8 @@ class ApiClient:
             dict: The JSON response from the server.
 
         Raises:
-            urllib.error.HTTPError: If the server couldn't fulfill the request.
-            Exception: If the server returns a non-200 HTTP status code.
+            PermanentError: If the server couldn't fulfill the request.
+            TransientError: If the request still failed after all retries.
         """
 
         return self.make_api_request("GET", "/api/me/me/me")
@@ -0,0 +1,162 @@
+import io
+import json
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import BinaryIO
+
+from famly_fetch.storage import LocalStorage, SpoolWriter, Storage, StorageWriter
+
+ARCHIVE_FORMATS = ("tar", "zip")
+
+
+class ArchiveWriter:
+    """Write downloaded media into rolling tar or zip archives.
+
+    Every member is written in one go, so the archive is a single sequential
+    write without per-file create and metadata costs. Each run starts a new
+    volume (`<name>-0001.tar`, `<name>-0002.tar`, ...) rather than touching
+    existing ones, and a volume is closed and the next one started once it
+    grows past `max_volume_size`. With `target` "-" a single tar stream is
+    written to stdout.
+
+    Volumes are written to `storage`, with `target` as the key, or to the
+    local disk at the path `target` without one.
+
+    Every member is also recorded in `index_file`, one JSON object per line
+    with the item id, the volume and the member name.
+    """
+
+    def __init__(
+        self,
+        target: str,
+        index_file: Path,
+        archive_format: str = "tar",
+        max_volume_size: int | None = None,
+        storage: Storage | None = None,
+    ):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format {archive_format!r}")
+        if target == "-" and archive_format != "tar":
+            raise ValueError("Only tar archives can be written to stdout")
+
+        if storage is None and target != "-":
+            storage = LocalStorage(Path(target).parent)
+            target = Path(target).name
+        self._storage = storage
+        self._target = target
+        self._format = archive_format
+        self._max_volume_size = max_volume_size
+        self._lock = threading.Lock()
+        self._archive: tarfile.TarFile | zipfile.ZipFile | None = None
+        self._out: StorageWriter | None = None
+        self._volume: str | None = None
+        self._volume_size = 0
+        self._index = open(index_file, "a")
+
+    def _volume_key(self) -> str:
+        stem, dot, suffix = self._target.rpartition(".")
+        if not dot or "/" in suffix:
+            stem, suffix = self._target, self._format
+        number = 1
+        while True:
+            key = f"{stem}-{number:04d}.{suffix}"
+            if not self._storage.exists(key):
+                return key
+            number += 1
+
+    def _open_volume(self):
+        if self._target == "-":
+            self._volume = "-"
+            # sys.stdout itself may be redirected to keep messages out of
+            # the stream
+            self._archive = tarfile.open(fileobj=sys.__stdout__.buffer, mode="w|")
+        else:
+            key = self._volume_key()
+            self._volume = key
+            # Written as a stream, so it can go straight to remote storage
+            self._out = self._storage.open(key)
+            if self._format == "tar":
+                self._archive = tarfile.open(fileobj=self._out, mode="w|")
+            else:
+                self._archive = zipfile.ZipFile(self._out, mode="w")
+        self._volume_size = 0
+
+    def _close_volume(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+    def add(
+        self,
+        member: str,
+        data: BinaryIO,
+        size: int,
+        item_id: str | None = None,
+        mtime: float | None = None,
+    ):
+        """Append `size` bytes from `data` as `member`."""
+        mtime = mtime or time.time()
+        with self._lock:
+            if self._archive is None:
+                self._open_volume()
+
+            if isinstance(self._archive, tarfile.TarFile):
+                info = tarfile.TarInfo(member)
+                info.size = size
+                info.mtime = int(mtime)
+                self._archive.addfile(info, data)
+            else:
+                info = zipfile.ZipInfo(member, time.localtime(mtime)[:6])
+                # Media is already compressed
+                info.compress_type = zipfile.ZIP_STORED
+                # Known up front, so members over 2 GiB get ZIP64 headers
+                info.file_size = size
+                with self._archive.open(info, mode="w") as f:
+                    while chunk := data.read(1024 * 1024):
+                        f.write(chunk)
+
+            self._volume_size += size
+            self._index.write(
+                json.dumps({"id": item_id, "volume": self._volume, "member": member})
+                + "\n"
+            )
+            self._index.flush()
+
+            if self._max_volume_size and self._volume_size >= self._max_volume_size:
+                self._close_volume()
+
+    def add_bytes(self, member: str, data: bytes, **kwargs):
+        self.add(member, io.BytesIO(data), len(data), **kwargs)
+
+    def close(self):
+        with self._lock:
+            self._close_volume()
+            self._index.close()
+
+
+class ArchiveStorage(Storage):
+    """Storage backend that adds every file to an ArchiveWriter."""
+
+    def __init__(self, archive: ArchiveWriter):
+        self.archive = archive
+
+    def open(self, key, item_id=None, mtime=None, size=None) -> StorageWriter:
+        # A member can't be taken out again, so only complete files go in
+        return SpoolWriter(
+            lambda data, size: self.archive.add(
+                key, data, size, item_id=item_id, mtime=mtime
+            )
+        )
+
+    def exists(self, key: str) -> bool:
+        return False
+
+    def close(self):
+        self.archive.close()
@@ -0,0 +1,347 @@
+import json
+import os
+import threading
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+
+import click
+
+from famly_fetch.budget import Budget
+from famly_fetch.connection_pool import ConnectionPool
+from famly_fetch.date_range import DateRange
+from famly_fetch.downloader import FamlyDownloader
+from famly_fetch.hooks import HookPipeline
+from famly_fetch.postprocess import PostProcessor
+from famly_fetch.retry import Retrier, RetryPolicy
+from famly_fetch.storage import S3Storage
+from famly_fetch.transfer import RateLimiter
+
+SOURCES = ("tagged", "journey", "notes", "messages", "liked", "feed")
+
+# A job runs on a worker thread and may return follow-up jobs for its account
+Job = Callable[[], Iterable["Job"] | None]
+
+
+@dataclass
+class AccountConfig:
+    name: str
+    pictures_folder: Path
+    state_file: Path
+    email: str | None = None
+    password: str | None = None
+    access_token: str | None = None
+    famly_base_url: str = "https://app.famly.co"
+    sources: list[str] = field(default_factory=lambda: ["tagged"])
+    max_workers: int = 1
+    stop_on_existing: bool = False
+    text_comments: bool = True
+    latitude: float | None = None
+    longitude: float | None = None
+    filename_pattern: str = "%FP-%Y-%m-%d_%H-%M-%S-%ID"
+    layout: str = "date"
+    archive: str | None = None
+    archive_format: str = "tar"
+    archive_volume_size: int | None = None
+    s3: str | None = None
+    s3_endpoint_url: str = "https://s3.amazonaws.com"
+    s3_region: str = "us-east-1"
+    s3_access_key: str | None = None
+    s3_secret_key: str | None = None
+    max_dimension: int | None = None
+    upgrade_capped: bool = False
+    sidecar_metadata: bool = False
+    include_files: bool = False
+    include_videos: bool = False
+    max_retries: int = 5
+    feed_page_size: int = 10
+    page_size: int = 100
+    adaptive_page_size: bool = True
+    feed_crawl_workers: int = 1
+    feed_window_days: int = 30
+
+    @staticmethod
+    def from_dict(data: dict, base_dir: Path) -> "AccountConfig":
+        data = dict(data)
+        unknown = set(data) - set(AccountConfig.__dataclass_fields__)
+        if unknown:
+            raise click.BadParameter(
+                f"Unknown account setting(s): {', '.join(sorted(unknown))}"
+            )
+        if "name" not in data or "pictures_folder" not in data:
+            raise click.BadParameter(
+                "Every account needs a 'name' and a 'pictures_folder'"
+            )
+
+        bad_sources = set(data.get("sources", [])) - set(SOURCES)
+        if bad_sources:
+            raise click.BadParameter(
+                f"Unknown source(s) for {data['name']}: {', '.join(sorted(bad_sources))}"
+            )
+
+        # Credentials may reference environment variables, e.g. "$FAMLY_PASSWORD_A"
+        for key in (
+            "email",
+            "password",
+            "access_token",
+            "s3_access_key",
+            "s3_secret_key",
+        ):
+            if data.get(key):
+                data[key] = os.path.expandvars(data[key])
+
+        if data.get("s3") and not (
+            data.get("s3_access_key") and data.get("s3_secret_key")
+        ):
+            raise click.BadParameter(
+                f"S3 uploads for {data['name']} need 's3_access_key' and 's3_secret_key'"
+            )
+
+        data["pictures_folder"] = (base_dir / data["pictures_folder"]).resolve()
+        if data.get("archive") and not data.get("s3"):
+            data["archive"] = str((base_dir / data["archive"]).resolve())
+        if data.get("state_file"):
+            data["state_file"] = (base_dir / data["state_file"]).resolve()
+        else:
+            data["state_file"] = data["pictures_folder"] / "state.json"
+
+        return AccountConfig(**data)
+
+
+def load_accounts(config_file: Path) -> tuple[list[AccountConfig], dict]:
+    """Read the accounts config file.
+
+    Returns:
+        tuple: The accounts and the global settings (`max_workers`,
+        `postprocess_workers`, `max_rate`, `rate_schedule`).
+    """
+    with open(config_file, "r") as f:
+        config = json.load(f)
+
+    base_dir = config_file.parent
+    accounts = [AccountConfig.from_dict(a, base_dir) for a in config["accounts"]]
+
+    names = [a.name for a in accounts]
+    if len(names) != len(set(names)):
+        raise click.BadParameter("Account names must be unique")
+
+    settings = {k: v for k, v in config.items() if k != "accounts"}
+    return accounts, settings
+
+
+class FairScheduler:
+    """Run jobs from several accounts on one shared thread pool.
+
+    Accounts take turns (round-robin) whenever a worker becomes free, and no
+    account has more than its own `max_workers` jobs running at a time, so a
+    large account can't starve the others.
+    """
+
+    def __init__(self, max_workers: int):
+        self._max_workers = max_workers
+        self._queues: dict[str, deque] = {}
+        self._caps: dict[str, int] = {}
+        self._running: dict[str, int] = {}
+        self._order: deque[str] = deque()
+        self._lock = threading.Lock()
+
+    def add_account(self, name: str, max_workers: int, jobs: Iterable[Job] = ()):
+        with self._lock:
+            self._queues[name] = deque(jobs)
+            self._caps[name] = max(1, max_workers)
+            self._running[name] = 0
+            self._order.append(name)
+
+    def _next_job(self) -> tuple[str, Job] | None:
+        with self._lock:
+            for _ in range(len(self._order)):
+                name = self._order[0]
+                self._order.rotate(-1)
+                if self._queues[name] and self._running[name] < self._caps[name]:
+                    self._running[name] += 1
+                    return name, self._queues[name].popleft()
+        return None
+
+    def _run_job(self, name: str, job: Job):
+        try:
+            follow_ups = job() or ()
+        except Exception as e:
+            click.secho(f"[{name}] An exception occurred: {e}", fg="red")
+            follow_ups = ()
+
+        with self._lock:
+            self._queues[name].extend(follow_ups)
+            self._running[name] -= 1
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            in_flight: set = set()
+            while True:
+                while len(in_flight) < self._max_workers:
+                    picked = self._next_job()
+                    if picked is None:
+                        break
+                    in_flight.add(executor.submit(self._run_job, *picked))
+
+                if not in_flight:
+                    break
+                _done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+
+
+def _account_setup_job(
+    account: AccountConfig,
+    user_agent: str,
+    pool: ConnectionPool,
+    postprocessor: PostProcessor,
+    downloaders: list[FamlyDownloader],
+    rate_limiter: RateLimiter | None = None,
+    budget: Budget | None = None,
+    date_range: DateRange | None = None,
+    hooks: HookPipeline | None = None,
+) -> Job:
+    """Build the first job for an account.
+
+    It logs in and discovers the children, then hands back one job per source
+    (and per child for the per-child sources). The downloader is added to
+    `downloaders`, to be closed once all accounts are done."""
+
+    def setup():
+        click.secho(f"[{account.name}] Logging in...", fg="cyan")
+        storage = None
+        if account.s3:
+            storage = S3Storage.from_url(
+                account.s3,
+                access_key=account.s3_access_key,
+                secret_key=account.s3_secret_key,
+                endpoint_url=account.s3_endpoint_url,
+                region=account.s3_region,
+                pool=pool,
+                retrier=Retrier(RetryPolicy(max_attempts=account.max_retries)),
+            )
+        downloader = FamlyDownloader(
+            email=account.email,
+            password=account.password,
+            famly_base_url=account.famly_base_url,
+            pictures_folder=account.pictures_folder,
+            stop_on_existing=account.stop_on_existing,
+            text_comments=account.text_comments,
+            state_file=account.state_file,
+            user_agent=user_agent,
+            access_token=account.access_token,
+            latitude=account.latitude,
+            longitude=account.longitude,
+            filename_pattern=account.filename_pattern,
+            layout=account.layout,
+            archive=account.archive,
+            archive_format=account.archive_format,
+            archive_volume_size=account.archive_volume_size * 1_000_000
+            if account.archive_volume_size
+            else None,
+            storage=storage,
+            max_dimension=account.max_dimension,
+            upgrade_capped=account.upgrade_capped,
+            sidecar_metadata=account.sidecar_metadata,
+            include_files=account.include_files,
+            include_videos=account.include_videos,
+            pool=pool,
+            max_retries=account.max_retries,
+            feed_page_size=account.feed_page_size,
+            page_size=account.page_size,
+            adaptive_page_size=account.adaptive_page_size,
+            feed_crawl_workers=account.feed_crawl_workers,
+            feed_window_days=account.feed_window_days,
+            postprocessor=postprocessor,
+            rate_limiter=rate_limiter,
+            budget=budget,
+            date_range=date_range,
+            hooks=hooks,
+        )
+        downloaders.append(downloader)
+
+        children = downloader.get_all_children()
+        jobs: list[Job] = []
+        if "messages" in account.sources:
+            jobs.append(downloader.download_images_from_messages)
+
+        for child_id, first_name in children:
+            if "tagged" in account.sources:
+                jobs.append(
+                    partial(downloader.download_tagged_images, child_id, first_name)
+                )
+            if "journey" in account.sources:
+                jobs.append(
+                    partial(
+                        downloader.download_images_from_learning_journey,
+                        child_id,
+                        first_name,
+                    )
+                )
+            if "notes" in account.sources:
+                jobs.append(
+                    partial(downloader.download_images_from_notes, child_id, first_name)
+                )
+
+        if "liked" in account.sources or "feed" in account.sources:
+
+            def download_feed():
+                parent_ids = None
+                if "liked" in account.sources:
+                    parent_ids = set()
+                    for child_id, _first_name in children:
+                        parent_ids |= downloader.get_parents_ids(child_id)
+                # One walk of the feed serves both
+                downloader.download_feed(parent_ids, "feed" in account.sources)
+
+            jobs.append(download_feed)
+
+        return jobs
+
+    return setup
+
+
+def run_accounts(
+    accounts: list[AccountConfig],
+    max_workers: int,
+    user_agent: str,
+    postprocess_workers: int = 0,
+    rate_limiter: RateLimiter | None = None,
+    budget: Budget | None = None,
+    date_range: DateRange | None = None,
+    hooks: HookPipeline | None = None,
+):
+    """Download all accounts concurrently, sharing one connection pool, one
+    post-processing pool, one bandwidth limit and one time and byte budget.
+    All of them are limited to `date_range`, and hand their files to `hooks`,
+    which the caller closes."""
+    pool = ConnectionPool(max_idle_per_host=max_workers)
+    postprocessor = PostProcessor(postprocess_workers)
+    scheduler = FairScheduler(max_workers)
+    downloaders: list[FamlyDownloader] = []
+    for account in accounts:
+        scheduler.add_account(
+            account.name,
+            account.max_workers,
+            [
+                _account_setup_job(
+                    account,
+                    user_agent,
+                    pool,
+                    postprocessor,
+                    downloaders,
+                    rate_limiter,
+                    budget,
+                    date_range,
+                    hooks,
+                )
+            ],
+        )
+    try:
+        scheduler.run()
+    finally:
+        postprocessor.close()
+        for downloader in downloaders:
+            downloader.close()
+        pool.close()
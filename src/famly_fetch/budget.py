@@ -0,0 +1,65 @@
+import re
+import threading
+import time
+
+import click
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)\s*([smhd]?)", re.IGNORECASE)
+_SECONDS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value: str) -> float:
+    """Parse a duration in seconds, like "90", "45m" or "1.5h"."""
+    match = _DURATION.fullmatch(value.strip())
+    if not match:
+        raise ValueError(f"Invalid duration {value!r}, expected e.g. 45m or 2h")
+    return float(match.group(1)) * _SECONDS[match.group(2).lower()]
+
+
+class Budget:
+    """How long a run may take and how much it may download.
+
+    Checked between items, so the item in progress is always finished and
+    marked; the next run carries on with what's left.
+    """
+
+    def __init__(self, max_runtime: float | None = None, max_bytes: int | None = None):
+        self.max_runtime = max_runtime
+        self.max_bytes = max_bytes
+        self._started = time.monotonic()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stopped: str | None = None
+        self._reported = False
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def add_bytes(self, count: int):
+        with self._lock:
+            self._bytes += count
+
+    def stop(self, reason: str):
+        """End the run at the next item, e.g. on SIGTERM."""
+        self._stopped = reason
+
+    def _exhausted(self) -> str | None:
+        if self._stopped:
+            return self._stopped
+        if self.max_runtime is not None:
+            if time.monotonic() - self._started >= self.max_runtime:
+                return f"reached --max-runtime of {self.max_runtime:g}s"
+        if self.max_bytes is not None and self._bytes >= self.max_bytes:
+            return f"reached --max-bytes with {self._bytes / 1e6:.1f} MB downloaded"
+        return None
+
+    def exhausted(self) -> bool:
+        """Check whether the run should stop, and say why the first time."""
+        reason = self._exhausted()
+        if reason and not self._reported:
+            self._reported = True
+            click.secho(
+                f"Stopping, {reason}. The next run continues from here.", fg="cyan"
+            )
+        return reason is not None
@@ -0,0 +1,339 @@
+import base64
+import gzip
+import hashlib
+import json
+import re
+import secrets
+import threading
+import time
+import urllib.parse
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from famly_fetch.retry import PermanentError, TransientError, error_for_status
+
+CASSETTE_VERSION = 1
+
+# Replay timings: sleep as long as the recorded request took, or not at all
+TIMINGS = ("original", "fast")
+
+# Keys whose string values are personal data, replaced when recording
+PII_KEYS = {
+    "accessToken",
+    "address",
+    "birthday",
+    "body",
+    "email",
+    "fileName",
+    "filename",
+    "firstName",
+    "fullName",
+    "lastName",
+    "middleName",
+    "name",
+    "originalFilename",
+    "password",
+    "phone",
+    "phoneNumber",
+    "subtitle",
+    "text",
+    "title",
+}
+
+# Keys of PII_KEYS holding file names, whose extension is kept
+_FILENAME_KEYS = {"fileName", "filename", "originalFilename"}
+
+# Characters of an API error body kept in the cassette
+_ERROR_BODY_LENGTH = 200
+
+# Request parameters left out of the request key, so a replay with other
+# (e.g. adaptive) page sizes still finds the recorded pages
+_PAGE_SIZE_PARAMS = {"first", "limit"}
+
+_ACCESS_TOKEN = re.compile(r"(accessToken=)[^&\s\"]+")
+
+# Headers of media responses kept in the cassette
+_MEDIA_HEADERS = ("Content-Type", "Content-Length", "Last-Modified", "ETag")
+
+
+def scrub_url(url: str) -> str:
+    return _ACCESS_TOKEN.sub(r"\1scrubbed", url)
+
+
+def request_key(
+    method: str, path: str, params: dict | None = None, body: dict | None = None
+) -> str:
+    """Identifies an API request in a cassette.
+
+    Page sizes, the GraphQL query text and personal data in the request are
+    left out."""
+    params = {k: v for k, v in (params or {}).items() if k not in _PAGE_SIZE_PARAMS}
+    key = endpoint_key(method, path)
+    if params:
+        key += "?" + urllib.parse.urlencode(sorted(params.items()))
+    if body:
+        variables = {
+            k: "" if k in PII_KEYS else v
+            for k, v in (body.get("variables") or {}).items()
+            if k not in _PAGE_SIZE_PARAMS
+        }
+        digest = hashlib.sha256(
+            json.dumps(variables, sort_keys=True).encode()
+        ).hexdigest()
+        key += f" {digest[:16]}"
+    return key
+
+
+def endpoint_key(method: str, path: str) -> str:
+    """Identifies the endpoint of an API request, without its parameters."""
+    return f"{method} {scrub_url(path)}"
+
+
+class Scrubber:
+    """Replaces personal data in API responses with pseudonyms.
+
+    A pseudonym has the length of the value it replaces, so the responses keep
+    their size, and the same value always gets the same pseudonym within a
+    recording, so e.g. a child's name still matches across responses. The
+    salt is random per recording, so pseudonyms can't be looked up."""
+
+    def __init__(self):
+        self._salt = secrets.token_bytes(16)
+
+    def pseudonym(self, value: str) -> str:
+        if not value:
+            return value
+        digest = hashlib.blake2b(value.encode(), key=self._salt).hexdigest()
+        return (digest * (len(value) // len(digest) + 1))[: len(value)]
+
+    def scrub(self, data, key: str | None = None):
+        if isinstance(data, dict):
+            return {k: self.scrub(v, k) for k, v in data.items()}
+        if isinstance(data, list):
+            return [self.scrub(v, key) for v in data]
+        if isinstance(data, str):
+            if key in _FILENAME_KEYS:
+                stem, dot, extension = data.rpartition(".")
+                if stem:
+                    return self.pseudonym(stem) + dot + extension
+            return self.pseudonym(data) if key in PII_KEYS else scrub_url(data)
+        return data
+
+
+class _TeeResponse:
+    """A media response that keeps what's read from it, for the recorder."""
+
+    def __init__(self, response, keep_body: bool):
+        self._response = response
+        self.status = response.status
+        self.size = 0
+        self.body: bytearray | None = bytearray() if keep_body else None
+
+    def getheader(self, name: str, default=None):
+        return self._response.getheader(name, default)
+
+    def _keep(self, data):
+        self.size += len(data)
+        if self.body is not None:
+            self.body += data
+
+    def read(self, amt: int | None = None) -> bytes:
+        data = self._response.read(amt)
+        self._keep(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        n = self._response.readinto(buffer)
+        self._keep(memoryview(buffer)[:n])
+        return n
+
+
+class CassetteRecorder:
+    """Records the API responses of a session, and optionally media, into a
+    cassette: a gzipped JSON lines file, written as the session goes.
+
+    Personal data is scrubbed from the responses (see `Scrubber`). Media
+    responses are recorded with their status, headers and size; their bodies
+    only with `media_bodies`."""
+
+    def __init__(self, path: Path, media_bodies: bool = False):
+        self.path = path
+        self.media_bodies = media_bodies
+        self._scrubber = Scrubber()
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._write(
+            {
+                "version": CASSETTE_VERSION,
+                "recorded_at": datetime.now(timezone.utc).isoformat(),
+                "media_bodies": media_bodies,
+            }
+        )
+
+    def _write(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def record_api(
+        self,
+        key: str,
+        endpoint: str,
+        status: int | None,
+        data,
+        size: int,
+        elapsed: float,
+        error: str | None = None,
+    ):
+        """Record an API response; for a failed one `data` is None, and
+        `error` the start of the response body, without access tokens."""
+        entry = {
+            "kind": "api",
+            "key": key,
+            "endpoint": endpoint,
+            "status": status,
+            "elapsed": round(elapsed, 4),
+            "size": size,
+            "data": self._scrubber.scrub(data) if status == 200 else None,
+        }
+        if error:
+            entry["error"] = scrub_url(error[:_ERROR_BODY_LENGTH])
+        self._write(entry)
+
+    def record_media_error(self, url: str, status: int | None, elapsed: float):
+        self._write(
+            {
+                "kind": "media",
+                "key": scrub_url(url),
+                "status": status,
+                "elapsed": round(elapsed, 4),
+            }
+        )
+
+    @contextmanager
+    def media(self, url: str, response, started: float):
+        """Wrap an open media response, and record it once it's been read."""
+        tee = _TeeResponse(response, self.media_bodies)
+        yield tee
+        entry = {
+            "kind": "media",
+            "key": scrub_url(url),
+            "status": tee.status,
+            "elapsed": round(time.monotonic() - started, 4),
+            "headers": {
+                name: value
+                for name in _MEDIA_HEADERS
+                if (value := response.getheader(name)) is not None
+            },
+            "size": tee.size,
+        }
+        if tee.body is not None:
+            entry["body"] = base64.b64encode(tee.body).decode("ascii")
+        self._write(entry)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class _ReplayedResponse:
+    """A media response served from a cassette."""
+
+    def __init__(self, entry: dict):
+        self.status = entry["status"]
+        self._headers = {k.lower(): v for k, v in entry.get("headers", {}).items()}
+        size = entry.get("size", 0)
+        body = entry.get("body")
+        # Without the recorded body, zeros of the recorded size
+        self._body = base64.b64decode(body) if body is not None else bytes(size)
+        self._offset = 0
+
+    def getheader(self, name: str, default=None):
+        return self._headers.get(name.lower(), default)
+
+    def read(self, amt: int | None = None) -> bytes:
+        end = len(self._body) if amt is None else self._offset + amt
+        data = self._body[self._offset : end]
+        self._offset += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class CassettePlayer:
+    """Serves the requests of a session from a cassette instead of Famly.
+
+    Responses to the same request are served in the order they were
+    recorded, the last one again once they run out. A request that wasn't
+    recorded as such gets the next recorded response of the same endpoint,
+    e.g. a feed window laid out from the current time. With the "original"
+    timing each request takes as long as it did when recorded."""
+
+    def __init__(self, path: Path, timing: str = "original"):
+        if timing not in TIMINGS:
+            raise ValueError(f"Unknown timing {timing!r}, expected one of {TIMINGS}")
+        self.path = path
+        self.timing = timing
+        self._lock = threading.Lock()
+        self._responses: dict[str, deque] = {}
+        self._endpoints: dict[str, deque] = {}
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"{path} isn't a cassette this version can replay")
+            for line in f:
+                entry = json.loads(line)
+                self._responses.setdefault(entry["key"], deque()).append(entry)
+                if entry["kind"] == "api":
+                    endpoint = self._endpoints.setdefault(entry["endpoint"], deque())
+                    endpoint.append(entry)
+
+    def _next(self, key: str, endpoint: str | None = None) -> dict | None:
+        with self._lock:
+            queue = self._responses.get(key)
+            if queue:
+                return queue.popleft() if len(queue) > 1 else queue[0]
+            queue = self._endpoints.get(endpoint) if endpoint else None
+            if queue:
+                queue.rotate(-1)
+                return queue[-1]
+        return None
+
+    def _wait(self, entry: dict):
+        if self.timing == "original":
+            time.sleep(entry.get("elapsed", 0))
+
+    def _raise_for(self, entry: dict, url: str):
+        status = entry["status"]
+        if status is None:
+            raise TransientError(f"Replayed failure of {url}", url)
+        if status != 200:
+            message = f"HTTP {status} from {url}: {entry.get('error') or ''}"
+            raise error_for_status(status, message.rstrip(": ") + " (replayed)", url)
+
+    def play_api(self, key: str, endpoint: str):
+        """Returns the recorded data and response size of an API request."""
+        entry = self._next(key, endpoint)
+        if entry is None:
+            raise PermanentError(f"{key} isn't in the cassette {self.path}")
+        self._wait(entry)
+        self._raise_for(entry, key)
+        return entry["data"], entry["size"]
+
+    def media_size(self, url: str) -> int | None:
+        """The recorded size of a media download, without using it up."""
+        with self._lock:
+            queue = self._responses.get(scrub_url(url))
+            return queue[-1].get("size") if queue else None
+
+    def open_media(self, url: str) -> _ReplayedResponse:
+        entry = self._next(scrub_url(url))
+        if entry is None:
+            raise PermanentError(f"{url} isn't in the cassette {self.path}", url, 404)
+        self._wait(entry)
+        self._raise_for(entry, url)
+        return _ReplayedResponse(entry)
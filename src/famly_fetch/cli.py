@@ -1,9 +1,25 @@
+import signal
+import sys
 from importlib.metadata import PackageNotFoundError, version
 from pathlib import Path
 
 import click
 
+from famly_fetch.archive import ARCHIVE_FORMATS
+from famly_fetch.batch import load_accounts, run_accounts
+from famly_fetch.budget import Budget, parse_duration
+from famly_fetch.cassette import TIMINGS, CassettePlayer, CassetteRecorder
+from famly_fetch.date_range import DateRange
 from famly_fetch.downloader import FamlyDownloader
+from famly_fetch.hooks import Hook, HookPipeline
+from famly_fetch.layout import LAYOUTS, FileLayout
+from famly_fetch.plan import make_plan, print_plan, write_manifest
+from famly_fetch.reindex import reindex as reindex_downloads
+from famly_fetch.retry import Retrier, RetryPolicy
+from famly_fetch.storage import S3Storage
+from famly_fetch.transfer import RateLimiter, RateSchedule, parse_rate, parse_size
+from famly_fetch.verify import verify as verify_downloads
+from famly_fetch.watcher import PollTask, Watcher
 
 
 def get_version():
@@ -13,6 +29,54 @@ def get_version():
         return "unknown"
 
 
+def make_rate_limiter(
+    max_rate: str | None, rate_schedule: str | None
+) -> RateLimiter | None:
+    if not max_rate and not rate_schedule:
+        return None
+    try:
+        default = parse_rate(max_rate) if max_rate else None
+        return RateLimiter(RateSchedule.parse(rate_schedule or "", default))
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--max-rate/--rate-schedule")
+
+
+def make_budget(max_runtime: str | None, max_bytes: str | None) -> Budget | None:
+    if not max_runtime and not max_bytes:
+        return None
+    try:
+        return Budget(
+            max_runtime=parse_duration(max_runtime) if max_runtime else None,
+            max_bytes=parse_size(max_bytes) if max_bytes else None,
+        )
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--max-runtime/--max-bytes")
+
+
+def make_hooks(
+    hook_specs: tuple[str, ...], batch_size: int, workers: int
+) -> HookPipeline | None:
+    if not hook_specs:
+        return None
+    try:
+        hooks = [Hook.parse(spec, batch_size) for spec in hook_specs]
+    except (ValueError, ImportError, AttributeError) as e:
+        raise click.BadParameter(str(e), param_hint="--hook")
+    return HookPipeline(hooks, workers=workers)
+
+
+def make_date_range(since: str | None, until: str | None) -> DateRange:
+    try:
+        date_range = DateRange.parse(since, until)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--since/--until")
+    if date_range.since and date_range.until and date_range.since >= date_range.until:
+        raise click.BadParameter(
+            "--since must be before --until", param_hint="--since/--until"
+        )
+    return date_range
+
+
 @click.command()
 @click.option(
     "--email",
@@ -72,6 +136,26 @@ def get_version():
     is_flag=True,
     help="Also download videos from learning journey observations and feed posts",
 )
+@click.option(
+    "--since",
+    help="Only download items created on or after this date, e.g. 2024-05-01 (or 2024-05-01T08:00)",
+    metavar="DATE",
+    type=str,
+)
+@click.option(
+    "--until",
+    help="Only download items created on or before this date, e.g. 2024-05-31 (or up to a time, 2024-05-31T18:00)",
+    metavar="DATE",
+    type=str,
+)
+@click.option(
+    "--child",
+    "children",
+    multiple=True,
+    help="Only download the tagged images, notes and learning journey of this child, by first name or id. Can be given several times",
+    metavar="NAME",
+    type=str,
+)
 @click.option(
     "-p",
     "--pictures-folder",
@@ -104,6 +188,56 @@ def get_version():
     show_default=True,
     type=str,
 )
+@click.option(
+    "--max-dimension",
+    envvar="FAMLY_MAX_DIMENSION",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Download images scaled down to at most this many pixels wide or high, instead of full size originals. Can be set via FAMLY_MAX_DIMENSION env var",
+    metavar="PIXELS",
+)
+@click.option(
+    "--upgrade-capped",
+    is_flag=True,
+    help="Download again images that were downloaded with a smaller --max-dimension than the current one (or with any, when --max-dimension isn't given)",
+)
+@click.option(
+    "--postprocess-workers",
+    envvar="FAMLY_POSTPROCESS_WORKERS",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Write EXIF data and sidecar files in this many worker processes, overlapping with the downloads (0 writes them on the download thread). Can be set via FAMLY_POSTPROCESS_WORKERS env var",
+    metavar="N",
+)
+@click.option(
+    "--hook",
+    "hook_specs",
+    multiple=True,
+    help="Command to run on downloaded files while the download goes on, with their paths as arguments and their details as JSON lines on stdin; or python:module:function to call a function with the files. Can be given several times",
+    metavar="COMMAND",
+)
+@click.option(
+    "--hook-batch-size",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of files to hand to a hook at a time",
+    metavar="N",
+)
+@click.option(
+    "--hook-workers",
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+    help="Number of hook calls run at the same time",
+    metavar="N",
+)
+@click.option(
+    "--sidecar-metadata",
+    is_flag=True,
+    help="Write a <image>.json file with the id, date, text and size next to each downloaded image",
+)
 @click.option(
     "--latitude",
     envvar="LATITUDE",
@@ -133,6 +267,78 @@ def get_version():
     metavar="PATTERN",
     type=str,
 )
+@click.option(
+    "--layout",
+    envvar="FAMLY_LAYOUT",
+    type=click.Choice(list(LAYOUTS)),
+    default="date",
+    show_default=True,
+    help="Folder layout below the pictures folder: date (2024-01-15), year-month (2024/01), year-month-day (2024/01/15) or sharded (hash based, e.g. 3f/a2). Can be set via FAMLY_LAYOUT env var",
+)
+@click.option(
+    "--archive",
+    envvar="FAMLY_ARCHIVE",
+    type=str,
+    default=None,
+    help="Write the downloads into archive files named after FILE (e.g. famly.tar becomes famly-0001.tar, a new one per run) instead of single files, or as a tar stream to stdout with '-'. Can be set via FAMLY_ARCHIVE env var",
+    metavar="FILE",
+)
+@click.option(
+    "--archive-format",
+    type=click.Choice(ARCHIVE_FORMATS),
+    default="tar",
+    show_default=True,
+    help="Archive format used with --archive",
+)
+@click.option(
+    "--archive-volume-size",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Start a new archive file once the current one holds this many megabytes",
+    metavar="MB",
+)
+@click.option(
+    "--s3",
+    "s3_url",
+    envvar="FAMLY_S3_URL",
+    type=str,
+    default=None,
+    help="Upload the downloads (or the --archive files) to an S3 compatible bucket instead of the pictures folder, given as s3://bucket/prefix. Can be set via FAMLY_S3_URL env var",
+    metavar="URL",
+)
+@click.option(
+    "--s3-endpoint-url",
+    envvar="FAMLY_S3_ENDPOINT_URL",
+    default="https://s3.amazonaws.com",
+    show_default=True,
+    help="S3 server to upload to, e.g. a MinIO instance. Can be set via FAMLY_S3_ENDPOINT_URL env var",
+    metavar="URL",
+    type=str,
+)
+@click.option(
+    "--s3-region",
+    envvar="AWS_REGION",
+    default="us-east-1",
+    show_default=True,
+    help="Region of the S3 bucket, can be set via AWS_REGION env var",
+    metavar="REGION",
+    type=str,
+)
+@click.option(
+    "--s3-access-key",
+    envvar="AWS_ACCESS_KEY_ID",
+    help="S3 access key id, can be set via AWS_ACCESS_KEY_ID env var",
+    metavar="KEY",
+    type=str,
+)
+@click.option(
+    "--s3-secret-key",
+    envvar="AWS_SECRET_ACCESS_KEY",
+    help="S3 secret access key, can be set via AWS_SECRET_ACCESS_KEY env var",
+    metavar="KEY",
+    hide_input=True,
+    type=str,
+)
 @click.option(
     "--state-file",
     envvar="FAMLY_STATE_FILE",
@@ -148,6 +354,228 @@ def get_version():
     help="Path to state file for tracking downloaded images, can be set via FAMLY_STATE_FILE env var",
     metavar="FILE",
 )
+@click.option(
+    "--verify",
+    is_flag=True,
+    help="Check instead of downloading that every file in the state exists and is complete, and remove the ones that aren't from the state so the next run downloads them again. Uses --filename-pattern to recognise the files",
+)
+@click.option(
+    "--verify-hash",
+    is_flag=True,
+    help="With --verify, also hash the files and report files whose contents changed since the last --verify-hash",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="With --verify, remove the items without a complete file from the state even when most of them look missing, which usually means a wrong --filename-pattern or --layout",
+)
+@click.option(
+    "--reindex",
+    is_flag=True,
+    help="Rebuild the state file from the files in the pictures folder instead of downloading, e.g. after losing it. Uses --filename-pattern to recognise the files",
+)
+@click.option(
+    "--retry-failed",
+    is_flag=True,
+    help="Retry only the items that failed to download in earlier runs, without crawling Famly again. They're kept in state.failed.json next to the state file",
+)
+@click.option(
+    "--plan",
+    is_flag=True,
+    help="Count the items and bytes a run would download, per source and per child, and estimate how long it takes, without downloading anything",
+)
+@click.option(
+    "--plan-sizes",
+    is_flag=True,
+    help="With --plan, get the size of every item with a HEAD request",
+)
+@click.option(
+    "--plan-workers",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="Number of HEAD requests sent at a time with --plan-sizes",
+)
+@click.option(
+    "--plan-manifest",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    default=None,
+    help="With --plan, also write the totals and the items to download to this JSON file",
+    metavar="FILE",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Keep running and poll for new images instead of exiting after one pass",
+)
+@click.option(
+    "--poll-interval",
+    envvar="FAMLY_POLL_INTERVAL",
+    type=click.FloatRange(min=1),
+    default=900,
+    show_default=True,
+    help="Seconds between polls of the per-child sources in watch mode, can be set via FAMLY_POLL_INTERVAL env var",
+    metavar="SECONDS",
+)
+@click.option(
+    "--feed-poll-interval",
+    type=click.FloatRange(min=1),
+    default=None,
+    show_default="--poll-interval",
+    help="Seconds between polls of the feed in watch mode",
+    metavar="SECONDS",
+)
+@click.option(
+    "--messages-poll-interval",
+    type=click.FloatRange(min=1),
+    default=None,
+    show_default="--poll-interval",
+    help="Seconds between polls of the conversations in watch mode",
+    metavar="SECONDS",
+)
+@click.option(
+    "--poll-jitter",
+    type=click.FloatRange(min=0, max=1),
+    default=0.1,
+    show_default=True,
+    help="Random jitter applied to the poll intervals, as a fraction of the interval",
+    metavar="FRACTION",
+)
+@click.option(
+    "--state-flush-interval",
+    type=click.FloatRange(min=1),
+    default=60,
+    show_default=True,
+    help="Seconds between saving the state file in watch mode",
+    metavar="SECONDS",
+)
+@click.option(
+    "--max-rate",
+    envvar="FAMLY_MAX_RATE",
+    type=str,
+    default=None,
+    help="Limit the combined download speed, in bytes per second (e.g. 500K or 2M). Can be set via FAMLY_MAX_RATE env var",
+    metavar="RATE",
+)
+@click.option(
+    "--rate-schedule",
+    envvar="FAMLY_RATE_SCHEDULE",
+    type=str,
+    default=None,
+    help="Download speed limits by time of day, overriding --max-rate within their windows, e.g. '08:00-18:00=200K,22:00-06:00=unlimited'. Can be set via FAMLY_RATE_SCHEDULE env var",
+    metavar="SCHEDULE",
+)
+@click.option(
+    "--max-runtime",
+    envvar="FAMLY_MAX_RUNTIME",
+    type=str,
+    default=None,
+    help="Stop gracefully after this long (e.g. 45m or 2h), downloading the newest items of all sources first. The next run continues from there. Can be set via FAMLY_MAX_RUNTIME env var",
+    metavar="DURATION",
+)
+@click.option(
+    "--max-bytes",
+    envvar="FAMLY_MAX_BYTES",
+    type=str,
+    default=None,
+    help="Stop gracefully after downloading this much (e.g. 500M or 2G), downloading the newest items of all sources first. Can be set via FAMLY_MAX_BYTES env var",
+    metavar="SIZE",
+)
+@click.option(
+    "--record",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    default=None,
+    help="Record the API responses of this run, with personal data scrubbed, into a cassette file to replay later",
+    metavar="FILE",
+)
+@click.option(
+    "--record-media-bodies",
+    is_flag=True,
+    help="With --record, also record the contents of the downloaded media, not just their sizes and headers",
+)
+@click.option(
+    "--replay",
+    type=click.Path(dir_okay=False, exists=True, path_type=Path),
+    default=None,
+    help="Replay a cassette recorded with --record instead of talking to Famly",
+    metavar="FILE",
+)
+@click.option(
+    "--replay-timing",
+    type=click.Choice(TIMINGS),
+    default="original",
+    show_default=True,
+    help="With --replay, take as long as each request took when recorded, or go as fast as possible",
+)
+@click.option(
+    "--accounts-config",
+    envvar="FAMLY_ACCOUNTS_CONFIG",
+    type=click.Path(
+        file_okay=True,
+        dir_okay=False,
+        exists=True,
+        resolve_path=True,
+        path_type=Path,
+    ),
+    default=None,
+    help="JSON file describing several accounts to download concurrently. The account, source and folder options are then taken from the file. Can be set via FAMLY_ACCOUNTS_CONFIG env var",
+    metavar="FILE",
+)
+@click.option(
+    "--max-workers",
+    type=click.IntRange(min=1),
+    default=None,
+    show_default="4",
+    help="Maximum number of sources downloaded at the same time across all accounts (with --accounts-config)",
+    metavar="N",
+)
+@click.option(
+    "--max-retries",
+    envvar="FAMLY_MAX_RETRIES",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Attempts per request before giving up on transient errors (timeouts, connection resets, 429 and 5xx responses), can be set via FAMLY_MAX_RETRIES env var",
+    metavar="N",
+)
+@click.option(
+    "--feed-page-size",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="Number of feed posts to request per page (starting value with --adaptive-page-size)",
+    metavar="N",
+)
+@click.option(
+    "--page-size",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="Number of notes and learning journey entries to request per page (starting value with --adaptive-page-size)",
+    metavar="N",
+)
+@click.option(
+    "--adaptive-page-size/--fixed-page-size",
+    default=True,
+    show_default=True,
+    help="Grow page sizes while the server responds quickly and shrink them on slow responses and errors",
+)
+@click.option(
+    "--feed-crawl-workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Crawl the feed in date windows with this many concurrent requests",
+    metavar="N",
+)
+@click.option(
+    "--feed-window-days",
+    type=click.IntRange(min=1),
+    default=30,
+    show_default=True,
+    help="Size of the date windows used with --feed-crawl-workers",
+    metavar="DAYS",
+)
 @click.version_option()
 def main(
     email: str,
@@ -162,20 +590,204 @@ def main(
     feed: bool,
     include_files: bool,
     include_videos: bool,
+    since: str | None,
+    until: str | None,
+    children: tuple[str, ...],
     pictures_folder: Path,
     stop_on_existing: bool,
     user_agent: str,
+    max_dimension: int | None,
+    upgrade_capped: bool,
+    postprocess_workers: int,
+    hook_specs: tuple[str, ...],
+    hook_batch_size: int,
+    hook_workers: int,
+    sidecar_metadata: bool,
     latitude: float,
     longitude: float,
     text_comments: bool,
     filename_pattern: str,
+    layout: str,
+    archive: str | None,
+    archive_format: str,
+    archive_volume_size: int | None,
+    s3_url: str | None,
+    s3_endpoint_url: str,
+    s3_region: str,
+    s3_access_key: str | None,
+    s3_secret_key: str | None,
     state_file: Path,
+    verify: bool,
+    verify_hash: bool,
+    force: bool,
+    reindex: bool,
+    retry_failed: bool,
+    plan: bool,
+    plan_sizes: bool,
+    plan_workers: int,
+    plan_manifest: Path | None,
+    watch: bool,
+    poll_interval: float,
+    feed_poll_interval: float | None,
+    messages_poll_interval: float | None,
+    poll_jitter: float,
+    state_flush_interval: float,
+    max_rate: str | None,
+    rate_schedule: str | None,
+    max_runtime: str | None,
+    max_bytes: str | None,
+    record: Path | None,
+    record_media_bodies: bool,
+    replay: Path | None,
+    replay_timing: str,
+    accounts_config: Path | None,
+    max_workers: int | None,
+    max_retries: int,
+    feed_page_size: int,
+    page_size: int,
+    adaptive_page_size: bool,
+    feed_crawl_workers: int,
+    feed_window_days: int,
 ):
     """Fetch kids' images from famly.co"""
 
+    budget = make_budget(max_runtime, max_bytes)
+    date_range = make_date_range(since, until)
+    if budget is not None:
+        if watch:
+            raise click.BadParameter(
+                "A budget can't be combined with --watch",
+                param_hint="--max-runtime/--max-bytes",
+            )
+        # A scheduler stopping the run gets the same graceful stop
+        signal.signal(signal.SIGTERM, lambda *_: budget.stop("received SIGTERM"))
+
+    if plan and (watch or accounts_config is not None):
+        raise click.BadParameter(
+            "Runs are planned for a single account, without --watch",
+            param_hint="--plan",
+        )
+    if retry_failed and (watch or accounts_config is not None):
+        raise click.BadParameter(
+            "Failed items are retried for a single account, without --watch",
+            param_hint="--retry-failed",
+        )
+
+    if watch and accounts_config is not None:
+        raise click.BadParameter(
+            "Only a single account can be watched", param_hint="--watch"
+        )
+    if (record or replay) and accounts_config is not None:
+        raise click.BadParameter(
+            "Sessions are recorded and replayed for a single account",
+            param_hint="--record/--replay",
+        )
+    if record and replay:
+        raise click.BadParameter(
+            "A run can't record and replay at once", param_hint="--record/--replay"
+        )
+
+    if accounts_config is not None:
+        if children:
+            raise click.BadParameter(
+                "Children are selected for a single account", param_hint="--child"
+            )
+        accounts, settings = load_accounts(accounts_config)
+        hooks = make_hooks(hook_specs, hook_batch_size, hook_workers)
+        try:
+            run_accounts(
+                accounts,
+                max_workers=max_workers or settings.get("max_workers") or 4,
+                user_agent=user_agent,
+                postprocess_workers=postprocess_workers
+                or settings.get("postprocess_workers", 0),
+                rate_limiter=make_rate_limiter(
+                    max_rate or settings.get("max_rate"),
+                    rate_schedule or settings.get("rate_schedule"),
+                ),
+                budget=budget,
+                date_range=date_range,
+                hooks=hooks,
+            )
+        finally:
+            if hooks is not None:
+                hooks.close()
+        return
+
     if state_file is None:
         state_file = pictures_folder / "state.json"
 
+    if reindex:
+        if s3_url:
+            raise click.BadParameter(
+                "Only the pictures folder can be reindexed", param_hint="--reindex"
+            )
+        reindex_downloads(
+            pictures_folder,
+            state_file,
+            FileLayout(pictures_folder, filename_pattern, layout, create_dirs=False),
+        )
+        return
+
+    if verify:
+        if archive or s3_url:
+            raise click.BadParameter(
+                "Only downloads in the pictures folder can be verified",
+                param_hint="--verify",
+            )
+        if not state_file.exists():
+            click.secho(f"No state file at {state_file}, nothing to verify.", fg="red")
+            return
+        verify_downloads(
+            pictures_folder,
+            state_file,
+            FileLayout(pictures_folder, filename_pattern, layout, create_dirs=False),
+            hash_files=verify_hash,
+            force=force,
+        )
+        return
+
+    if archive == "-":
+        if archive_format != "tar":
+            raise click.BadParameter(
+                "Only tar archives can be written to stdout", param_hint="--archive"
+            )
+        # stdout carries the archive, so all output goes to stderr instead
+        sys.stdout = sys.stderr
+
+    rate_limiter = make_rate_limiter(max_rate, rate_schedule)
+
+    storage = None
+    if s3_url:
+        if not s3_access_key or not s3_secret_key:
+            raise click.BadParameter(
+                "S3 uploads need --s3-access-key and --s3-secret-key",
+                param_hint="--s3",
+            )
+        try:
+            storage = S3Storage.from_url(
+                s3_url,
+                access_key=s3_access_key,
+                secret_key=s3_secret_key,
+                endpoint_url=s3_endpoint_url,
+                region=s3_region,
+                retrier=Retrier(RetryPolicy(max_attempts=max_retries)),
+            )
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--s3")
+
+    hooks = make_hooks(hook_specs, hook_batch_size, hook_workers)
+    cassette = None
+    if replay:
+        try:
+            cassette = CassettePlayer(replay, replay_timing)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--replay")
+        # The recorded session was already logged in
+        access_token = access_token or "replay"
+    elif record:
+        cassette = CassetteRecorder(record, media_bodies=record_media_bodies)
+
     # Validate authentication parameters
     if not access_token and (not email or not password):
         if not email:
@@ -205,34 +817,201 @@ def main(
             latitude=latitude,
             longitude=longitude,
             filename_pattern=filename_pattern,
+            layout=layout,
+            archive=archive,
+            archive_format=archive_format,
+            archive_volume_size=archive_volume_size * 1_000_000
+            if archive_volume_size
+            else None,
+            storage=storage,
+            rate_limiter=rate_limiter,
+            budget=budget,
+            date_range=date_range,
+            cassette=cassette,
+            hooks=hooks,
+            children=children,
+            max_dimension=max_dimension,
+            upgrade_capped=upgrade_capped,
+            postprocess_workers=postprocess_workers,
+            sidecar_metadata=sidecar_metadata,
             include_files=include_files,
             include_videos=include_videos,
+            max_retries=max_retries,
+            feed_page_size=feed_page_size,
+            page_size=page_size,
+            adaptive_page_size=adaptive_page_size,
+            feed_crawl_workers=feed_crawl_workers,
+            feed_window_days=feed_window_days,
         )
 
-        if messages:
-            famly_downloader.download_images_from_messages()
+        if retry_failed:
+            try:
+                famly_downloader.retry_failed()
+            finally:
+                famly_downloader.close()
+            famly_downloader.print_stats()
+            if famly_downloader.failed:
+                click.secho(
+                    f"{len(famly_downloader.failed)} item(s) still fail, see "
+                    f"{famly_downloader.failed_state_file}.",
+                    fg="yellow",
+                )
+            return
 
-        # Process each child
+        children = famly_downloader.get_all_children()
         parent_ids = set()
-        for child_id, first_name in famly_downloader.get_all_children():
+        for child_id, _first_name in children:
             parent_ids |= famly_downloader.get_parents_ids(child_id)
-            if not no_tagged:
-                famly_downloader.download_tagged_images(child_id, first_name)
-            if journey:
-                famly_downloader.download_images_from_learning_journey(
-                    child_id, first_name
+
+        def run_source(download, *args) -> bool:
+            """Run one source. One failing source shouldn't abort the others,
+            so the error is reported and False returned."""
+            try:
+                download(*args)
+            except Exception as e:
+                click.secho(f"An exception occurred: {e}", fg="red")
+                return False
+            return True
+
+        def download_from_children() -> bool:
+            ok = True
+            for child_id, first_name in children:
+                if not no_tagged:
+                    ok &= run_source(
+                        famly_downloader.download_tagged_images, child_id, first_name
+                    )
+                if journey:
+                    ok &= run_source(
+                        famly_downloader.download_images_from_learning_journey,
+                        child_id,
+                        first_name,
+                    )
+                if notes:
+                    ok &= run_source(
+                        famly_downloader.download_images_from_notes,
+                        child_id,
+                        first_name,
+                    )
+            return ok
+
+        def download_from_feed() -> bool:
+            if not (liked or feed):
+                return True
+            # One walk of the feed serves both
+            return run_source(
+                famly_downloader.download_feed,
+                parent_ids if liked else None,
+                feed,
+            )
+
+        def media_sources():
+            sources = {}
+            if messages:
+                sources["messages"] = famly_downloader.iter_messages(
+                    files=include_files, newest_first=True
+                )
+            for child_id, first_name in children:
+                if not no_tagged:
+                    sources[f"tagged images of {first_name}"] = (
+                        famly_downloader.iter_tagged(
+                            child_id, first_name, newest_first=True
+                        )
+                    )
+                if journey:
+                    sources[f"learning journey of {first_name}"] = (
+                        famly_downloader.iter_journey(
+                            child_id,
+                            first_name,
+                            files=include_files,
+                            videos=include_videos,
+                            newest_first=True,
+                        )
+                    )
+                if notes:
+                    sources[f"notes of {first_name}"] = famly_downloader.iter_notes(
+                        child_id, first_name, files=include_files, newest_first=True
+                    )
+            if liked or feed:
+                sources["feed"] = famly_downloader.iter_feed(
+                    parent_ids if liked and not feed else None,
+                    files=include_files,
+                    videos=include_videos,
+                )
+            return sources
+
+        if plan:
+            rate = rate_limiter.rate if rate_limiter is not None else None
+            try:
+                download_plan = make_plan(
+                    famly_downloader,
+                    media_sources(),
+                    dict(children),
+                    sizes=plan_sizes,
+                    workers=plan_workers,
                 )
-            if notes:
-                famly_downloader.download_images_from_notes(child_id, first_name)
+            finally:
+                famly_downloader.close()
+            print_plan(download_plan, rate)
+            if plan_manifest:
+                write_manifest(download_plan, plan_manifest, rate)
+            return
 
-        if liked:
-            famly_downloader.download_images_from_feed(parent_ids)
+        if not watch:
+            try:
+                if budget is not None:
+                    famly_downloader.download_newest_first(media_sources())
+                else:
+                    if messages:
+                        run_source(famly_downloader.download_images_from_messages)
+                    download_from_children()
+                    download_from_feed()
+            finally:
+                famly_downloader.close()
+            famly_downloader.print_stats()
+            if famly_downloader.failed_items:
+                click.secho(
+                    f"{famly_downloader.failed_items} item(s) failed to download, "
+                    "run again or use --retry-failed to retry them.",
+                    fg="yellow",
+                )
+            return
+
+        tasks = []
+        if messages:
+            tasks.append(
+                PollTask(
+                    "messages",
+                    messages_poll_interval or poll_interval,
+                    famly_downloader.download_images_from_messages,
+                    incremental=False,
+                )
+            )
+        if not no_tagged or journey or notes:
+            tasks.append(PollTask("children", poll_interval, download_from_children))
+        if liked or feed:
+            tasks.append(
+                PollTask(
+                    "feed", feed_poll_interval or poll_interval, download_from_feed
+                )
+            )
+        if not tasks:
+            click.secho("Nothing to watch, no sources enabled.", fg="yellow")
+            return
 
-        if feed:
-            famly_downloader.download_all_images_from_feed()
+        Watcher(
+            famly_downloader,
+            tasks,
+            jitter=poll_jitter,
+            flush_interval=state_flush_interval,
+        ).run()
 
     except Exception as e:
         click.secho(f"An exception occurred: {e}", fg="red")
+    finally:
+        if hooks is not None:
+            hooks.close()
+        if isinstance(cassette, CassetteRecorder):
+            cassette.close()
 
 
 if __name__ == "__main__":
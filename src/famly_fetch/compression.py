@@ -0,0 +1,90 @@
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional, installed with the "brotli" extra
+    brotli = None
+
+# Content encodings we can decode, most preferred first
+ACCEPT_ENCODING = ", ".join((["br"] if brotli else []) + ["gzip", "deflate"])
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class _Inflater:
+    """zlib decompression that also copes with raw deflate streams, which
+    some servers send as Content-Encoding: deflate."""
+
+    def __init__(self, wbits: int):
+        self._wbits = wbits
+        self._d = zlib.decompressobj(wbits)
+        self._started = False
+
+    def decompress(self, chunk: bytes) -> bytes:
+        if self._started:
+            return self._d.decompress(chunk)
+        self._started = True
+        try:
+            return self._d.decompress(chunk)
+        except zlib.error:
+            if self._wbits != zlib.MAX_WBITS:
+                raise
+            self._d = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._d.decompress(chunk)
+
+    def flush(self) -> bytes:
+        return self._d.flush()
+
+
+class _Unbrotli:
+    def __init__(self):
+        self._d = brotli.Decompressor()
+
+    def decompress(self, chunk: bytes) -> bytes:
+        return self._d.process(chunk)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _decoder(encoding: str):
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return _Inflater(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return _Inflater(zlib.MAX_WBITS)
+    if encoding == "br" and brotli is not None:
+        return _Unbrotli()
+    raise ValueError(f"Unsupported Content-Encoding {encoding!r}")
+
+
+def read_body(response) -> tuple[bytearray, int, float]:
+    """Read a (possibly compressed) HTTP response body.
+
+    The body is decompressed chunk by chunk while it is read, so the
+    compressed and the decoded body are never both held in full, and the
+    body is returned as the buffer it was read into rather than copied.
+
+    Returns:
+        tuple: The decoded body, the number of bytes received, and the seconds
+        spent decompressing.
+    """
+    encoding = (response.getheader("Content-Encoding") or "").strip().lower()
+    decoder = _decoder(encoding)
+
+    body = bytearray()
+    wire_bytes = 0
+    decode_seconds = 0.0
+    while chunk := response.read(READ_CHUNK_SIZE):
+        wire_bytes += len(chunk)
+        if decoder is None:
+            body += chunk
+            continue
+        start = time.perf_counter()
+        body += decoder.decompress(chunk)
+        decode_seconds += time.perf_counter() - start
+    if decoder is not None:
+        body += decoder.flush()
+    return body, wire_bytes, decode_seconds
@@ -0,0 +1,118 @@
+import http.client
+import io
+import threading
+import urllib.error
+import urllib.parse
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """A small pool of keep-alive HTTP(S) connections.
+
+    `urllib.request.urlopen` opens (and TLS-handshakes) a new connection for
+    every request. The pool keeps idle connections around per (scheme, host,
+    port) so consecutive API calls reuse them. One pool can be shared between
+    several ApiClient instances and threads.
+    """
+
+    def __init__(self, max_idle_per_host: int = 4, timeout: float = 60):
+        self._max_idle_per_host = max_idle_per_host
+        self._timeout = timeout
+        self._idle: dict[tuple[str, str, int | None], list] = {}
+        self._lock = threading.Lock()
+
+    def _new_connection(self, scheme: str, host: str, port: int | None):
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self._timeout)
+        return http.client.HTTPConnection(host, port, timeout=self._timeout)
+
+    def _checkout(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(*key), False
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self._max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    @contextmanager
+    def urlopen(
+        self,
+        method: str,
+        url: str,
+        body: bytes | None = None,
+        headers: dict[str, str] | None = None,
+    ):
+        """Perform a request and yield the `http.client.HTTPResponse`.
+
+        Mirrors `urllib.request.urlopen`: a status of 400 or above raises
+        `urllib.error.HTTPError`, with the body read so it can still be read
+        from the error. The connection is returned to the pool when
+        the response has been read completely, and closed otherwise.
+
+        Raises:
+            urllib.error.HTTPError: If the server couldn't fulfill the request.
+        """
+        parsed = urllib.parse.urlsplit(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        target = parsed.path or "/"
+        if parsed.query:
+            target += "?" + parsed.query
+
+        conn, reused = self._checkout(key)
+        try:
+            conn.request(method, target, body=body, headers=headers or {})
+            resp = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection, retry once
+            conn = self._new_connection(*key)
+            try:
+                conn.request(method, target, body=body, headers=headers or {})
+                resp = conn.getresponse()
+            except BaseException:
+                conn.close()
+                raise
+        except BaseException:
+            conn.close()
+            raise
+
+        if resp.status >= 400:
+            try:
+                error_body = resp.read()
+            except (http.client.HTTPException, OSError):
+                error_body = b""
+            if resp.isclosed() and not resp.will_close:
+                self._checkin(key, conn)
+            else:
+                conn.close()
+            raise urllib.error.HTTPError(
+                url, resp.status, resp.reason, resp.msg, io.BytesIO(error_body)
+            )
+
+        try:
+            yield resp
+        except BaseException:
+            conn.close()
+            raise
+
+        if resp.isclosed() and not resp.will_close:
+            self._checkin(key, conn)
+        else:
+            conn.close()
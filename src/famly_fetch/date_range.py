@@ -0,0 +1,58 @@
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+
+
+def aware(value: datetime) -> datetime:
+    """`value` with a timezone; Famly dates without one are in UTC."""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def parse_date(value: str, end_of_day: bool = False) -> datetime:
+    """Parse a date ("2024-05-01") or date and time ("2024-05-01T08:00").
+
+    Without a timezone it's taken as local time. A date alone is its start, or
+    with `end_of_day` the start of the next day, so it's included as a whole.
+    """
+    try:
+        if len(value.strip()) == 10:
+            day = date.fromisoformat(value.strip())
+            if end_of_day:
+                day += timedelta(days=1)
+            parsed = datetime.combine(day, time())
+        else:
+            parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}, expected e.g. 2024-05-01")
+    return parsed if parsed.tzinfo else parsed.astimezone()
+
+
+@dataclass(frozen=True)
+class DateRange:
+    """The items a run is limited to: created at or after `since`, and
+    before `until`. Either end may be open."""
+
+    since: datetime | None = None
+    until: datetime | None = None
+
+    @staticmethod
+    def parse(since: str | None, until: str | None) -> "DateRange":
+        return DateRange(
+            since=parse_date(since) if since else None,
+            until=parse_date(until, end_of_day=True) if until else None,
+        )
+
+    def __bool__(self) -> bool:
+        return self.since is not None or self.until is not None
+
+    def __contains__(self, value: object) -> bool:
+        if not isinstance(value, datetime):
+            return False
+        return not self.is_before(value) and not self.is_after(value)
+
+    def is_before(self, value: datetime) -> bool:
+        """Check if `value` is older than the range, so a source that goes
+        from new to old can stop there."""
+        return self.since is not None and aware(value) < self.since
+
+    def is_after(self, value: datetime) -> bool:
+        return self.until is not None and aware(value) >= self.until
@@ -9,24 +9,104 @@ Auth has two versions:
 
 """
 
+import heapq
+import io
 import json
-import os
-import shutil
+import threading
 import time
+import urllib.error
 import urllib.request
-from datetime import datetime, timezone
+from collections import deque
+from collections.abc import Callable, Collection, Iterable, Iterator
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from functools import partial
 from pathlib import Path
-from urllib.parse import urlparse
 
 import click
-import piexif
-import piexif.helper
 
 from famly_fetch.api_client import ApiClient
+from famly_fetch.archive import ArchiveStorage, ArchiveWriter
+from famly_fetch.budget import Budget
+from famly_fetch.cassette import CassettePlayer, CassetteRecorder
+from famly_fetch.connection_pool import ConnectionPool
+from famly_fetch.date_range import DateRange, aware
+from famly_fetch.exif import add_exif, add_exif_to_bytes, write_sidecar
+from famly_fetch.failed import FailedItems
 from famly_fetch.file import File
+from famly_fetch.hooks import DownloadedFile, HookPipeline
+from famly_fetch.id_index import IdIndex
 from famly_fetch.image import BaseImage, Image, SecretImage
+from famly_fetch.layout import FileLayout
+from famly_fetch.media import MediaItem
+from famly_fetch.paging import AdaptivePageSize
+from famly_fetch.postprocess import PostProcessor
+from famly_fetch.retry import (
+    ApiError,
+    PermanentError,
+    RequestTimeout,
+    Retrier,
+    RetryPolicy,
+)
+from famly_fetch.storage import LocalStorage, Storage
+from famly_fetch.transfer import RateLimiter, copy_stream
 from famly_fetch.video import Video
 
+# Seconds to wait for a media server before retrying
+MEDIA_TIMEOUT = 60
+
+# Upper bounds for adaptive page sizes
+FEED_MAX_PAGE_SIZE = 100
+GRAPHQL_MAX_PAGE_SIZE = 500
+
+# Signed URLs closer than this to their expiry are refreshed before use
+SIGNED_URL_MARGIN = timedelta(seconds=60)
+
+# Seconds to wait before each tagged image, to avoid 400 errors
+TAGGED_PAUSE = 1
+
+# Seconds between saves of the state while downloading
+CHECKPOINT_INTERVAL = 10
+
+# Handles one feed post, returns True when it wants no more posts
+FeedConsumer = Callable[[dict], bool]
+
+
+def _feed_item_date(feed_item: dict) -> datetime:
+    return aware(datetime.fromisoformat(feed_item["createdDate"]))
+
+
+def _content_length(response) -> int | None:
+    """The announced size of a (not content encoded) media response."""
+    if response.getheader("Content-Encoding"):
+        return None
+    try:
+        return int(response.getheader("Content-Length") or "") or None
+    except ValueError:
+        return None
+
+
+def _with_fresh_secret(
+    img: SecretImage, fresh: dict[str, dict] | None
+) -> SecretImage | None:
+    """Return `img` with the signed URL from a re-queried page, if it's there."""
+    if fresh is None or img.img_id not in fresh:
+        return None
+    secret = fresh[img.img_id]
+    return replace(
+        img,
+        prefix=secret["prefix"],
+        key=secret["key"],
+        path=secret["path"],
+        expires=secret["expires"],
+    )
+
+
+def _newest_first(items: list[MediaItem]) -> list[MediaItem]:
+    return sorted(items, key=lambda item: aware(item.date), reverse=True)
+
 
 class FamlyDownloader:
     def __init__(
@@ -45,6 +125,29 @@ class FamlyDownloader:
         filename_pattern: str = "%FP-%Y-%m-%d_%H-%M-%S-%ID",
         include_files: bool = False,
         include_videos: bool = False,
+        pool: ConnectionPool | None = None,
+        max_retries: int = 5,
+        feed_page_size: int = 10,
+        page_size: int = 100,
+        adaptive_page_size: bool = True,
+        feed_crawl_workers: int = 1,
+        feed_window_days: int = 30,
+        layout: str = "date",
+        max_dimension: int | None = None,
+        upgrade_capped: bool = False,
+        postprocess_workers: int = 0,
+        sidecar_metadata: bool = False,
+        postprocessor: PostProcessor | None = None,
+        archive: str | None = None,
+        archive_format: str = "tar",
+        archive_volume_size: int | None = None,
+        storage: Storage | None = None,
+        rate_limiter: RateLimiter | None = None,
+        budget: Budget | None = None,
+        date_range: DateRange | None = None,
+        children: Collection[str] | None = None,
+        cassette: CassetteRecorder | CassettePlayer | None = None,
+        hooks: HookPipeline | None = None,
     ):
         self._pictures_folder: Path = pictures_folder
         self._pictures_folder.mkdir(parents=True, exist_ok=True)
@@ -55,28 +158,215 @@ class FamlyDownloader:
         self.text_comments = text_comments
         self.filename_pattern = filename_pattern
         self.state_file = state_file
+        # Paths below the pictures folder are the storage keys. An archive is
+        # written to the storage backend given, if any.
+        if archive:
+            self._storage: Storage = ArchiveStorage(
+                ArchiveWriter(
+                    archive,
+                    self.archive_index_file,
+                    archive_format,
+                    archive_volume_size,
+                    storage=storage,
+                )
+            )
+        else:
+            self._storage = storage or LocalStorage(pictures_folder)
+        self._layout = FileLayout(
+            pictures_folder,
+            filename_pattern,
+            layout,
+            create_dirs=isinstance(self._storage, LocalStorage),
+        )
         self.include_files = include_files
         self.include_videos = include_videos
+        self.feed_crawl_workers = feed_crawl_workers
+        self.feed_window_days = feed_window_days
         self.downloaded_images = self.load_state()
-
+        self.max_dimension = max_dimension
+        self.sidecar_metadata = sidecar_metadata
+        # Shared between downloaders, so they draw from one bandwidth budget
+        self._rate_limiter = rate_limiter
+        # Shared between downloaders too, a run stops once it's used up
+        self.budget = budget
+        # Only items created in this range are downloaded
+        self.date_range = date_range or DateRange()
+        # Ids or first names of the children to download for, all if empty
+        self.children = {c.lower() for c in children or ()}
+        # A post-processor passed in is shared, and closed by its owner
+        self._owns_postprocessor = postprocessor is None
+        self._postprocessor = postprocessor or PostProcessor(postprocess_workers)
+        # Downloaded files are handed to the hooks, closed by their owner
+        self._hooks = hooks
+        self.upgrade_capped = upgrade_capped
+        # Image id -> the max dimension it was downloaded with
+        self.capped_images = self.load_capped_state()
+        # Items that failed, to retry with `retry_failed`
+        self.failed = FailedItems(self.failed_state_file)
+        self._state_dirty = False
+        self._state_lock = threading.Lock()
+        self._last_save = time.monotonic()
+        # Last seen activity per conversation, lets repeated polls skip
+        # conversations that haven't changed
+        self._conversation_activity: dict[str, str] = {}
+        # Activity of conversations walked through, with the ids of the items
+        # in them; it's only taken as seen once all of them are downloaded
+        self._pending_activity: dict[str, tuple[str, list[str]]] = {}
+
+        self.failed_items = 0
+        self._page_sizes = {
+            "feed": AdaptivePageSize(
+                feed_page_size,
+                maximum=FEED_MAX_PAGE_SIZE,
+                adaptive=adaptive_page_size,
+            ),
+            "notes": AdaptivePageSize(
+                page_size,
+                maximum=GRAPHQL_MAX_PAGE_SIZE,
+                adaptive=adaptive_page_size,
+            ),
+            "journey": AdaptivePageSize(
+                page_size,
+                maximum=GRAPHQL_MAX_PAGE_SIZE,
+                adaptive=adaptive_page_size,
+            ),
+        }
+        # Shared by API and media requests, so both back off from a failing host
+        if isinstance(cassette, CassettePlayer) and cassette.timing == "fast":
+            # Replayed failures don't need time to go away
+            self._retrier = Retrier(
+                RetryPolicy(max_attempts=max_retries, base_delay=0, max_delay=0),
+                reset_timeout=0,
+            )
+        else:
+            self._retrier = Retrier(RetryPolicy(max_attempts=max_retries))
+        # Records the session, or replays a recorded one instead of Famly
+        self._cassette = cassette
         self._apiClient = ApiClient(
-            base_url=famly_base_url, user_agent=user_agent, access_token=access_token
+            base_url=famly_base_url,
+            user_agent=user_agent,
+            access_token=access_token,
+            pool=pool,
+            retrier=self._retrier,
+            cassette=cassette,
         )
         if not access_token:
             self._apiClient.login(email, password)
 
-    def load_state(self):
-        if self.state_file.exists():
-            with open(self.state_file, "r") as f:
+    def load_state(self) -> IdIndex:
+        return IdIndex(self.state_file)
+
+    @property
+    def capped_state_file(self) -> Path:
+        """Sidecar to the state file, with the images downloaded at a capped size."""
+        return self.state_file.with_suffix(".capped.json")
+
+    @property
+    def failed_state_file(self) -> Path:
+        """Sidecar to the state file, with the items that failed to download."""
+        return self.state_file.with_suffix(".failed.json")
+
+    @property
+    def archive_index_file(self) -> Path:
+        """Sidecar to the state file, listing which archive holds each item."""
+        return self.state_file.with_suffix(".archive.jsonl")
+
+    def load_capped_state(self) -> dict[str, int]:
+        if self.capped_state_file.exists():
+            with open(self.capped_state_file, "r") as f:
                 return json.load(f)
         return {}
 
     def save_state(self):
-        with open(self.state_file, "w") as f:
-            json.dump(self.downloaded_images, f)
+        # Several sources may run concurrently against the same state
+        with self._state_lock:
+            self.downloaded_images.save()
+            if self.capped_images or self.capped_state_file.exists():
+                with open(self.capped_state_file, "w") as f:
+                    json.dump(self.capped_images, f)
+            self.failed.save()
+            self._state_dirty = False
+            self._last_save = time.monotonic()
+
+    def _checkpoint(self):
+        """Save the state now and then while downloading, so a run that is
+        killed loses little."""
+        if time.monotonic() - self._last_save >= CHECKPOINT_INTERVAL:
+            self.flush_state()
+
+    def _out_of_budget(self) -> bool:
+        return self.budget is not None and self.budget.exhausted()
+
+    def flush_state(self):
+        """Save the state if anything has been downloaded since the last save."""
+        if self._state_dirty:
+            self.save_state()
+
+    def end_poll(self):
+        """Forget what only matters within one poll of --watch."""
+        self._layout.clear_claims()
+
+    def close(self):
+        """Finish pending post-processing and storage, and save the state."""
+        if self._owns_postprocessor:
+            self._postprocessor.close()
+        self._storage.close()
+        self.flush_state()
+
+    def _already_downloaded(self, img: BaseImage) -> bool:
+        """Check if an image is downloaded, at a size we're happy with.
+
+        With `upgrade_capped`, an image downloaded at a smaller size than the
+        current `max_dimension` allows (or than the original, without a cap)
+        counts as not downloaded, so it gets fetched again."""
+        if img.img_id not in self.downloaded_images:
+            return False
+        capped_at = self.capped_images.get(img.img_id)
+        if not self.upgrade_capped or capped_at is None:
+            return True
+        if self.max_dimension and capped_at >= self.max_dimension:
+            return True
+        if max(img.width, img.height) <= capped_at:
+            return True
+        click.secho(
+            f"Image {img.img_id} was downloaded at max {capped_at}px, upgrading.",
+            fg="cyan",
+        )
+        return False
 
     def mark_as_downloaded(self, img_id: str):
-        self.downloaded_images[img_id] = datetime.now(timezone.utc).isoformat()
+        with self._state_lock:
+            self.downloaded_images.add(img_id)
+            self._state_dirty = True
+
+    def _fetch_and_mark(
+        self, item: MediaItem, fetch: Callable[[], bool | None]
+    ) -> bool:
+        """Run one media fetch and mark the item as downloaded.
+
+        A failing item is reported and skipped rather than aborting the whole
+        source. It isn't marked, so the next run tries it again, and it's
+        recorded in `failed` for `retry_failed`. A fetch that returns True has
+        left its item to the post-processor, which marks it once it's done."""
+        try:
+            pending = fetch()
+        except Exception as e:
+            self._item_failed(item, e)
+            return False
+        if not pending:
+            self._item_done(item)
+        return True
+
+    def _item_done(self, item: MediaItem):
+        self.mark_as_downloaded(item.item_id)
+        self.failed.discard(item.item_id)
+
+    def _item_failed(self, item: MediaItem, error: BaseException):
+        click.secho(f"Failed to download {item.item_id}, skipping: {error}", fg="red")
+        with self._state_lock:
+            self.failed_items += 1
+            self.failed.record(item, error)
+            self._state_dirty = True
 
     def get_all_children(self):
         my_info = self._apiClient.me_me_me()
@@ -95,400 +385,946 @@ class FamlyDownloader:
         for child in prev_children:
             all_children.append((child["childId"], child["name"]["firstName"]))
 
+        if self.children:
+            all_children = [
+                (child_id, first_name)
+                for child_id, first_name in all_children
+                if child_id.lower() in self.children
+                or first_name.lower() in self.children
+            ]
+            if not all_children:
+                click.secho("No children match --child.", fg="yellow")
+
         return all_children
 
+    def _in_date_range(self, date: str) -> bool:
+        return datetime.fromisoformat(date) in self.date_range
+
+    def _past_date_range(self, dates: list[str]) -> bool:
+        """Check if a page sorted newest first has reached items older than
+        the date range, so the pages after it can be skipped."""
+        return bool(dates) and self.date_range.is_before(
+            datetime.fromisoformat(dates[-1])
+        )
+
     def get_parents_ids(self, child_id: str) -> set[str]:
         relations = self._apiClient.get_relations(child_id)
         return {x["loginId"] for x in relations if x["loginId"]}
 
-    def download_images_from_notes(self, child_id, first_name):
-        click.secho(
-            f"Downloading learning journey images for {first_name}...", fg="green"
-        )
+    def iter_notes(
+        self,
+        child_id: str,
+        first_name: str,
+        files: bool = True,
+        newest_first: bool = False,
+    ) -> Iterator[MediaItem]:
+        """Yield the images (and files) attached to a child's notes, page by
+        page as they are fetched.
+
+        The images of a page come in order of expiry of their signed URLs, or
+        with `newest_first` the items of a page come newest first; the images
+        can be refreshed through `MediaItem.refresh`."""
         next_ref = None
 
         while True:
-            click.echo("Fetching next 100 notes")
-            batch = self._apiClient.get_child_notes(
-                child_id, cursor=next_ref, first=100
+            page_ref = next_ref
+            batch, page_size = self._fetch_page(
+                "notes",
+                "notes",
+                lambda first: self._apiClient.get_child_notes(
+                    child_id, cursor=page_ref, first=first
+                ),
+                lambda page: len(page["result"]),
             )
             click.echo(f"{len(batch['result'])} fetched.")
 
-            for _i, note in enumerate(batch["result"]):
-                text = note["text"] + " - " + note["createdBy"]["name"]["fullName"]
-                date = note["createdAt"]
-
-                for img_dict in note["images"]:
-                    img = SecretImage.from_dict(
-                        img_dict,
-                        date_override=date,
-                        text_override=text if self.text_comments else None,
-                    )
-                    click.echo(f" - image {img.img_id} from note at {img.date}")
+            entries = [
+                (
+                    note,
+                    note["text"] + " - " + note["createdBy"]["name"]["fullName"],
+                    note["createdAt"],
+                )
+                for note in batch["result"]
+            ]
+            past_range = self._past_date_range([date for _, _, date in entries])
+            entries = [entry for entry in entries if self._in_date_range(entry[2])]
+
+            page_items = self._secret_image_items(
+                [(note["images"], text, date) for note, text, date in entries],
+                filename_prefix=f"{first_name}-note",
+                source="note",
+                child_id=child_id,
+                refetch_page=lambda cursor=page_ref, first=page_size: (
+                    self._apiClient.get_child_notes(
+                        child_id, cursor=cursor, first=first
+                    )["result"]
+                ),
+            )
 
-                    file_path = self.download_file_path(img, f"{first_name}-note")
-                    if img.img_id in self.downloaded_images:
-                        click.secho(
-                            f"Image {img.img_id} already downloaded, {'stopping download' if self.stop_on_existing else 'skipping'}.",
-                            fg="yellow",
+            if files:
+                for note, text, date in entries:
+                    page_items.extend(
+                        self._file_items(
+                            note.get("files") or [],
+                            date=date,
+                            text=text,
+                            filename_prefix=f"{first_name}-note",
+                            source="note",
                         )
-                        if self.stop_on_existing:
-                            return
-                        else:
-                            continue
-                    self.fetch_image(img, file_path)
-                    self.mark_as_downloaded(img.img_id)
-
-                if self.include_files:
-                    if self._download_files_from_item(
-                        note.get("files") or [],
-                        date=date,
-                        text=text,
-                        filename_prefix=f"{first_name}-note",
-                    ):
-                        return
+                    )
+            yield from _newest_first(page_items) if newest_first else page_items
 
             next_ref = batch["next"]
 
-            if not next_ref:
+            if not next_ref or past_range:
                 break
 
-        self.save_state()
-
-    def download_images_from_learning_journey(self, child_id, first_name):
+    def download_images_from_notes(self, child_id, first_name):
         click.secho(
             f"Downloading learning journey images for {first_name}...", fg="green"
         )
+        self.download(self.iter_notes(child_id, first_name, files=self.include_files))
 
+    def iter_journey(
+        self,
+        child_id: str,
+        first_name: str,
+        files: bool = True,
+        videos: bool = True,
+        newest_first: bool = False,
+    ) -> Iterator[MediaItem]:
+        """Yield the images, files and videos of a child's learning journey,
+        page by page as they are fetched. Items come as in `iter_notes`."""
         next_cursor = None
 
         while True:
-            click.echo("Fetching next 100 learning journey entries")
-            batch = self._apiClient.learning_journey_query(
-                child_id, cursor=next_cursor, first=100
+            page_cursor = next_cursor
+            batch, page_size = self._fetch_page(
+                "journey",
+                "learning journey entries",
+                lambda first: self._apiClient.learning_journey_query(
+                    child_id, cursor=page_cursor, first=first
+                ),
+                lambda page: len(page["results"]),
             )
             click.echo(f"{len(batch['results'])} fetched.")
 
-            for _i, observation in enumerate(batch["results"]):
-                text = (
+            entries = [
+                (
+                    observation,
                     observation["remark"]["body"]
                     + " - "
-                    + observation["createdBy"]["name"]["fullName"]
+                    + observation["createdBy"]["name"]["fullName"],
+                    observation["status"]["createdAt"],
                 )
-                date = observation["status"]["createdAt"]
+                for observation in batch["results"]
+            ]
+            past_range = self._past_date_range([date for _, _, date in entries])
+            entries = [entry for entry in entries if self._in_date_range(entry[2])]
+
+            page_items = self._secret_image_items(
+                [(obs["images"], text, date) for obs, text, date in entries],
+                filename_prefix=f"{first_name}-journey",
+                source="observation",
+                child_id=child_id,
+                refetch_page=lambda cursor=page_cursor, first=page_size: (
+                    self._apiClient.learning_journey_query(
+                        child_id, cursor=cursor, first=first
+                    )["results"]
+                ),
+            )
 
-                for img_dict in observation["images"]:
-                    img = SecretImage.from_dict(
-                        img_dict,
-                        date_override=date,
-                        text_override=text if self.text_comments else None,
+            for observation, text, date in entries:
+                if files:
+                    page_items.extend(
+                        self._file_items(
+                            observation.get("files") or [],
+                            date=date,
+                            text=text,
+                            filename_prefix=f"{first_name}-journey",
+                            source="observation",
+                        )
                     )
-                    click.echo(f" - image {img.img_id} from observation at {img.date}")
-
-                    file_path = self.download_file_path(img, f"{first_name}-journey")
-                    if img.img_id in self.downloaded_images:
-                        click.secho(
-                            f"Image {img.img_id} already downloaded, {'stopping download' if self.stop_on_existing else 'skipping'}.",
-                            fg="yellow",
+                if videos:
+                    page_items.extend(
+                        self._video_items(
+                            observation.get("videos") or [],
+                            date=date,
+                            text=text,
+                            filename_prefix=f"{first_name}-journey",
+                            source="observation",
                         )
-                        if self.stop_on_existing:
-                            return
-                        else:
-                            continue
-                    self.fetch_image(img, file_path)
-                    self.mark_as_downloaded(img.img_id)
-
-                if self.include_files:
-                    if self._download_files_from_item(
-                        observation.get("files") or [],
-                        date=date,
-                        text=text,
-                        filename_prefix=f"{first_name}-journey",
-                    ):
-                        return
-
-                if self.include_videos:
-                    if self._download_videos_from_item(
-                        observation.get("videos") or [],
-                        date=date,
-                        text=text,
-                        filename_prefix=f"{first_name}-journey",
-                    ):
-                        return
+                    )
+            yield from _newest_first(page_items) if newest_first else page_items
 
             next_cursor = batch["next"]
 
-            if not next_cursor:
+            if not next_cursor or past_range:
                 break
 
-        self.save_state()
-
-    def download_tagged_images(self, child_id, first_name):
-        """Download images by childId"""
-        click.secho(f"Downloading tagged images for {first_name}...", fg="green")
+    def download_images_from_learning_journey(self, child_id, first_name):
+        click.secho(
+            f"Downloading learning journey images for {first_name}...", fg="green"
+        )
+        self.download(
+            self.iter_journey(
+                child_id,
+                first_name,
+                files=self.include_files,
+                videos=self.include_videos,
+            )
+        )
 
+    def _secret_image_items(
+        self,
+        images: list[tuple[list[dict], str, str]],
+        filename_prefix: str,
+        source: str,
+        child_id: str,
+        refetch_page,
+    ) -> list[MediaItem]:
+        """The signed images of one notes/journey page, in order of expiry.
+
+        `images` holds the image dicts, text and date of each entry. An image
+        whose URL has expired (or is about to) when its turn comes gets a
+        fresh URL by re-querying the page it came from through
+        `refetch_page`, which must return the page's entries. The page is
+        re-queried at most once per expiry round."""
+        fresh: dict[str, dict] | None = None
+
+        def refresh(img: SecretImage) -> SecretImage | None:
+            nonlocal fresh
+            refreshed = _with_fresh_secret(img, fresh)
+            if refreshed is None or refreshed.is_expired(SIGNED_URL_MARGIN):
+                click.echo("Signed image URLs expired, refreshing page")
+                fresh = {
+                    img_dict["id"]: img_dict["secret"]
+                    for entry in refetch_page()
+                    for img_dict in entry["images"]
+                }
+                refreshed = _with_fresh_secret(img, fresh)
+            return refreshed
+
+        imgs = [
+            SecretImage.from_dict(
+                img_dict,
+                date_override=date,
+                text_override=text if self.text_comments else None,
+            )
+            for img_dicts, text, date in images
+            for img_dict in img_dicts
+        ]
+        far_future = datetime.max.replace(tzinfo=timezone.utc)
+        imgs.sort(key=lambda img: img.expires_at or far_future)
+        return [
+            MediaItem(img, source, filename_prefix, child_id, refresh) for img in imgs
+        ]
+
+    def iter_tagged(
+        self, child_id: str, first_name: str, newest_first: bool = False
+    ) -> Iterator[MediaItem]:
+        """Yield the images a child is tagged in, as listed by Famly or, with
+        `newest_first`, newest first."""
         imgs = self._apiClient.make_api_request(
             "GET", "/api/v2/images/tagged", params={"childId": child_id}
         )
 
         click.echo(f"Fetching {len(imgs)} tagged images for {first_name}")
 
-        for img_no, img_dict in enumerate(imgs, start=1):
-            img = Image.from_dict(img_dict)
-            click.echo(f" - image {img.img_id} at {img.date} ({img_no}/{len(imgs)})")
-
-            file_path = self.download_file_path(img, first_name)
-            if img.img_id in self.downloaded_images:
-                click.secho(
-                    f"Image {img.img_id} already downloaded, {'stopping download' if self.stop_on_existing else 'skipping'}.",
-                    fg="yellow",
-                )
-                if self.stop_on_existing:
-                    return
-                else:
-                    continue
-
-            # sleep for 1s to avoid 400 errors
-            time.sleep(1)
-            self.fetch_image(img, file_path)
-            self.mark_as_downloaded(img.img_id)
-
-        self.save_state()
+        items = [
+            MediaItem(img, "tagged", first_name, child_id)
+            for img in map(Image.from_dict, imgs)
+            if img.date in self.date_range
+        ]
+        yield from _newest_first(items) if newest_first else items
 
-    def download_images_from_messages(self):
-        click.secho("Downloading images from messages...", fg="green")
+    def download_tagged_images(self, child_id, first_name):
+        """Download images by childId"""
+        click.secho(f"Downloading tagged images for {first_name}...", fg="green")
+        self.download(self.iter_tagged(child_id, first_name), pause=TAGGED_PAUSE)
+
+    def iter_messages(
+        self, files: bool = True, newest_first: bool = False
+    ) -> Iterator[MediaItem]:
+        """Yield the images (and files) in all conversations, oldest first
+        or, with `newest_first`, newest first.
+
+        Conversations without activity since they were last walked through
+        to the end, by an earlier call, are skipped, unless some of their
+        items weren't downloaded."""
+        self._settle_conversation_activity()
+        items = self._conversation_items(files, newest_first)
+        if newest_first:
+            # Conversations are listed by activity and their messages overlap
+            # in time, so all of them are taken before sorting
+            yield from _newest_first(list(items))
+        else:
+            yield from items
 
+    def _conversation_items(
+        self, files: bool, newest_first: bool
+    ) -> Iterator[MediaItem]:
         conv_ids = self._apiClient.make_api_request("GET", "/api/v2/conversations")
         click.echo(f"Found {len(conv_ids)} conversations")
 
-        for conv_id in reversed(conv_ids):
+        order = (lambda items: items) if newest_first else reversed
+        for conv_id in order(conv_ids):
+            last_activity = conv_id.get("lastActivityAt")
+            seen_activity = self._conversation_activity.get(conv_id["conversationId"])
+            if last_activity and last_activity == seen_activity:
+                continue
+            # Nothing new enough in it, no need to fetch it
+            if last_activity and self.date_range.is_before(
+                datetime.fromisoformat(last_activity)
+            ):
+                continue
+
             conversation = self._apiClient.make_api_request(
                 "GET", "/api/v2/conversations/%s" % (conv_id["conversationId"])
             )
-            for msg in reversed(conversation["messages"]):
+            item_ids = []
+            for msg in order(conversation["messages"]):
                 text = msg["body"] + " - " + msg["author"]["title"]
                 date = msg["createdAt"]
+                if not self._in_date_range(date):
+                    continue
                 for img_dict in msg["images"]:
                     img = Image.from_dict(
                         img_dict,
                         date_override=date,
                         text_override=text if self.text_comments else None,
                     )
+                    item_ids.append(img.img_id)
+                    yield MediaItem(img, "message", "message")
 
-                    click.echo(f" - image {img.img_id} from message at {img.date}")
-
-                    file_path = self.download_file_path(img, "message")
-
-                    if img.img_id in self.downloaded_images:
-                        click.secho(
-                            f"Image {img.img_id} already downloaded, {'stopping download' if self.stop_on_existing else 'skipping'}.",
-                            fg="yellow",
-                        )
-                        if self.stop_on_existing:
-                            return
-                        else:
-                            continue
-                    self.fetch_image(img, file_path)
-                    self.mark_as_downloaded(img.img_id)
-
-                if self.include_files:
-                    if self._download_files_from_item(
+                if files:
+                    for item in self._file_items(
                         msg.get("files") or [],
                         date=date,
                         text=text,
                         filename_prefix="message",
+                        source="message",
                     ):
-                        return
-        self.save_state()
+                        item_ids.append(item.item_id)
+                        yield item
 
-    def download_images_from_feed(self, liked_by_ids: set[str]):
-        click.secho("Downloading liked images in posts...", fg="green")
+            if last_activity:
+                self._pending_activity[conv_id["conversationId"]] = (
+                    last_activity,
+                    item_ids,
+                )
 
-        cursor = None
-        older_than = None
-        while True:
-            click.echo("Fetching next 10 Posts")
-            response = self._apiClient.feed(
-                cursor=cursor, older_than=older_than, limit=10
+    def _settle_conversation_activity(self):
+        """Take the activity of the conversations walked through as seen if
+        all their items were downloaded in the meantime. Done at the start of
+        the next walk, so post-processing that was still running then has
+        marked its items."""
+        for conv_id, (last_activity, item_ids) in self._pending_activity.items():
+            if all(item_id in self.downloaded_images for item_id in item_ids):
+                self._conversation_activity[conv_id] = last_activity
+        self._pending_activity.clear()
+
+    def download_images_from_messages(self):
+        click.secho("Downloading images from messages...", fg="green")
+        self.download(self.iter_messages(files=self.include_files))
+
+    def is_downloaded(self, item: MediaItem) -> bool:
+        """Check if an item is downloaded (at a size we're happy with)."""
+        if isinstance(item.media, BaseImage):
+            return self._already_downloaded(item.media)
+        return item.item_id in self.downloaded_images
+
+    def _is_downloaded(self, item: MediaItem) -> bool:
+        """Check if an item is downloaded, and report it if so."""
+        click.echo(f" - {item.kind} {item.item_id} ({item.source}) at {item.date}")
+        downloaded = self.is_downloaded(item)
+        if downloaded:
+            click.secho(
+                f"{item.kind.capitalize()} {item.item_id} already downloaded, "
+                f"{'stopping download' if self.stop_on_existing else 'skipping'}.",
+                fg="yellow",
             )
-            if not response["feedItems"]:
+        return downloaded
+
+    def fetch_item(self, item: MediaItem) -> bool:
+        """Download one item, whether or not it was downloaded before, and
+        mark it as downloaded.
+
+        Returns:
+            bool: Whether it was downloaded; failures are reported.
+        """
+        media = item.media
+        if isinstance(media, SecretImage) and media.is_expired(SIGNED_URL_MARGIN):
+            refreshed = item.refresh(media) if item.refresh else None
+            if refreshed is None:
+                click.secho(
+                    f"Image {item.item_id} is gone after refreshing, skipping.",
+                    fg="yellow",
+                )
+                self.failed.discard(item.item_id)
+                return False
+            media = refreshed
+
+        if isinstance(media, BaseImage):
+            file_path = self.download_file_path(media, item.filename_prefix)
+            fetch = partial(self.fetch_image, media, file_path, item=item)
+        else:
+            file_path = self.attachment_path(
+                attachment_id=item.item_id,
+                attachment_url=media.url,
+                date=media.date,
+                filename_prefix=item.filename_prefix,
+                original_name=media.name if isinstance(media, File) else None,
+            )
+            fetch = partial(
+                self.fetch_binary, media.url, file_path, item.item_id, item=item
+            )
+        return self._fetch_and_mark(item, fetch)
+
+    def download(self, items: Iterable[MediaItem], pause: float = 0) -> int:
+        """Download the items not downloaded yet, e.g. from the `iter_*`
+        methods; with `stop_on_existing`, up to the first one that was.
+
+        Items are taken one at a time, so a lazy iterable is only advanced as
+        far as needed. `pause` seconds are slept before each download. Stops
+        early once the budget is used up.
+
+        Returns:
+            int: The number of items downloaded.
+        """
+        downloaded = 0
+        for item in items:
+            if self._out_of_budget():
                 break
-            last_item = response["feedItems"][-1]
-            cursor = last_item["feedItemId"]
-            older_than = last_item["createdDate"]
-            for feed_item in response["feedItems"]:
-                if not feed_item["originatorId"].startswith("Post:"):
-                    # not a Post item
-                    continue
-                create_date = feed_item["createdDate"]
-                for img_dict in feed_item["images"]:
-                    if not (
-                        img_dict["liked"]
-                        or [
-                            like
-                            for like in img_dict["likes"]
-                            if like["loginId"] in liked_by_ids
-                        ]
-                    ):
-                        # not liked by parents
-                        continue
-                    img = Image.from_dict(
-                        img_dict,
-                        date_override=create_date,
-                        text_override=feed_item["body"] if self.text_comments else None,
-                    )
-                    click.echo(f" - image {img.img_id} from post at {create_date}")
+            if self._is_downloaded(item):
+                if self.stop_on_existing:
+                    break
+                continue
+            if pause:
+                time.sleep(pause)
+            if self.fetch_item(item):
+                downloaded += 1
+            self._checkpoint()
+        self.save_state()
+        return downloaded
 
-                    if img.img_id in self.downloaded_images:
-                        click.secho(
-                            f"Image {img.img_id} already downloaded, {'stopping download' if self.stop_on_existing else 'skipping'}.",
-                            fg="yellow",
-                        )
-                        if self.stop_on_existing:
-                            return
-                        else:
-                            continue
-                    file_path = self.download_file_path(img, "post")
-                    self.fetch_image(img, file_path)
-                    self.mark_as_downloaded(img.img_id)
-
-                feed_text = feed_item.get("body") if self.text_comments else None
-                if self.include_files:
-                    if self._download_files_from_item(
-                        feed_item.get("files") or [],
-                        date=create_date,
-                        text=feed_text,
-                        filename_prefix="post",
-                    ):
-                        return
-                if self.include_videos:
-                    if self._download_videos_from_item(
-                        feed_item.get("videos") or [],
-                        date=create_date,
-                        text=feed_text,
-                        filename_prefix="post",
-                    ):
-                        return
+    def _until_existing(
+        self, name: str, items: Iterable[MediaItem]
+    ) -> Iterator[MediaItem]:
+        """The items not downloaded yet; with `stop_on_existing`, up to the
+        first one that was. A failing source ends, without the others."""
+        try:
+            for item in items:
+                if not self._is_downloaded(item):
+                    yield item
+                elif self.stop_on_existing:
+                    click.secho(f"Done with {name}.", fg="yellow")
+                    return
+        except Exception as e:
+            click.secho(f"An exception occurred in {name}: {e}", fg="red")
+
+    def download_newest_first(self, sources: dict[str, Iterable[MediaItem]]) -> int:
+        """Download from several sources at once, newest items first.
+
+        Each source must yield its items newest first, like the `iter_*`
+        methods (`iter_messages`, `iter_tagged`, `iter_notes` and
+        `iter_journey` with `newest_first`); they are merged by date, so when
+        the budget runs out the newest items of all sources have been
+        downloaded. `stop_on_existing` applies to each source on its
+        own.
+
+        Returns:
+            int: The number of items downloaded.
+        """
+
+        merged = heapq.merge(
+            *(self._until_existing(name, items) for name, items in sources.items()),
+            key=lambda item: aware(item.date),
+            reverse=True,
+        )
+        downloaded = 0
+        # The same item may be in several sources, e.g. tagged and in the feed
+        handled: set[str] = set()
+        for item in merged:
+            if self._out_of_budget():
+                break
+            if item.item_id in handled:
+                continue
+            handled.add(item.item_id)
+            if item.source == "tagged":
+                time.sleep(TAGGED_PAUSE)
+            if self.fetch_item(item):
+                downloaded += 1
+            self._checkpoint()
+        self.save_state()
+        return downloaded
+
+    def retry_failed(self) -> int:
+        """Download only the items that failed before, see `failed`.
+
+        Nothing is crawled: the items are taken from the failed items file.
+        Signed image URLs that have expired since are refreshed by paging
+        through the notes or learning journey of the child they're from, up
+        to where the last of them is found.
+
+        Returns:
+            int: The number of items downloaded.
+        """
+        items = self.failed.items()
+        if not items:
+            click.secho("No failed items to retry.", fg="green")
+            return 0
+        click.secho(f"Retrying {len(items)} failed item(s)...", fg="green")
+
+        wanted: dict[tuple[str, str], set[str]] = {}
+        for item in items:
+            if isinstance(item.media, SecretImage) and item.child_id:
+                wanted.setdefault((item.source, item.child_id), set()).add(item.item_id)
+        refreshers = {
+            key: self._failed_refresher(*key, ids) for key, ids in wanted.items()
+        }
 
+        downloaded = 0
+        for item in items:
+            if self._out_of_budget():
+                break
+            if item.item_id in self.downloaded_images:
+                self.failed.discard(item.item_id)
+                continue
+            click.echo(f" - {item.kind} {item.item_id} ({item.source}) at {item.date}")
+            item.refresh = refreshers.get((item.source, item.child_id))
+            if self.fetch_item(item):
+                downloaded += 1
+            self._checkpoint()
         self.save_state()
+        return downloaded
+
+    def _failed_refresher(
+        self, source: str, child_id: str, wanted: set[str]
+    ) -> Callable[[SecretImage], SecretImage | None]:
+        """A `MediaItem.refresh` for failed images of one child and source,
+        which looks up the fresh URLs of all of them on first use."""
+        fresh: dict[str, dict] | None = None
+
+        def refresh(img: SecretImage) -> SecretImage | None:
+            nonlocal fresh
+            if fresh is None:
+                click.echo("Signed image URLs expired, looking them up again")
+                fresh = self._fresh_secrets(source, child_id, wanted)
+            return _with_fresh_secret(img, fresh)
+
+        return refresh
+
+    def _fresh_secrets(
+        self, source: str, child_id: str, wanted: set[str]
+    ) -> dict[str, dict]:
+        """Page through a child's notes ("note") or learning journey
+        ("observation") until the signed URLs of all `wanted` images are found.
+
+        Returns:
+            dict: Image id -> secret, for the images that are still there.
+        """
+        fresh: dict[str, dict] = {}
+        next_cursor = None
+        while True:
+            page_cursor = next_cursor
+            if source == "note":
+                batch, _ = self._fetch_page(
+                    "notes",
+                    "notes",
+                    lambda first: self._apiClient.get_child_notes(
+                        child_id, cursor=page_cursor, first=first
+                    ),
+                    lambda page: len(page["result"]),
+                )
+                entries = batch["result"]
+            else:
+                batch, _ = self._fetch_page(
+                    "journey",
+                    "learning journey entries",
+                    lambda first: self._apiClient.learning_journey_query(
+                        child_id, cursor=page_cursor, first=first
+                    ),
+                    lambda page: len(page["results"]),
+                )
+                entries = batch["results"]
+            for entry in entries:
+                for img_dict in entry["images"]:
+                    if img_dict["id"] in wanted:
+                        fresh[img_dict["id"]] = img_dict["secret"]
+            next_cursor = batch["next"]
+            if not next_cursor or wanted <= fresh.keys():
+                return fresh
 
-    def download_all_images_from_feed(self, batch_size=20, batch_pause=10):
-        click.secho("Downloading all images from feed posts...", fg="green")
+    def _fetch_page(
+        self,
+        endpoint: str,
+        what: str,
+        fetch,
+        count_items,
+        pager: AdaptivePageSize | None = None,
+    ):
+        """Fetch one page of a paginated source with an adaptive page size.
+
+        `fetch` is called with the page size to request, `count_items` returns
+        the number of items on a page. `pager` replaces the endpoint's own
+        page size, for one of several concurrent crawls. A page that times
+        out or is refused as too large is retried with a smaller size; other
+        errors are raised.
+
+        Returns:
+            tuple: The page, and the page size it was fetched with.
+        """
+        pager = pager or self._page_sizes[endpoint]
+        while True:
+            size = pager.size
+            click.echo(f"Fetching next {size} {what}")
+            started = time.monotonic()
+            try:
+                page = fetch(size)
+            except ApiError as e:
+                refused = isinstance(e, PermanentError) and e.status in (400, 413)
+                if not refused and not isinstance(e, RequestTimeout):
+                    raise
+                if not pager.failed(refused=refused):
+                    raise
+                click.secho(
+                    f"Fetching {size} {what} failed, trying {pager.size}", fg="yellow"
+                )
+                continue
+
+            pager.record(
+                time.monotonic() - started,
+                self._apiClient.last_response_bytes,
+                count_items(page),
+                wire_bytes=self._apiClient.last_wire_bytes,
+                decode_seconds=self._apiClient.last_decode_seconds,
+            )
+            return page, size
+
+    def _iter_feed_posts(self):
+        """Walk the feed from newest to oldest, yielding the Post items."""
+        if self.feed_crawl_workers > 1:
+            items = self._iter_feed_partitioned()
+        else:
+            items = self._iter_feed_sequential()
+        for feed_item in items:
+            if not feed_item["originatorId"].startswith("Post:"):
+                # not a Post item
+                continue
+            if _feed_item_date(feed_item) not in self.date_range:
+                continue
+            yield feed_item
 
+    def _iter_feed_sequential(self):
+        """Page through the feed, from the end of the date range back to its
+        start."""
+        until = self.date_range.until
         cursor = None
-        older_than = None
-        batch_count = 0
+        older_than = until.isoformat() if until else None
         while True:
-            click.echo("Fetching next 10 Posts")
-            response = self._apiClient.feed(
-                cursor=cursor, older_than=older_than, limit=10
+            response, _size = self._fetch_page(
+                "feed",
+                "Posts",
+                lambda limit: self._apiClient.feed(
+                    cursor=cursor, older_than=older_than, limit=limit
+                ),
+                lambda page: len(page["feedItems"]),
             )
             if not response["feedItems"]:
                 break
             last_item = response["feedItems"][-1]
             cursor = last_item["feedItemId"]
             older_than = last_item["createdDate"]
-            for feed_item in response["feedItems"]:
-                if not feed_item["originatorId"].startswith("Post:"):
+            yield from response["feedItems"]
+            if self.date_range.is_before(_feed_item_date(last_item)):
+                break
+
+    def _crawl_feed_window(self, start: datetime, end: datetime):
+        """Fetch the feed items created in [start, end), with a page size of
+        its own (see `AdaptivePageSize.fork`).
+
+        Returns:
+            tuple: The items, newest first, and whether the feed has nothing
+            older than `end` at all.
+        """
+        feed_pager = self._page_sizes["feed"]
+        pager = feed_pager.fork()
+        items = []
+        cursor = None
+        older_than = end.isoformat()
+        try:
+            while True:
+                response, _size = self._fetch_page(
+                    "feed",
+                    f"Posts before {older_than}",
+                    lambda limit: self._apiClient.feed(
+                        cursor=cursor, older_than=older_than, limit=limit
+                    ),
+                    lambda page: len(page["feedItems"]),
+                    pager,
+                )
+                page = response["feedItems"]
+                if not page:
+                    # Paged past the oldest post
+                    return items, True
+                items.extend(i for i in page if start <= _feed_item_date(i) < end)
+
+                last_item = page[-1]
+                if _feed_item_date(last_item) < start:
+                    return items, False
+                cursor = last_item["feedItemId"]
+                older_than = last_item["createdDate"]
+        finally:
+            feed_pager.merge(pager)
+
+    def _iter_feed_partitioned(self):
+        """Crawl the feed in date windows, several windows at a time.
+
+        Windows of `feed_window_days` are laid out backwards from now and
+        crawled concurrently on `feed_crawl_workers` threads, each paging
+        with `olderThan` from its own end. Items are yielded newest first,
+        with the overlap at window boundaries removed by feedItemId. The
+        crawl ends at the first window with nothing older than its end, or at
+        the start of the date range.
+        """
+        window = timedelta(days=self.feed_window_days)
+        newest = self.date_range.until or datetime.now(timezone.utc) + timedelta(days=1)
+        since = self.date_range.since
+        seen: set[str] = set()
+
+        executor = ThreadPoolExecutor(max_workers=self.feed_crawl_workers)
+        pending: deque = deque()
+        next_window = 0
+        try:
+            while True:
+                while len(pending) < self.feed_crawl_workers * 2:
+                    end = newest - next_window * window
+                    if since is not None and end <= since:
+                        break
+                    start = end - window if since is None else max(end - window, since)
+                    pending.append(executor.submit(self._crawl_feed_window, start, end))
+                    next_window += 1
+                if not pending:
+                    break
+
+                items, exhausted = pending.popleft().result()
+                for feed_item in items:
+                    if feed_item["feedItemId"] not in seen:
+                        seen.add(feed_item["feedItemId"])
+                        yield feed_item
+                if exhausted:
+                    break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def print_stats(self):
+        """Print request statistics, overall and per paginated endpoint."""
+        if self._apiClient.requests:
+            click.secho(f"api: {self._apiClient.summary()}", fg="cyan")
+        for endpoint, pager in self._page_sizes.items():
+            if pager.requests:
+                click.secho(f"{endpoint}: {pager.summary()}", fg="cyan")
+
+    def crawl_feed(self, consumers: dict[str, FeedConsumer]):
+        """Walk the feed once, handing every post to each consumer.
+
+        A consumer returns True when it is done (stop_on_existing), and the
+        walk ends once all consumers are done."""
+        active = dict(consumers)
+        for feed_item in self._iter_feed_posts():
+            if self._out_of_budget():
+                break
+            for name, consume in list(active.items()):
+                if consume(feed_item):
+                    click.secho(f"Done with {name} from the feed.", fg="yellow")
+                    del active[name]
+            if not active:
+                break
+        self.save_state()
+
+    def _post_images(
+        self, feed_item: dict, wanted: Callable[[dict], bool] | None = None
+    ) -> Iterator[MediaItem]:
+        for img_dict in feed_item["images"]:
+            if wanted is not None and not wanted(img_dict):
+                continue
+            img = Image.from_dict(
+                img_dict,
+                date_override=feed_item["createdDate"],
+                text_override=feed_item["body"] if self.text_comments else None,
+            )
+            yield MediaItem(img, "post", "post")
+
+    def _post_attachments(
+        self, feed_item: dict, files: bool, videos: bool
+    ) -> Iterator[MediaItem]:
+        create_date = feed_item["createdDate"]
+        feed_text = feed_item.get("body") if self.text_comments else None
+        if files:
+            yield from self._file_items(
+                feed_item.get("files") or [],
+                date=create_date,
+                text=feed_text,
+                filename_prefix="post",
+                source="post",
+            )
+        if videos:
+            yield from self._video_items(
+                feed_item.get("videos") or [],
+                date=create_date,
+                text=feed_text,
+                filename_prefix="post",
+                source="post",
+            )
+
+    def iter_feed(
+        self,
+        liked_by_ids: set[str] | None = None,
+        files: bool = True,
+        videos: bool = True,
+    ) -> Iterator[MediaItem]:
+        """Yield the images, files and videos of all feed posts, newest first.
+
+        With `liked_by_ids`, only the images liked by one of these logins (or
+        by you) are included."""
+        wanted = None
+        if liked_by_ids is not None:
+
+            def wanted(img_dict: dict) -> bool:
+                return img_dict["liked"] or any(
+                    like["loginId"] in liked_by_ids for like in img_dict["likes"]
+                )
+
+        for feed_item in self._iter_feed_posts():
+            yield from self._post_images(feed_item, wanted)
+            yield from self._post_attachments(feed_item, files, videos)
+
+    def _feed_images_consumer(
+        self,
+        wanted: Callable[[dict], bool],
+        handled: set[str],
+        batch_size: int | None = None,
+        batch_pause: float = 0,
+    ) -> FeedConsumer:
+        """Download the images of a post for which `wanted` is true.
+
+        Images in `handled` were already taken care of by another consumer in
+        the same walk, and are skipped without counting as existing."""
+        batch_count = 0
+
+        def consume(feed_item: dict) -> bool:
+            nonlocal batch_count
+            for item in self._post_images(feed_item, wanted):
+                if self._out_of_budget():
+                    return True
+                if item.item_id in handled:
                     continue
-                create_date = feed_item["createdDate"]
-                for img_dict in feed_item["images"]:
-                    img = Image.from_dict(
-                        img_dict,
-                        date_override=create_date,
-                        text_override=feed_item["body"] if self.text_comments else None,
+                handled.add(item.item_id)
+                if self._is_downloaded(item):
+                    if self.stop_on_existing:
+                        return True
+                    continue
+                if not self.fetch_item(item):
+                    continue
+                if batch_size is None:
+                    self._checkpoint()
+                    continue
+                self.save_state()
+                batch_count += 1
+                # A rate limit paces the downloads smoothly instead
+                if batch_count % batch_size == 0 and self._rate_limiter is None:
+                    click.secho(
+                        f"Downloaded {batch_count} images, pausing {batch_pause}s...",
+                        fg="cyan",
                     )
-                    click.echo(f" - image {img.img_id} from post at {create_date}")
+                    time.sleep(batch_pause)
+            return False
 
-                    if img.img_id in self.downloaded_images:
-                        click.secho(
-                            f"Image {img.img_id} already downloaded, {'stopping download' if self.stop_on_existing else 'skipping'}.",
-                            fg="yellow",
-                        )
-                        if self.stop_on_existing:
-                            return
-                        else:
-                            continue
-                    file_path = self.download_file_path(img, "post")
-                    self.fetch_image(img, file_path)
-                    self.mark_as_downloaded(img.img_id)
-                    self.save_state()
-                    batch_count += 1
-                    if batch_count % batch_size == 0:
-                        click.secho(
-                            f"Downloaded {batch_count} images, pausing {batch_pause}s...",
-                            fg="cyan",
-                        )
-                        time.sleep(batch_pause)
-
-                feed_text = feed_item.get("body") if self.text_comments else None
-                if self.include_files:
-                    if self._download_files_from_item(
-                        feed_item.get("files") or [],
-                        date=create_date,
-                        text=feed_text,
-                        filename_prefix="post",
-                    ):
-                        return
-                if self.include_videos:
-                    if self._download_videos_from_item(
-                        feed_item.get("videos") or [],
-                        date=create_date,
-                        text=feed_text,
-                        filename_prefix="post",
-                    ):
-                        return
+        return consume
 
-    def _download_files_from_item(
+    def _feed_attachments_consumer(self) -> FeedConsumer:
+        def consume(feed_item: dict) -> bool:
+            for item in self._post_attachments(
+                feed_item, self.include_files, self.include_videos
+            ):
+                if self._out_of_budget():
+                    return True
+                if self._is_downloaded(item):
+                    if self.stop_on_existing:
+                        return True
+                    continue
+                self.fetch_item(item)
+                self._checkpoint()
+            return False
+
+        return consume
+
+    def download_feed(
+        self,
+        liked_by_ids: set[str] | None = None,
+        all_images: bool = False,
+        batch_size=20,
+        batch_pause=10,
+    ):
+        """Download from the feed in a single walk: the images liked by
+        `liked_by_ids` (if given), all images (with `all_images`), and the
+        files and videos if enabled."""
+        handled: set[str] = set()
+        consumers: dict[str, FeedConsumer] = {}
+        if liked_by_ids is not None:
+            click.secho("Downloading liked images in posts...", fg="green")
+
+            def liked(img_dict: dict) -> bool:
+                return img_dict["liked"] or any(
+                    like["loginId"] in liked_by_ids for like in img_dict["likes"]
+                )
+
+            consumers["liked images"] = self._feed_images_consumer(liked, handled)
+        if all_images:
+            click.secho("Downloading all images from feed posts...", fg="green")
+            consumers["all images"] = self._feed_images_consumer(
+                lambda img_dict: True, handled, batch_size, batch_pause
+            )
+        if consumers and (self.include_files or self.include_videos):
+            consumers["attachments"] = self._feed_attachments_consumer()
+        if consumers:
+            self.crawl_feed(consumers)
+
+    def download_images_from_feed(self, liked_by_ids: set[str]):
+        self.download_feed(liked_by_ids=liked_by_ids)
+
+    def download_all_images_from_feed(self, batch_size=20, batch_pause=10):
+        self.download_feed(
+            all_images=True, batch_size=batch_size, batch_pause=batch_pause
+        )
+
+    def _file_items(
         self,
         file_dicts: list,
         date: str,
         text: str | None,
         filename_prefix: str,
-    ) -> bool:
-        """Download every File attachment on a single note/observation/message.
-
-        Returns True if the caller should stop (only when stop_on_existing is
-        set and an already-downloaded file is encountered)."""
+        source: str,
+    ) -> Iterator[MediaItem]:
+        """The File attachments on a single note/observation/message/post."""
         for file_dict in file_dicts:
             f = File.from_dict(
                 file_dict,
                 date_override=date,
                 text_override=text if self.text_comments else None,
             )
-            click.echo(f" - file {f.file_id} ({f.name or '?'}) at {f.date}")
-
-            if f.file_id in self.downloaded_images:
-                click.secho(
-                    f"File {f.file_id} already downloaded, "
-                    f"{'stopping download' if self.stop_on_existing else 'skipping'}.",
-                    fg="yellow",
-                )
-                if self.stop_on_existing:
-                    return True
-                continue
+            yield MediaItem(f, source, filename_prefix)
 
-            file_path = self.attachment_path(
-                attachment_id=f.file_id,
-                attachment_url=f.url,
-                date=f.date,
-                filename_prefix=filename_prefix,
-                original_name=f.name,
-            )
-            self.fetch_binary(f.url, file_path)
-            self.mark_as_downloaded(f.file_id)
-        return False
-
-    def _download_videos_from_item(
+    def _video_items(
         self,
         video_dicts: list,
         date: str,
         text: str | None,
         filename_prefix: str,
-    ) -> bool:
-        """Download every Video attachment on a single observation.
-
-        Returns True if the caller should stop (stop_on_existing semantics)."""
+        source: str,
+    ) -> Iterator[MediaItem]:
+        """The Video attachments on a single observation/post."""
         for video_dict in video_dicts:
             try:
                 v = Video.from_dict(
@@ -508,29 +1344,7 @@ class FamlyDownloader:
                     fg="yellow",
                 )
                 continue
-
-            click.echo(f" - video {v.video_id} at {v.date}")
-
-            if v.video_id in self.downloaded_images:
-                click.secho(
-                    f"Video {v.video_id} already downloaded, "
-                    f"{'stopping download' if self.stop_on_existing else 'skipping'}.",
-                    fg="yellow",
-                )
-                if self.stop_on_existing:
-                    return True
-                continue
-
-            file_path = self.attachment_path(
-                attachment_id=v.video_id,
-                attachment_url=v.url,
-                date=v.date,
-                filename_prefix=filename_prefix,
-                original_name=None,
-            )
-            self.fetch_binary(v.url, file_path)
-            self.mark_as_downloaded(v.video_id)
-        return False
+            yield MediaItem(v, source, filename_prefix)
 
     def attachment_path(
         self,
@@ -540,149 +1354,188 @@ class FamlyDownloader:
         filename_prefix: str,
         original_name: str | None,
     ) -> Path:
-        """Pick a destination path for a non-image attachment (file or video).
-
-        Uses the original filename if available (sanitised, with date prefix
-        for sortability and id suffix to disambiguate); otherwise falls back
-        to the same filename pattern images use, with the extension derived
-        from the URL path."""
-        date_dir = date.strftime("%Y-%m-%d")
-        dir_path = Path(self._pictures_folder, date_dir)
-        dir_path.mkdir(parents=True, exist_ok=True)
-
-        if original_name:
-            safe = (
-                "".join(
-                    c if c.isalnum() or c in "-_." else "_" for c in original_name
-                ).strip("._")
-                or attachment_id
-            )
-            stem, ext = os.path.splitext(safe)
-            filename = (
-                f"{filename_prefix}-{date.strftime('%Y-%m-%d_%H-%M-%S')}"
-                f"-{attachment_id}-{stem}{ext}"
-            )
-        else:
-            ext = os.path.splitext(urlparse(attachment_url).path)[1].lower()
-            filename = self.filename_pattern
-            filename = filename.replace("%FP", filename_prefix)
-            filename = filename.replace("%ID", attachment_id)
-            filename = date.strftime(filename) + ext
-        return Path(dir_path, filename)
-
-    def fetch_binary(self, url: str, file_path: Path):
-        """Stream a URL to disk. Used for non-image attachments where EXIF
-        injection doesn't apply."""
+        """Pick a destination path for a non-image attachment (file or video)."""
+        return self._layout.attachment_path(
+            attachment_id, attachment_url, date, filename_prefix, original_name
+        )
+
+    @contextmanager
+    def _open_media(self, url: str):
+        if isinstance(self._cassette, CassettePlayer):
+            yield self._cassette.open_media(url)
+            return
+        recorder = self._cassette
+        started = time.monotonic()
         req = urllib.request.Request(url=url)
-        with urllib.request.urlopen(req) as r, open(file_path, "wb") as f:
+        try:
+            r = urllib.request.urlopen(req, timeout=MEDIA_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if recorder is not None:
+                recorder.record_media_error(url, e.code, time.monotonic() - started)
+            raise
+        with r:
             if r.status != 200:
-                raise Exception(f"Broken! {r.read().decode('utf-8')}")
-            shutil.copyfileobj(r, f)
+                if recorder is not None:
+                    recorder.record_media_error(
+                        url, r.status, time.monotonic() - started
+                    )
+                raise PermanentError(
+                    f"Broken! {r.read().decode('utf-8')}", url, r.status
+                )
+            if recorder is None:
+                yield r
+            else:
+                with recorder.media(url, r, started) as tee:
+                    yield tee
+
+    def media_url(self, item: MediaItem) -> str:
+        """The URL an item is downloaded from."""
+        if isinstance(item.media, BaseImage):
+            return item.media.url_for(self.max_dimension)
+        return item.url
+
+    def head_size(self, url: str) -> int | None:
+        """The size of a media file according to a HEAD request, None if the
+        server doesn't say."""
+        if isinstance(self._cassette, CassettePlayer):
+            return self._cassette.media_size(url)
+
+        def request():
+            req = urllib.request.Request(url=url, method="HEAD")
+            with urllib.request.urlopen(req, timeout=MEDIA_TIMEOUT) as r:
+                return _content_length(r)
+
+        return self._retrier.call(url, request)
+
+    def _storage_key(self, file_path: Path) -> str:
+        return file_path.relative_to(self._pictures_folder).as_posix()
+
+    def fetch_binary(
+        self,
+        url: str,
+        file_path: Path,
+        item_id: str | None = None,
+        item: MediaItem | None = None,
+    ):
+        """Stream a URL to storage. Used for non-image attachments where EXIF
+        injection doesn't apply. With `item`, the file is handed to the hooks
+        once it's stored."""
+        key = self._storage_key(file_path)
+
+        def request():
+            with self._open_media(url) as r:
+                # A failed attempt is discarded, the next one starts over
+                with self._storage.writer(
+                    key, item_id=item_id, size=_content_length(r)
+                ) as out:
+                    self._count_bytes(copy_stream(r, out, self._rate_limiter))
+
+        self._retrier.call(url, request)
+        self._run_hooks(item, key)
+
+    def _run_hooks(self, item: MediaItem | None, key: str):
+        if self._hooks is not None and item is not None:
+            self._hooks.submit(DownloadedFile(item, key, self._storage.local_path(key)))
+
+    def _count_bytes(self, count: int):
+        if self.budget is not None:
+            self.budget.add_bytes(count)
+
+    def _fetch_bytes(self, url: str) -> bytes:
+        def request():
+            with self._open_media(url) as r:
+                buffer = io.BytesIO()
+                self._count_bytes(copy_stream(r, buffer, self._rate_limiter))
+                return buffer.getvalue()
+
+        return self._retrier.call(url, request)
 
     def download_file_path(self, img: BaseImage, filename_prefix: str) -> Path:
         """Generate the file path for the downloaded image."""
-
-        file_ext = os.path.splitext(urlparse(img.url).path)[1].lower()
-
-        # Replace custom patterns first (to avoid collisions with strftime patterns)
-        filename = self.filename_pattern
-        filename = filename.replace("%FP", filename_prefix)
-        filename = filename.replace("%ID", img.img_id)
-
-        filename = img.date.strftime(filename)
-        filename = filename + file_ext
-
-        date_dir = img.date.strftime("%Y-%m-%d")
-        dir_path = Path(self._pictures_folder, date_dir)
-        dir_path.mkdir(parents=True, exist_ok=True)
-        return Path(dir_path, filename)
-
-    def fetch_image(self, img: BaseImage, file_path: Path):
-        req = urllib.request.Request(url=img.url)
-
-        captured_date_for_exif = img.date.strftime("%Y:%m:%d %H:%M:%S")
-
-        if img.date.tzinfo is not None:
-            timezone_offset = img.date.strftime("%z")
-            # Convert from +0200 to +02:00 format
-            if len(timezone_offset) == 5:
-                timezone_offset = timezone_offset[:3] + ":" + timezone_offset[3:]
-        else:
-            timezone_offset = None
-
-        with urllib.request.urlopen(req) as r, open(file_path, "wb") as f:
-            if r.status != 200:
-                raise Exception(f"Broken! {r.read().decode('utf-8')}")
-            shutil.copyfileobj(r, f)
-
-        try:
-            piexif.load(str(file_path.resolve()))
-        except piexif.InvalidImageDataError:
-            click.secho(
-                "Not a JPEG/TIFF or corrupted image, skip exif updating.", fg="yellow"
-            )
-            return
-
-        # Prepare the EXIF data
-        exif_dict = {
-            "Exif": {piexif.ExifIFD.DateTimeOriginal: captured_date_for_exif.encode()}
+        return self._layout.image_path(img.img_id, img.url, img.date, filename_prefix)
+
+    def _sidecar(self, img: BaseImage, capped_at: int | None) -> dict:
+        return {
+            "id": img.img_id,
+            "date": img.date.isoformat(),
+            "text": img.text,
+            "width": img.width,
+            "height": img.height,
+            "capped_at": capped_at,
         }
 
-        if timezone_offset:
-            exif_dict["Exif"][piexif.ExifIFD.OffsetTimeOriginal] = (
-                timezone_offset.encode()
-            )
+    def _set_capped(self, img_id: str, capped_at: int | None):
+        """Remember the size an image was downloaded at, once it's done."""
+        with self._state_lock:
+            if capped_at is not None:
+                self.capped_images[img_id] = capped_at
+            else:
+                self.capped_images.pop(img_id, None)
 
-        if img.text:
-            exif_dict["Exif"][piexif.ExifIFD.UserComment] = (
-                piexif.helper.UserComment.dump(img.text, encoding="unicode")
-            )
-
-        # Add GPS data if latitude and longitude are provided
-        if self.latitude is not None and self.longitude is not None:
-            from fractions import Fraction
-
-            def to_deg(value, loc):
-                if value < 0:
-                    loc_value = loc[0]
-                elif value > 0:
-                    loc_value = loc[1]
-                else:
-                    loc_value = ""
-                abs_value = abs(value)
-                deg = int(abs_value)
-                t1 = (abs_value - deg) * 60
-                min_val = int(t1)
-                sec = round((t1 - min_val) * 60, 2)
-                return deg, min_val, sec, loc_value
-
-            def to_rational(number):
-                f = Fraction(number).limit_denominator(10000)
-                return (f.numerator, f.denominator)
-
-            lat_deg = to_deg(self.latitude, ["S", "N"])
-            lng_deg = to_deg(self.longitude, ["W", "E"])
-
-            exiv_lat = (
-                to_rational(lat_deg[0]),
-                to_rational(lat_deg[1]),
-                to_rational(lat_deg[2]),
+    def fetch_image(
+        self, img: BaseImage, file_path: Path, item: MediaItem | None = None
+    ) -> bool:
+        """Download an image and write its EXIF data. With `item`, the file
+        is handed to the hooks once that's done.
+
+        Returns:
+            bool: Whether the EXIF data is written later by the post-processor,
+                which then marks `item` as downloaded, or records it as failed.
+        """
+        url = img.url_for(self.max_dimension)
+        capped_at = self.max_dimension if url != img.url else None
+        key = self._storage_key(file_path)
+        local_path = self._storage.local_path(key)
+        if local_path is not None:
+            self.fetch_binary(url, file_path, img.img_id)
+        else:
+            # Without a local file, EXIF is written in memory before storing
+            data = add_exif_to_bytes(
+                self._fetch_bytes(url),
+                img.date,
+                img.text,
+                self.latitude,
+                self.longitude,
+                img.img_id,
             )
-            exiv_lng = (
-                to_rational(lng_deg[0]),
-                to_rational(lng_deg[1]),
-                to_rational(lng_deg[2]),
+            mtime = img.date.timestamp()
+            self._storage.write_bytes(key, data, item_id=img.img_id, mtime=mtime)
+            self._set_capped(img.img_id, capped_at)
+            if self.sidecar_metadata:
+                self._storage.write_bytes(
+                    key + ".json",
+                    json.dumps(self._sidecar(img, capped_at), indent=2).encode(),
+                    mtime=mtime,
+                )
+            self._run_hooks(item, key)
+            return False
+
+        # EXIF and sidecar writing is CPU-bound, leave it to the post-processor
+        # so the next download can start right away
+        self._postprocessor.submit(
+            add_exif,
+            str(local_path.resolve()),
+            img.date,
+            img.text,
+            self.latitude,
+            self.longitude,
+            img.img_id,
+            then=partial(self._postprocessed, img.img_id, capped_at, item, key),
+            failed=partial(self._item_failed, item) if item is not None else None,
+        )
+        if self.sidecar_metadata:
+            self._postprocessor.submit(
+                write_sidecar,
+                str(local_path.resolve()),
+                self._sidecar(img, capped_at),
             )
+        return item is not None
 
-            exif_dict["GPS"] = {  # type: ignore[assignment]
-                piexif.GPSIFD.GPSVersionID: (2, 0, 0, 0),
-                piexif.GPSIFD.GPSLatitudeRef: lat_deg[3].encode(),
-                piexif.GPSIFD.GPSLatitude: exiv_lat,
-                piexif.GPSIFD.GPSLongitudeRef: lng_deg[3].encode(),
-                piexif.GPSIFD.GPSLongitude: exiv_lng,
-            }
-
-        exif_bytes = piexif.dump(exif_dict)
-
-        # Write the EXIF data to the image
-        piexif.insert(exif_bytes, str(file_path.resolve()))
+    def _postprocessed(
+        self, img_id: str, capped_at: int | None, item: MediaItem | None, key: str
+    ):
+        """Called once the EXIF data of a downloaded image is written."""
+        self._set_capped(img_id, capped_at)
+        if item is not None:
+            self._item_done(item)
+            self._run_hooks(item, key)
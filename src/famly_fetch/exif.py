@@ -0,0 +1,153 @@
+import io
+import json
+from datetime import datetime
+from fractions import Fraction
+
+import click
+import piexif
+import piexif.helper
+
+
+def _exif_bytes(
+    date: datetime,
+    text: str | None,
+    latitude: float | None,
+    longitude: float | None,
+    image_id: str | None = None,
+) -> bytes:
+    captured_date_for_exif = date.strftime("%Y:%m:%d %H:%M:%S")
+
+    if date.tzinfo is not None:
+        timezone_offset = date.strftime("%z")
+        # Convert from +0200 to +02:00 format
+        if len(timezone_offset) == 5:
+            timezone_offset = timezone_offset[:3] + ":" + timezone_offset[3:]
+    else:
+        timezone_offset = None
+
+    # Prepare the EXIF data
+    exif_dict = {
+        "Exif": {piexif.ExifIFD.DateTimeOriginal: captured_date_for_exif.encode()}
+    }
+
+    if timezone_offset:
+        exif_dict["Exif"][piexif.ExifIFD.OffsetTimeOriginal] = timezone_offset.encode()
+
+    # Lets --reindex recognise the image whatever its name
+    if image_id:
+        exif_dict["Exif"][piexif.ExifIFD.ImageUniqueID] = image_id.encode()
+
+    if text:
+        exif_dict["Exif"][piexif.ExifIFD.UserComment] = piexif.helper.UserComment.dump(
+            text, encoding="unicode"
+        )
+
+    # Add GPS data if latitude and longitude are provided
+    if latitude is not None and longitude is not None:
+
+        def to_deg(value, loc):
+            if value < 0:
+                loc_value = loc[0]
+            elif value > 0:
+                loc_value = loc[1]
+            else:
+                loc_value = ""
+            abs_value = abs(value)
+            deg = int(abs_value)
+            t1 = (abs_value - deg) * 60
+            min_val = int(t1)
+            sec = round((t1 - min_val) * 60, 2)
+            return deg, min_val, sec, loc_value
+
+        def to_rational(number):
+            f = Fraction(number).limit_denominator(10000)
+            return (f.numerator, f.denominator)
+
+        lat_deg = to_deg(latitude, ["S", "N"])
+        lng_deg = to_deg(longitude, ["W", "E"])
+
+        exiv_lat = (
+            to_rational(lat_deg[0]),
+            to_rational(lat_deg[1]),
+            to_rational(lat_deg[2]),
+        )
+        exiv_lng = (
+            to_rational(lng_deg[0]),
+            to_rational(lng_deg[1]),
+            to_rational(lng_deg[2]),
+        )
+
+        exif_dict["GPS"] = {  # type: ignore[assignment]
+            piexif.GPSIFD.GPSVersionID: (2, 0, 0, 0),
+            piexif.GPSIFD.GPSLatitudeRef: lat_deg[3].encode(),
+            piexif.GPSIFD.GPSLatitude: exiv_lat,
+            piexif.GPSIFD.GPSLongitudeRef: lng_deg[3].encode(),
+            piexif.GPSIFD.GPSLongitude: exiv_lng,
+        }
+
+    return piexif.dump(exif_dict)
+
+
+def add_exif(
+    file_path: str,
+    date: datetime,
+    text: str | None,
+    latitude: float | None = None,
+    longitude: float | None = None,
+    image_id: str | None = None,
+):
+    """Write the capture date, comment, GPS position and Famly id into an
+    image's EXIF.
+
+    A module level function, so it can run in a worker process."""
+    try:
+        piexif.load(file_path)
+    except piexif.InvalidImageDataError:
+        click.secho(
+            "Not a JPEG/TIFF or corrupted image, skip exif updating.", fg="yellow"
+        )
+        return
+
+    # Write the EXIF data to the image
+    piexif.insert(_exif_bytes(date, text, latitude, longitude, image_id), file_path)
+
+
+def add_exif_to_bytes(
+    data: bytes,
+    date: datetime,
+    text: str | None,
+    latitude: float | None = None,
+    longitude: float | None = None,
+    image_id: str | None = None,
+) -> bytes:
+    """Like add_exif, for an image held in memory. Returns the new image."""
+    if data[:2] != b"\xff\xd8":
+        click.secho("Not a JPEG or corrupted image, skip exif updating.", fg="yellow")
+        return data
+
+    out = io.BytesIO()
+    piexif.insert(_exif_bytes(date, text, latitude, longitude, image_id), data, out)
+    return out.getvalue()
+
+
+def write_sidecar(file_path: str, metadata: dict):
+    """Write metadata about a downloaded file next to it, as <file>.json."""
+    with open(file_path + ".json", "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def read_image_id(file_path: str) -> str | None:
+    """The Famly id add_exif wrote into an image, if any.
+
+    Only the start of the file is read; the EXIF segment is near the start
+    and can't be larger than 64 KiB."""
+    with open(file_path, "rb") as f:
+        head = f.read(128 * 1024)
+    if head[:2] != b"\xff\xd8":
+        return None
+    try:
+        image_id = piexif.load(head)["Exif"].get(piexif.ExifIFD.ImageUniqueID)
+    except Exception:
+        # piexif fails in many ways on damaged data
+        return None
+    return image_id.decode(errors="replace") if image_id else None
@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+from famly_fetch.media import MediaItem
+
+
+class FailedItems:
+    """The items that failed to download, saved next to the state file
+    (`state.failed.json`) so they can be retried on their own later.
+
+    Each entry holds the item, the URL it failed on, the number of failed
+    attempts and the last error. An item is dropped again once it downloads.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._entries: dict[str, dict] = {}
+        if path.exists():
+            with open(path, "r") as f:
+                self._entries = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, item_id: object) -> bool:
+        return item_id in self._entries
+
+    def record(self, item: MediaItem, error: Exception):
+        with self._lock:
+            previous = self._entries.get(item.item_id, {})
+            self._entries[item.item_id] = {
+                "url": item.url,
+                "source": item.source,
+                "attempts": previous.get("attempts", 0) + 1,
+                "last_error": str(error) or type(error).__name__,
+                "failed_at": datetime.now(timezone.utc).isoformat(),
+                "item": item.to_dict(),
+            }
+            self._dirty = True
+
+    def discard(self, item_id: str):
+        with self._lock:
+            if self._entries.pop(item_id, None) is not None:
+                self._dirty = True
+
+    def entries(self) -> dict[str, dict]:
+        with self._lock:
+            return dict(self._entries)
+
+    def items(self) -> list[MediaItem]:
+        """The failed items, oldest failure first."""
+        entries = sorted(self.entries().values(), key=lambda e: e["failed_at"])
+        return [MediaItem.from_dict(entry["item"]) for entry in entries]
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            if self._entries:
+                tmp = self.path.with_suffix(".json.tmp")
+                with open(tmp, "w") as f:
+                    json.dump(self._entries, f, indent=2)
+                os.replace(tmp, self.path)
+            elif self.path.exists():
+                self.path.unlink()
+            self._dirty = False
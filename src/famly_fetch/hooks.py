@@ -0,0 +1,206 @@
+import importlib
+import json
+import queue
+import shlex
+import subprocess
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import click
+
+from famly_fetch.media import MediaItem
+
+# Seconds a partly filled batch waits for more files before it's handed over
+HOOK_MAX_WAIT = 30
+
+# Put on the queue to stop the dispatcher
+_CLOSE = object()
+
+
+@dataclass
+class DownloadedFile:
+    """A file that has been downloaded and post-processed."""
+
+    item: MediaItem
+    # Key in the storage, and the file on disk if the storage is local
+    key: str
+    path: Path | None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.item.item_id,
+            "kind": self.item.kind,
+            "source": self.item.source,
+            "date": self.item.date.isoformat(),
+            "text": self.item.text,
+            "key": self.key,
+            "path": str(self.path) if self.path else None,
+        }
+
+
+@dataclass
+class Hook:
+    """A step run on downloaded files, `batch_size` files at a time."""
+
+    name: str
+    run: Callable[[list[DownloadedFile]], None]
+    batch_size: int = 1
+    # Statistics, updated as batches finish
+    calls: int = field(default=0, init=False)
+    files: int = field(default=0, init=False)
+    failures: int = field(default=0, init=False)
+    seconds: float = field(default=0.0, init=False)
+    slowest: float = field(default=0.0, init=False)
+
+    def summary(self) -> str:
+        mean = self.seconds / self.calls if self.calls else 0
+        return (
+            f"{self.calls} calls ({self.failures} failed), {self.files} files, "
+            f"{self.seconds:.2f}s in total, {mean:.2f}s per call, "
+            f"{self.slowest:.2f}s slowest"
+        )
+
+    @staticmethod
+    def parse(spec: str, batch_size: int = 1) -> "Hook":
+        """A hook from the command line: "python:module:function" calls the
+        function with the list of files, anything else is a command run with
+        the paths of the files as arguments and their details as JSON lines
+        on stdin."""
+        if spec.startswith("python:"):
+            module_name, _, function_name = spec[len("python:") :].partition(":")
+            if not function_name:
+                raise ValueError(
+                    f"Invalid hook {spec!r}, expected python:module:function"
+                )
+            function = getattr(importlib.import_module(module_name), function_name)
+            return Hook(function_name, function, batch_size)
+        command = shlex.split(spec)
+        if not command:
+            raise ValueError("A hook command can't be empty")
+        return Hook(Path(command[0]).name, _run_command(command), batch_size)
+
+
+def _run_command(command: list[str]) -> Callable[[list[DownloadedFile]], None]:
+    def run(files: list[DownloadedFile]):
+        args = [str(f.path or f.key) for f in files]
+        details = "".join(json.dumps(f.to_dict()) + "\n" for f in files)
+        result = subprocess.run(
+            command + args, input=details, text=True, capture_output=True
+        )
+        if result.returncode != 0:
+            message = f"{shlex.join(command)} exited with {result.returncode}: "
+            raise RuntimeError((message + result.stderr.strip()[:200]).rstrip(": "))
+
+    return run
+
+
+class HookPipeline:
+    """Hands downloaded files to hooks in the background, so indexing,
+    thumbnailing or notifying overlaps with the downloads instead of being a
+    second pass afterwards.
+
+    Files are put on a queue of at most `max_pending`; `submit` blocks when
+    it's full, which keeps downloads from running arbitrarily far ahead of
+    slow hooks. A dispatcher thread collects each hook's files into batches
+    of its `batch_size`, and runs the batches on `workers` threads. A batch
+    that isn't full is run after `max_wait` seconds, or on `close`.
+    """
+
+    def __init__(
+        self,
+        hooks: list[Hook],
+        workers: int = 2,
+        max_pending: int | None = None,
+        max_wait: float = HOOK_MAX_WAIT,
+    ):
+        self.hooks = hooks
+        self.max_wait = max_wait
+        largest_batch = max((hook.batch_size for hook in hooks), default=1)
+        self._queue: queue.Queue = queue.Queue(
+            max_pending or max(workers, 1) * largest_batch * 4
+        )
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="hook")
+        self._lock = threading.Lock()
+        self._closed = False
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, name="hook-dispatcher", daemon=True
+        )
+        self._dispatcher.start()
+
+    def submit(self, downloaded: DownloadedFile):
+        if self._closed:
+            click.secho(
+                f"Hooks already stopped, not run for {downloaded.key}", fg="yellow"
+            )
+            return
+        self._queue.put(downloaded)
+
+    def _dispatch(self):
+        batches: list[list[DownloadedFile]] = [[] for _ in self.hooks]
+        started: float | None = None
+        while True:
+            timeout = None
+            if started is not None:
+                timeout = max(0.0, started + self.max_wait - time.monotonic())
+            try:
+                downloaded = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                downloaded = None
+            closing = downloaded is _CLOSE
+            if downloaded is not None and not closing:
+                if started is None:
+                    started = time.monotonic()
+                for batch in batches:
+                    batch.append(downloaded)
+            waited = started is not None and (
+                time.monotonic() - started >= self.max_wait
+            )
+            for i, hook in enumerate(self.hooks):
+                batch = batches[i]
+                if batch and (len(batch) >= hook.batch_size or waited or closing):
+                    batches[i] = []
+                    self._executor.submit(self._run, hook, batch)
+            if not any(batches):
+                started = None
+            elif waited:
+                started = time.monotonic()
+            if closing:
+                return
+
+    def _run(self, hook: Hook, batch: list[DownloadedFile]):
+        start = time.perf_counter()
+        failed = False
+        try:
+            hook.run(batch)
+        except Exception as e:
+            failed = True
+            click.secho(
+                f"Hook {hook.name} failed for {len(batch)} file(s): {e}", fg="red"
+            )
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            hook.calls += 1
+            hook.files += len(batch)
+            hook.failures += failed
+            hook.seconds += elapsed
+            hook.slowest = max(hook.slowest, elapsed)
+
+    def print_stats(self):
+        for hook in self.hooks:
+            if hook.calls:
+                click.secho(f"hook {hook.name}: {hook.summary()}", fg="cyan")
+
+    def close(self):
+        """Run the remaining batches, wait for all of them to finish, and
+        print the time spent per hook."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+        self.print_stats()
@@ -0,0 +1,159 @@
+import hashlib
+import heapq
+import json
+import os
+import shutil
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Header of the index file: magic, then the size and mtime of the state file
+# it was built from
+_MAGIC = int.from_bytes(b"famlyid1", "little")
+_HEADER_LENGTH = 3
+
+
+def id_hash(item_id: str) -> int:
+    """The 8 byte hash an id is stored as. With a million ids the chance of
+    any two colliding is about one in 40 million."""
+    return int.from_bytes(
+        hashlib.blake2b(item_id.encode(), digest_size=8).digest(), "little"
+    )
+
+
+class IdIndex:
+    """The ids in a state file, for membership checks.
+
+    The state file maps every downloaded id to the time it was downloaded.
+    Rather than holding all of it, ids are kept as sorted 8 byte hashes in an
+    array and looked up by bisection, so memory grows by 8 bytes per id. The
+    hashes are saved next to the state file (`state.ids`) and loaded from
+    there as long as the state file hasn't been changed by something else;
+    only then is the JSON parsed again.
+
+    Ids added during the run are kept as they are until `save`, which adds
+    them at the end of the state file. The existing entries are copied over
+    as they are, without parsing them, and the new file replaces the old one
+    at once, so a crash or a full disk can't leave a broken state file.
+    """
+
+    def __init__(self, state_file: Path):
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        # Id -> download time, not saved yet
+        self._pending: dict[str, str] = {}
+        self._hashes = self._load()
+
+    @property
+    def index_file(self) -> Path:
+        return self.state_file.with_suffix(".ids")
+
+    def _load(self) -> array:
+        if not self.state_file.exists():
+            return array("Q")
+        stat = self.state_file.stat()
+        try:
+            with open(self.index_file, "rb") as f:
+                header = array("Q")
+                header.fromfile(f, _HEADER_LENGTH)
+                if list(header) == [_MAGIC, stat.st_size, stat.st_mtime_ns]:
+                    hashes = array("Q")
+                    hashes.frombytes(f.read())
+                    return hashes
+        except (OSError, EOFError, ValueError):
+            pass  # missing, truncated or written on another platform
+
+        with open(self.state_file, "r") as f:
+            ids = json.load(f)
+        hashes = array("Q", sorted({id_hash(i) for i in ids}))
+        self._write_index(hashes)
+        return hashes
+
+    def _write_index(self, hashes: array):
+        stat = self.state_file.stat()
+        tmp = self.index_file.with_suffix(".ids.tmp")
+        with open(tmp, "wb") as f:
+            array("Q", [_MAGIC, stat.st_size, stat.st_mtime_ns]).tofile(f)
+            hashes.tofile(f)
+        os.replace(tmp, self.index_file)
+
+    def _saved(self, item_id: str) -> bool:
+        h = id_hash(item_id)
+        i = bisect_left(self._hashes, h)
+        return i < len(self._hashes) and self._hashes[i] == h
+
+    def __contains__(self, item_id: object) -> bool:
+        if not isinstance(item_id, str):
+            return False
+        return item_id in self._pending or self._saved(item_id)
+
+    def __len__(self) -> int:
+        return len(self._hashes) + len(self._pending)
+
+    def add(self, item_id: str):
+        with self._lock:
+            if item_id not in self:
+                self._pending[item_id] = datetime.now(timezone.utc).isoformat()
+
+    def save(self):
+        """Append the ids added since the last save to the state file."""
+        with self._lock:
+            if not self._pending:
+                return
+            self._append_to_state(self._pending)
+            added = sorted({id_hash(i) for i in self._pending})
+            hashes = array("Q", heapq.merge(self._hashes, added))
+            self._write_index(hashes)
+            self._hashes = hashes
+            self._pending = {}
+
+    def _append_to_state(self, entries: dict[str, str]):
+        if not self.state_file.exists() or self.state_file.stat().st_size == 0:
+            self._replace_state(lambda out: out.write(json.dumps(entries).encode()))
+            return
+
+        with open(self.state_file, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            tail_start = max(0, f.tell() - 256)
+            f.seek(tail_start)
+            tail = f.read()
+            end = tail.rfind(b"}")
+            if end == -1:
+                raise ValueError(f"{self.state_file} isn't a JSON object")
+            last = tail[:end].rstrip()
+            # Follow the formatting of the file, pretty-printed or not
+            if b"\n" in tail[len(last) : end]:
+                line = last[last.rfind(b"\n") + 1 :]
+                indent = line[: len(line) - len(line.lstrip())].decode()
+                separator, closing = ",\n" + indent, "\n}"
+            else:
+                separator, closing = ", ", "}"
+            body = separator.join(
+                f"{json.dumps(k)}: {json.dumps(v)}" for k, v in entries.items()
+            )
+            if last.endswith(b"{"):
+                body = separator.lstrip(", ") + body
+            else:
+                body = separator + body
+
+            def write(out):
+                # Everything up to the last entry, then the new ones
+                f.seek(0)
+                remaining = tail_start + len(last)
+                while remaining:
+                    chunk = f.read(min(remaining, shutil.COPY_BUFSIZE))
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    remaining -= len(chunk)
+                out.write((body + closing).encode())
+
+            self._replace_state(write)
+
+    def _replace_state(self, write):
+        tmp = self.state_file.with_suffix(".json.tmp")
+        with open(tmp, "wb") as out:
+            write(out)
+        os.replace(tmp, self.state_file)
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 
 @dataclass
@@ -16,6 +16,19 @@ class BaseImage:
     def url(self):
         raise NotImplementedError()
 
+    def scaled_size(self, max_dimension: int | None) -> tuple[int, int] | None:
+        """Width and height that fit within `max_dimension`, keeping the aspect
+        ratio, or None if the original already fits."""
+        if not max_dimension or max(self.width, self.height) <= max_dimension:
+            return None
+        scale = max_dimension / max(self.width, self.height)
+        return max(1, round(self.width * scale)), max(1, round(self.height * scale))
+
+    def url_for(self, max_dimension: int | None) -> str:
+        """URL of a rendition no larger than `max_dimension`, if the image
+        service supports it; the full size image otherwise."""
+        return self.url
+
 
 @dataclass
 class Image(BaseImage):
@@ -37,6 +50,13 @@ class Image(BaseImage):
     def url(self):
         return f"{self.prefix}/{self.key}"
 
+    def url_for(self, max_dimension: int | None) -> str:
+        size = self.scaled_size(max_dimension)
+        if size is None:
+            return self.url
+        # The image service renders any size requested as <width>x<height>
+        return f"{self.prefix}/{size[0]}x{size[1]}/{self.key}"
+
 
 @dataclass
 class SecretImage(BaseImage):
@@ -62,3 +82,28 @@ class SecretImage(BaseImage):
     @property
     def url(self):
         return f"{self.prefix}/{self.key}/{self.path}?expires={self.expires}"
+
+    @property
+    def expires_at(self) -> datetime | None:
+        """When the signed URL stops working, or None if `expires` isn't understood."""
+        value = str(self.expires)
+        try:
+            if value.isdigit():
+                timestamp = int(value)
+                # Tolerate millisecond timestamps
+                if timestamp > 10**11:
+                    timestamp //= 1000
+                return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+            expires_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except (ValueError, OverflowError):
+            return None
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        return expires_at
+
+    def is_expired(self, margin: timedelta = timedelta(0)) -> bool:
+        """Check if the signed URL has expired, or will within `margin`."""
+        expires_at = self.expires_at
+        if expires_at is None:
+            return False
+        return expires_at <= datetime.now(timezone.utc) + margin
@@ -0,0 +1,238 @@
+import hashlib
+import os
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+# Directory layouts, as strftime formats relative to the pictures folder
+LAYOUTS = {
+    "date": "%Y-%m-%d",
+    "year-month": "%Y/%m",
+    "year-month-day": "%Y/%m/%d",
+    "sharded": None,  # two levels of hash shards, e.g. 3f/a2
+}
+
+_TOKEN = re.compile(r"%%|%FP|%ID|%.", re.DOTALL)
+
+# What strftime codes render as, for reading names back
+_TIME_REGEX = {
+    "%Y": r"\d{4}",
+    "%y": r"\d{2}",
+    "%m": r"\d{2}",
+    "%d": r"\d{2}",
+    "%H": r"\d{2}",
+    "%I": r"\d{2}",
+    "%M": r"\d{2}",
+    "%S": r"\d{2}",
+    "%j": r"\d{3}",
+    "%f": r"\d{6}",
+    "%z": r"(?:[+-]\d{4})?",
+    "%%": "%",
+}
+
+# The fixed part of attachment names with an original filename
+_ATTACHMENT_NAME = re.compile(r".*?-\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}-(?P<rest>.+)")
+
+
+def _compile(pattern: str) -> list[tuple[str, str]]:
+    """Split a filename pattern into ("fp"|"id"|"time"|"text", value) parts.
+
+    Runs of strftime codes and literal text are kept together, so rendering
+    a name costs at most one strftime call per run.
+    """
+    parts: list[tuple[str, str]] = []
+    pos = 0
+    for match in _TOKEN.finditer(pattern):
+        text = pattern[pos : match.start()]
+        token = match.group()
+        pos = match.end()
+        if token in ("%FP", "%ID"):
+            if text:
+                parts.append(("time", text))
+            parts.append(("fp" if token == "%FP" else "id", ""))
+        else:
+            parts.append(("time", text + token))
+    if pos < len(pattern):
+        parts.append(("time", pattern[pos:]))
+
+    # Merge neighbouring strftime runs, and keep runs without codes as text
+    merged: list[tuple[str, str]] = []
+    for kind, value in parts:
+        if kind == "time" and merged and merged[-1][0] == "time":
+            merged[-1] = ("time", merged[-1][1] + value)
+        else:
+            merged.append((kind, value))
+    return [
+        ("text", value) if kind == "time" and "%" not in value else (kind, value)
+        for kind, value in merged
+    ]
+
+
+def _time_regex(value: str) -> str:
+    out = []
+    pos = 0
+    for match in _TOKEN.finditer(value):
+        out.append(re.escape(value[pos : match.start()]))
+        out.append(_TIME_REGEX.get(match.group(), ".+?"))
+        pos = match.end()
+    out.append(re.escape(value[pos:]))
+    return "".join(out)
+
+
+def url_extension(url: str) -> str:
+    return os.path.splitext(urlparse(url).path)[1].lower()
+
+
+class FileLayout:
+    """Decide where downloaded items go below the pictures folder.
+
+    The filename pattern is compiled once, directories are created only the
+    first time they are used in a run, and two different ids ending up with
+    the same path are told apart by appending the id.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        filename_pattern: str,
+        layout: str = "date",
+        create_dirs: bool = True,
+    ):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout {layout!r}")
+        self.root = root
+        self.filename_pattern = filename_pattern
+        self.layout = layout
+        # Off when the paths are only used as names, e.g. inside an archive
+        self.create_dirs = create_dirs
+        self._dir_format = LAYOUTS[layout]
+        self._parts = _compile(filename_pattern)
+        self._name_regex = self._compile_name_regex()
+        # Directories known to exist, by their path relative to root
+        self._dirs: dict[str, Path] = {}
+        self._claimed: dict[Path, str] = {}
+        self._lock = threading.Lock()
+
+    def render_name(self, filename_prefix: str, item_id: str, date: datetime) -> str:
+        """Render the filename pattern, without extension."""
+        out = []
+        for kind, value in self._parts:
+            if kind == "fp":
+                out.append(filename_prefix)
+            elif kind == "id":
+                out.append(item_id)
+            elif kind == "text":
+                out.append(value)
+            else:
+                out.append(date.strftime(value))
+        return "".join(out)
+
+    def _compile_name_regex(self) -> re.Pattern | None:
+        if not any(kind == "id" for kind, _ in self._parts):
+            return None
+        out = []
+        for kind, value in self._parts:
+            if kind == "fp":
+                out.append(".*?")
+            elif kind == "id":
+                # Only the first %ID is captured, later ones must repeat it
+                out.append("(?P=id)" if "(?P<id>" in "".join(out) else "(?P<id>.+?)")
+            elif kind == "text":
+                out.append(re.escape(value))
+            else:
+                out.append(_time_regex(value))
+        # A name taken by another item in the same run gets the id appended
+        return re.compile("".join(out) + r"(?:-(?P=id))?(?:\.[^.]*)?")
+
+    def candidate_ids(self, filename: str) -> list[str]:
+        """The ids a filename made by this layout may belong to.
+
+        The inverse of the naming in image_path and attachment_path. Names of
+        attachments with an original filename can't be split unambiguously,
+        so every possible id is returned; the caller picks the known one."""
+        candidates = []
+        if self._name_regex is not None:
+            match = self._name_regex.fullmatch(filename)
+            if match:
+                candidates.append(match.group("id"))
+
+        match = _ATTACHMENT_NAME.fullmatch(filename)
+        if match:
+            parts = match.group("rest").split("-")
+            for end in range(1, len(parts)):
+                candidates.append("-".join(parts[:end]))
+        return candidates
+
+    def directory(self, item_id: str, date: datetime) -> Path:
+        """The directory for an item, created on first use."""
+        if self._dir_format is None:
+            digest = hashlib.md5(item_id.encode()).hexdigest()
+            key = f"{digest[:2]}/{digest[2:4]}"
+        else:
+            key = date.strftime(self._dir_format)
+
+        dir_path = self._dirs.get(key)
+        if dir_path is None:
+            dir_path = self.root / key
+            if self.create_dirs:
+                dir_path.mkdir(parents=True, exist_ok=True)
+            with self._lock:
+                self._dirs[key] = dir_path
+        return dir_path
+
+    def _claim(self, path: Path, item_id: str) -> Path:
+        """Make sure no other item in this run has been given `path`."""
+        with self._lock:
+            owner = self._claimed.setdefault(path, item_id)
+            if owner == item_id:
+                return path
+            path = path.with_name(f"{path.stem}-{item_id}{path.suffix}")
+            self._claimed[path] = item_id
+            return path
+
+    def clear_claims(self):
+        """Forget the paths given out so far, e.g. after a poll in --watch,
+        so they don't pile up for as long as the process runs."""
+        with self._lock:
+            self._claimed.clear()
+
+    def image_path(
+        self, item_id: str, url: str, date: datetime, filename_prefix: str
+    ) -> Path:
+        """Path for an image, named by the filename pattern."""
+        filename = self.render_name(filename_prefix, item_id, date) + url_extension(url)
+        return self._claim(self.directory(item_id, date) / filename, item_id)
+
+    def attachment_path(
+        self,
+        attachment_id: str,
+        attachment_url: str,
+        date: datetime,
+        filename_prefix: str,
+        original_name: str | None,
+    ) -> Path:
+        """Path for a non-image attachment (file or video).
+
+        Uses the original filename if available (sanitised, with date prefix
+        for sortability and id suffix to disambiguate); otherwise falls back
+        to the same filename pattern images use, with the extension derived
+        from the URL path."""
+        if not original_name:
+            return self.image_path(attachment_id, attachment_url, date, filename_prefix)
+
+        safe = (
+            "".join(
+                c if c.isalnum() or c in "-_." else "_" for c in original_name
+            ).strip("._")
+            or attachment_id
+        )
+        stem, ext = os.path.splitext(safe)
+        filename = (
+            f"{filename_prefix}-{date.strftime('%Y-%m-%d_%H-%M-%S')}"
+            f"-{attachment_id}-{stem}{ext}"
+        )
+        return self._claim(
+            self.directory(attachment_id, date) / filename, attachment_id
+        )
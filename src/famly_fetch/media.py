@@ -0,0 +1,78 @@
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+
+from famly_fetch.file import File
+from famly_fetch.image import BaseImage, Image, SecretImage
+from famly_fetch.video import Video
+
+_MEDIA_TYPES = {cls.__name__: cls for cls in (Image, SecretImage, File, Video)}
+
+
+@dataclass
+class MediaItem:
+    """An image, file or video found on Famly, and where it was found.
+
+    `source` is one of "tagged", "note", "observation", "message" and "post".
+    `filename_prefix` is used for the file name when it's downloaded.
+    `child_id` is the child whose notes or learning journey it's from.
+    """
+
+    media: BaseImage | File | Video
+    source: str
+    filename_prefix: str
+    child_id: str | None = None
+    # Gets a fresh signed URL for an expired SecretImage, None if it's gone
+    refresh: Callable[[SecretImage], SecretImage | None] | None = field(
+        default=None, repr=False, compare=False
+    )
+
+    @property
+    def kind(self) -> str:
+        if isinstance(self.media, BaseImage):
+            return "image"
+        if isinstance(self.media, File):
+            return "file"
+        return "video"
+
+    @property
+    def item_id(self) -> str:
+        if isinstance(self.media, BaseImage):
+            return self.media.img_id
+        if isinstance(self.media, File):
+            return self.media.file_id
+        return self.media.video_id
+
+    @property
+    def date(self) -> datetime:
+        return self.media.date
+
+    @property
+    def text(self) -> str | None:
+        return self.media.text
+
+    @property
+    def url(self) -> str:
+        return self.media.url
+
+    def to_dict(self) -> dict:
+        """The item as JSON-serialisable data, see `from_dict`."""
+        media = asdict(self.media)
+        media["date"] = self.media.date.isoformat()
+        return {
+            "type": type(self.media).__name__,
+            "media": media,
+            "source": self.source,
+            "filename_prefix": self.filename_prefix,
+            "child_id": self.child_id,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "MediaItem":
+        media = dict(data["media"], date=datetime.fromisoformat(data["media"]["date"]))
+        return MediaItem(
+            media=_MEDIA_TYPES[data["type"]](**media),
+            source=data["source"],
+            filename_prefix=data["filename_prefix"],
+            child_id=data.get("child_id"),
+        )
@@ -0,0 +1,142 @@
+import threading
+
+
+class AdaptivePageSize:
+    """Page size for one paginated endpoint, adapted to how the server copes.
+
+    The size doubles while pages come back faster than `target_latency` and
+    smaller than `max_response_bytes` (both with some headroom), and halves
+    when a page is slow, too large, or the request fails. A size that made the
+    server refuse the request becomes the new upper bound.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: int | None = None,
+        adaptive: bool = True,
+        target_latency: float = 2.0,
+        max_response_bytes: int = 4_000_000,
+    ):
+        self.minimum = minimum
+        self.maximum = max(maximum or initial, initial)
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.max_response_bytes = max_response_bytes
+        self._size = initial
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.errors = 0
+        self.items = 0
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.seconds = 0.0
+        self.decode_seconds = 0.0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def record(
+        self,
+        latency: float,
+        response_bytes: int,
+        items: int,
+        wire_bytes: int | None = None,
+        decode_seconds: float = 0.0,
+    ):
+        """Record a successful page and adapt the size for the next one.
+
+        Args:
+            response_bytes (int): Size of the decoded response.
+            wire_bytes (int): Size as received, if it was compressed.
+            decode_seconds (float): Time spent decompressing and parsing it.
+        """
+        with self._lock:
+            self.requests += 1
+            self.items += items
+            self.bytes += response_bytes
+            self.wire_bytes += response_bytes if wire_bytes is None else wire_bytes
+            self.seconds += latency
+            self.decode_seconds += decode_seconds
+            if not self.adaptive:
+                return
+
+            if (
+                latency > self.target_latency
+                or response_bytes > self.max_response_bytes
+            ):
+                self._size = max(self.minimum, self._size // 2)
+            elif (
+                latency < self.target_latency / 2
+                and response_bytes < self.max_response_bytes / 2
+                # A short page means we've reached the end, growing won't help
+                and items >= self._size
+            ):
+                self._size = min(self.maximum, self._size * 2)
+
+    def failed(self, refused: bool = False) -> bool:
+        """Record a failed page and shrink the size.
+
+        Args:
+            refused (bool): The server rejected the request itself, so the
+                current size must not be tried again.
+
+        Returns:
+            bool: True if there is a smaller size left to try.
+        """
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+            if not self.adaptive or self._size <= self.minimum:
+                return False
+            if refused:
+                self.maximum = max(self.minimum, self._size - 1)
+            self._size = max(self.minimum, self._size // 2)
+            return True
+
+    def fork(self) -> "AdaptivePageSize":
+        """A pager for one of several concurrent crawls of this endpoint.
+
+        It starts from the current size and adapts to its own pages only, so
+        the crawls don't shrink or grow each other's pages; `merge` it back
+        once its crawl is done."""
+        with self._lock:
+            forked = AdaptivePageSize(
+                self._size,
+                minimum=self.minimum,
+                adaptive=self.adaptive,
+                target_latency=self.target_latency,
+                max_response_bytes=self.max_response_bytes,
+            )
+            forked.maximum = self.maximum
+        return forked
+
+    def merge(self, forked: "AdaptivePageSize"):
+        """Add the statistics of a forked pager, and take over the size it
+        ended with."""
+        with self._lock, forked._lock:
+            self.requests += forked.requests
+            self.errors += forked.errors
+            self.items += forked.items
+            self.bytes += forked.bytes
+            self.wire_bytes += forked.wire_bytes
+            self.seconds += forked.seconds
+            self.decode_seconds += forked.decode_seconds
+            self.maximum = min(self.maximum, forked.maximum)
+            self._size = min(forked._size, self.maximum)
+
+    def summary(self) -> str:
+        pages_per_second = (
+            (self.requests - self.errors) / self.seconds if self.seconds else 0
+        )
+        pages = self.requests - self.errors
+        decode_ms = 1000 * self.decode_seconds / pages if pages else 0
+        return (
+            f"{self.requests} requests ({self.errors} failed), {self.items} items, "
+            f"{self.bytes / 1_000_000:.1f} MB ({self.wire_bytes / 1_000_000:.1f} MB "
+            f"received), {decode_ms:.1f} ms decoding per page, "
+            f"{pages_per_second:.2f} pages/s, page size now {self._size}"
+        )
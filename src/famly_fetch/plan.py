@@ -0,0 +1,211 @@
+import json
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import timedelta
+from pathlib import Path
+
+import click
+
+from famly_fetch.downloader import TAGGED_PAUSE, FamlyDownloader
+from famly_fetch.media import MediaItem
+
+# Used to estimate the run time when --max-rate isn't set, and the time per
+# item when it wasn't measured with HEAD requests
+ASSUMED_RATE = 5_000_000
+ASSUMED_LATENCY = 0.3
+
+
+@dataclass
+class PlannedItem:
+    item: MediaItem
+    child: str | None
+    url: str
+    size: int | None = None
+
+
+@dataclass
+class Totals:
+    items: int = 0
+    images: int = 0
+    files: int = 0
+    videos: int = 0
+    bytes: int = 0
+    unknown_sizes: int = 0
+
+    def add(self, planned: PlannedItem):
+        self.items += 1
+        if planned.item.kind == "image":
+            self.images += 1
+        elif planned.item.kind == "file":
+            self.files += 1
+        else:
+            self.videos += 1
+        if planned.size is None:
+            self.unknown_sizes += 1
+        else:
+            self.bytes += planned.size
+
+    def describe(self) -> str:
+        size = f"{self.bytes / 1_000_000:.1f} MB"
+        if self.unknown_sizes:
+            size += f" (+{self.unknown_sizes} of unknown size)"
+        return (
+            f"{self.items} items ({self.images} images, {self.files} files, "
+            f"{self.videos} videos), {size}"
+        )
+
+
+@dataclass
+class Plan:
+    """The items a run would download, see `make_plan`."""
+
+    items: list[PlannedItem] = field(default_factory=list)
+    # Already downloaded items that were skipped
+    skipped: int = 0
+    # Mean time of a HEAD request, if sizes were asked for
+    latency: float | None = None
+
+    def totals(self) -> Totals:
+        totals = Totals()
+        for planned in self.items:
+            totals.add(planned)
+        return totals
+
+    def totals_by(self, key) -> dict[str, Totals]:
+        groups: dict[str, Totals] = {}
+        for planned in self.items:
+            groups.setdefault(key(planned), Totals()).add(planned)
+        return groups
+
+    def estimated_bytes(self) -> int:
+        """The total size, with the unknown sizes taken as the mean known one."""
+        totals = self.totals()
+        known = totals.items - totals.unknown_sizes
+        mean = totals.bytes / known if known else 0
+        return round(totals.bytes + totals.unknown_sizes * mean)
+
+    def estimated_seconds(self, rate: float | None) -> float:
+        """How long downloading everything takes at `rate` bytes per second."""
+        tagged = sum(1 for planned in self.items if planned.item.source == "tagged")
+        latency = self.latency if self.latency is not None else ASSUMED_LATENCY
+        return (
+            tagged * TAGGED_PAUSE
+            + len(self.items) * latency
+            + self.estimated_bytes() / (rate or ASSUMED_RATE)
+        )
+
+
+def make_plan(
+    downloader: FamlyDownloader,
+    sources: dict[str, Iterable[MediaItem]],
+    children: dict[str, str],
+    sizes: bool = False,
+    workers: int = 8,
+) -> Plan:
+    """Walk the sources like a run would, without downloading anything.
+
+    Items already downloaded are left out; with `stop_on_existing` a source
+    ends at the first one, like in a run. `children` maps child ids to names.
+    With `sizes`, the size of every item is asked for with a HEAD request,
+    `workers` at a time.
+    """
+    plan = Plan()
+    handled: set[str] = set()
+    for name, items in sources.items():
+        click.echo(f"Planning {name}...")
+        try:
+            for item in items:
+                if item.item_id in handled:
+                    continue
+                handled.add(item.item_id)
+                if downloader.is_downloaded(item):
+                    plan.skipped += 1
+                    if downloader.stop_on_existing:
+                        break
+                    continue
+                plan.items.append(
+                    PlannedItem(
+                        item,
+                        children.get(item.child_id) if item.child_id else None,
+                        downloader.media_url(item),
+                    )
+                )
+        except Exception as e:
+            click.secho(f"An exception occurred in {name}: {e}", fg="red")
+
+    if sizes and plan.items:
+        click.echo(f"Sending {len(plan.items)} HEAD requests...")
+
+        def head(planned: PlannedItem) -> float:
+            started = time.monotonic()
+            try:
+                planned.size = downloader.head_size(planned.url)
+            except Exception as e:
+                click.secho(f"No size for {planned.item.item_id}: {e}", fg="yellow")
+            return time.monotonic() - started
+
+        with ThreadPoolExecutor(workers) as executor:
+            latencies = list(executor.map(head, plan.items))
+        plan.latency = sum(latencies) / len(latencies)
+    return plan
+
+
+def print_plan(plan: Plan, rate: float | None = None):
+    click.secho("By source:", fg="green")
+    for source, totals in sorted(plan.totals_by(lambda p: p.item.source).items()):
+        click.echo(f"  {source}: {totals.describe()}")
+    by_child = plan.totals_by(lambda p: p.child or "")
+    by_child.pop("", None)
+    if by_child:
+        click.secho("By child:", fg="green")
+        for child, totals in sorted(by_child.items()):
+            click.echo(f"  {child}: {totals.describe()}")
+
+    duration = timedelta(seconds=round(plan.estimated_seconds(rate)))
+    rate_text = f"{(rate or ASSUMED_RATE) / 1_000_000:g} MB/s"
+    if not rate:
+        rate_text += " (assumed, set --max-rate to plan with yours)"
+    click.secho(
+        f"To download: {plan.totals().describe()}, {plan.skipped} already "
+        f"downloaded. About {duration} at {rate_text}.",
+        fg="cyan",
+    )
+    if plan.totals().unknown_sizes and plan.latency is None:
+        click.secho("Run with --plan-sizes to include the sizes.", fg="yellow")
+
+
+def write_manifest(plan: Plan, path: Path, rate: float | None = None):
+    """Write the plan as JSON: the totals, per source and per child, and the
+    items."""
+    manifest = {
+        "totals": asdict(plan.totals()),
+        "already_downloaded": plan.skipped,
+        "estimated_bytes": plan.estimated_bytes(),
+        "estimated_seconds": round(plan.estimated_seconds(rate)),
+        "sources": {
+            source: asdict(totals)
+            for source, totals in plan.totals_by(lambda p: p.item.source).items()
+        },
+        "children": {
+            child: asdict(totals)
+            for child, totals in plan.totals_by(lambda p: p.child or "").items()
+            if child
+        },
+        "items": [
+            {
+                "id": planned.item.item_id,
+                "kind": planned.item.kind,
+                "source": planned.item.source,
+                "child": planned.child,
+                "date": planned.item.date.isoformat(),
+                "url": planned.url,
+                "size": planned.size,
+            }
+            for planned in plan.items
+        ],
+    }
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    click.echo(f"Wrote the plan to {path}")
@@ -0,0 +1,79 @@
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+
+import click
+
+
+class PostProcessor:
+    """Run CPU-bound work on downloaded files (EXIF, sidecars) in worker
+    processes, so it overlaps with the downloads and uses several cores.
+
+    At most `max_pending` jobs are queued; `submit` blocks when the queue is
+    full, which keeps downloads from running arbitrarily far ahead. With
+    `workers=0` jobs run inline on the calling thread instead.
+
+    `then`, if given, is called in this process once the job has succeeded,
+    e.g. to mark the item as downloaded. `failed`, if given, is called with
+    the error instead when the job fails; without it the failure is only
+    reported (or raised, when running inline).
+    """
+
+    def __init__(self, workers: int = 0, max_pending: int | None = None):
+        self.workers = workers
+        self.failures = 0
+        self._executor = ProcessPoolExecutor(workers) if workers > 0 else None
+        self._slots = threading.BoundedSemaphore(max_pending or max(1, workers) * 4)
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        fn: Callable,
+        *args,
+        then: Callable[[], None] | None = None,
+        failed: Callable[[BaseException], None] | None = None,
+    ):
+        if self._executor is None:
+            try:
+                fn(*args)
+            except Exception as e:
+                if failed is None:
+                    raise
+                failed(e)
+                return
+            if then is not None:
+                then()
+            return
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(partial(self._done, then=then, failed=failed))
+
+    def _done(
+        self,
+        future: Future,
+        then: Callable[[], None] | None = None,
+        failed: Callable[[BaseException], None] | None = None,
+    ):
+        self._slots.release()
+        error = future.exception()
+        if error is not None:
+            with self._lock:
+                self.failures += 1
+            if failed is not None:
+                failed(error)
+            else:
+                click.secho(f"Post-processing failed: {error}", fg="red")
+        elif then is not None:
+            then()
+
+    def close(self):
+        """Wait for the queued jobs to finish and stop the workers."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
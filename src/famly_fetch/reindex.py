@@ -0,0 +1,116 @@
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import click
+
+from famly_fetch.exif import read_image_id
+from famly_fetch.layout import FileLayout
+from famly_fetch.verify import JPEG_EXTENSIONS, is_sidecar, state_files, walk_files
+
+# Famly ids are UUIDs
+_UUID = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE
+)
+
+
+def file_id(entry: os.DirEntry, layout: FileLayout) -> str | None:
+    """The id of the item a downloaded file belongs to, if it can be told.
+
+    The name is read back through the layout first. Names of attachments with
+    an original filename can be split several ways; the name only counts if
+    exactly one of the candidates is a UUID, or there is only one candidate.
+    A wrong id in the state would make its item be skipped for good, so
+    otherwise the sidecar metadata and, for JPEGs, the EXIF data are read,
+    and the file isn't recognised if they don't tell either.
+    """
+    candidates = list(dict.fromkeys(layout.candidate_ids(entry.name)))
+    uuids = [c for c in candidates if _UUID.fullmatch(c)]
+    if len(uuids) == 1:
+        return uuids[0]
+    if len(candidates) == 1 and not uuids:
+        return candidates[0]
+
+    try:
+        with open(entry.path + ".json", "r") as f:
+            return json.load(f)["id"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    if os.path.splitext(entry.name)[1].lower() in JPEG_EXTENSIONS:
+        return read_image_id(entry.path)
+    return None
+
+
+def reindex(
+    pictures_folder: Path,
+    state_file: Path,
+    layout: FileLayout,
+    workers: int | None = None,
+) -> int:
+    """Rebuild the state file from the files in the pictures folder, so a
+    lost or stale state doesn't mean downloading everything again.
+
+    Ids already in the state file are kept, so running it again with another
+    `layout` adds the files named differently. Items in an archive are taken
+    from the archive index next to the state file.
+
+    Returns:
+        int: The number of ids added.
+    """
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    state: dict[str, str] = {}
+    if state_file.exists():
+        with open(state_file, "r") as f:
+            state = json.load(f)
+    before = len(state)
+
+    skip = state_files(state_file)
+    click.echo(f"Scanning {pictures_folder}")
+    files = [
+        entry
+        for entry in walk_files(pictures_folder, workers)
+        if not is_sidecar(entry) and Path(entry.path) not in skip
+    ]
+
+    recognised = 0
+    with ThreadPoolExecutor(workers) as executor:
+        results = executor.map(lambda entry: file_id(entry, layout), files)
+        for entry, item_id in zip(files, results):
+            if not item_id:
+                continue
+            recognised += 1
+            downloaded_at = datetime.fromtimestamp(
+                entry.stat().st_mtime, timezone.utc
+            ).isoformat()
+            state.setdefault(item_id, downloaded_at)
+
+    archive_index = state_file.with_suffix(".archive.jsonl")
+    if archive_index.exists():
+        now = datetime.now(timezone.utc).isoformat()
+        with open(archive_index, "r") as f:
+            for line in f:
+                item_id = json.loads(line)["id"] if line.strip() else None
+                if item_id:
+                    state.setdefault(item_id, now)
+
+    with open(state_file, "w") as f:
+        json.dump(state, f)
+
+    added = len(state) - before
+    click.secho(
+        f"Recognised {recognised} of {len(files)} files, added {added} ids to "
+        f"{state_file}.",
+        fg="green",
+    )
+    if recognised < len(files):
+        click.secho(
+            f"{len(files) - recognised} file(s) weren't recognised. If they were "
+            "downloaded with another --filename-pattern, run --reindex again "
+            "with that one.",
+            fg="yellow",
+        )
+    return added
@@ -0,0 +1,247 @@
+import http.client
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import TypeVar
+
+import click
+
+T = TypeVar("T")
+
+# HTTP statuses worth trying again, everything else >= 400 is permanent
+TRANSIENT_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# HTTP statuses that mean the request took too long
+TIMEOUT_STATUSES = {408, 504}
+
+
+class ApiError(Exception):
+    """A request to Famly (API or media) that failed."""
+
+    def __init__(
+        self,
+        message: str,
+        url: str | None = None,
+        status: int | None = None,
+        retry_after: float | None = None,
+    ):
+        super().__init__(message)
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TransientError(ApiError):
+    """A failure that may go away if the request is retried."""
+
+
+class RequestTimeout(TransientError):
+    """The request timed out, possibly because it asked for too much."""
+
+
+class PermanentError(ApiError):
+    """A failure that retrying won't fix, e.g. 401 or 404."""
+
+
+class CircuitOpenError(TransientError):
+    """Raised without sending the request because the host keeps failing."""
+
+
+def _retry_after(headers) -> float | None:
+    value = headers.get("Retry-After") if headers else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def error_for_status(
+    status: int, message: str, url: str, retry_after: float | None = None
+) -> ApiError:
+    """The ApiError for a failed response with HTTP status `status`."""
+    if status in TIMEOUT_STATUSES:
+        cls = RequestTimeout
+    elif status in TRANSIENT_STATUSES:
+        cls = TransientError
+    else:
+        cls = PermanentError
+    return cls(message, url, status, retry_after)
+
+
+def classify(exc: BaseException, url: str) -> ApiError | None:
+    """Map an exception from urllib/http.client to an ApiError subclass.
+
+    Returns None for exceptions that aren't request failures (e.g. bugs),
+    which should propagate unchanged.
+    """
+    if isinstance(exc, ApiError):
+        return exc
+    if isinstance(exc, urllib.error.HTTPError):
+        try:
+            body = exc.read()[:200].decode("utf-8", errors="replace")
+        except Exception:
+            body = ""
+        message = f"HTTP {exc.code} from {url}: {body}".rstrip(": ")
+        return error_for_status(exc.code, message, url, _retry_after(exc.headers))
+    if isinstance(exc, TimeoutError) or isinstance(
+        getattr(exc, "reason", None), TimeoutError
+    ):
+        return RequestTimeout(f"Timed out requesting {url}", url)
+    if isinstance(
+        exc,
+        (
+            urllib.error.URLError,
+            TimeoutError,
+            ConnectionError,
+            http.client.HTTPException,
+        ),
+    ):
+        reason = getattr(exc, "reason", None) or exc
+        return TransientError(f"{type(exc).__name__} for {url}: {reason}", url)
+    return None
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """Exponential backoff with full jitter, honouring Retry-After."""
+        backoff = min(self.max_delay, self.base_delay * 2**attempt)
+        delay = random.uniform(0, backoff)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+# Seconds to wait before checking again on a trial request to an open breaker
+TRIAL_POLL_INTERVAL = 1.0
+
+
+class CircuitBreaker:
+    """Stop sending requests to a host after repeated transient failures.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    requests fail immediately for `reset_timeout` seconds. Then a single trial
+    request is let through (half-open); success closes the breaker again,
+    failure re-opens it. The error raised while it's open says how long to
+    wait in `retry_after`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_request(self, host: str):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self._reset_timeout:
+                raise CircuitOpenError(
+                    f"Too many failures from {host}, backing off",
+                    retry_after=self._reset_timeout - elapsed,
+                )
+            if self._trial_running:
+                raise CircuitOpenError(
+                    f"Waiting for trial request to {host}",
+                    retry_after=TRIAL_POLL_INTERVAL,
+                )
+            self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._failures >= self._failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class Retrier:
+    """Run requests with retries and one circuit breaker per host, which
+    stays open for `reset_timeout` seconds."""
+
+    def __init__(self, policy: RetryPolicy | None = None, reset_timeout: float = 30):
+        self.policy = policy or RetryPolicy()
+        self.reset_timeout = reset_timeout
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(reset_timeout=self.reset_timeout)
+            return self._breakers[host]
+
+    def call(self, url: str, request: Callable[[], T]) -> T:
+        """Call `request` until it succeeds, retrying transient failures.
+
+        While the host's breaker is open, the call waits for the trial request
+        instead of failing, and the wait counts as an attempt.
+
+        Raises:
+            PermanentError: If the request can't succeed.
+            TransientError: If the request still fails after all attempts.
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        breaker = self.breaker(host)
+
+        attempt = 0
+        while True:
+            try:
+                breaker.before_request(host)
+            except CircuitOpenError as error:
+                attempt += 1
+                if attempt >= self.policy.max_attempts:
+                    raise
+                click.secho(
+                    f"{error} (attempt {attempt}/{self.policy.max_attempts}), "
+                    f"waiting {error.retry_after:.1f}s",
+                    fg="yellow",
+                )
+                time.sleep(error.retry_after)
+                continue
+            try:
+                result = request()
+            except Exception as e:
+                error = classify(e, url)
+                if error is None:
+                    raise
+
+                if isinstance(error, PermanentError):
+                    # The host answered, so it is healthy
+                    breaker.record_success()
+                    raise error from (None if error is e else e)
+
+                breaker.record_failure()
+                attempt += 1
+                if attempt >= self.policy.max_attempts:
+                    raise error from (None if error is e else e)
+
+                delay = self.policy.delay(attempt, error.retry_after)
+                click.secho(
+                    f"{error} (attempt {attempt}/{self.policy.max_attempts}), "
+                    f"retrying in {delay:.1f}s",
+                    fg="yellow",
+                )
+                time.sleep(delay)
+                continue
+
+            breaker.record_success()
+            return result
@@ -0,0 +1,418 @@
+import hashlib
+import hmac
+import os
+import tempfile
+import urllib.parse
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import BinaryIO
+
+from famly_fetch.connection_pool import ConnectionPool
+from famly_fetch.retry import PermanentError, Retrier, RetryPolicy
+
+# S3 needs parts of at least 5 MiB, except for the last one
+S3_PART_SIZE = 8 * 1024 * 1024
+
+_EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+
+class StorageWriter:
+    """A file being written to a storage backend.
+
+    `close` makes the file available under its key; `abort` throws away
+    whatever was written."""
+
+    def write(self, data) -> int:
+        raise NotImplementedError
+
+    def tell(self) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+
+class Storage:
+    """Where downloaded files end up, by key (a relative path like
+    `2024-01-15/tagged-...jpg`)."""
+
+    def open(
+        self,
+        key: str,
+        item_id: str | None = None,
+        mtime: float | None = None,
+        size: int | None = None,
+    ) -> StorageWriter:
+        """Start writing `key`. `item_id` and `mtime` are used by backends
+        that keep an index or file times, `size` (the expected size, if
+        known) by backends that can reserve space up front."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Path | None:
+        """The file on the local disk, for backends that have one."""
+        return None
+
+    def close(self):
+        pass
+
+    @contextmanager
+    def writer(
+        self,
+        key: str,
+        item_id: str | None = None,
+        mtime: float | None = None,
+        size: int | None = None,
+    ):
+        """Open `key` for writing, and abort the write if the block fails."""
+        out = self.open(key, item_id=item_id, mtime=mtime, size=size)
+        try:
+            yield out
+        except BaseException:
+            out.abort()
+            raise
+        out.close()
+
+    def write_bytes(self, key: str, data: bytes, **kwargs):
+        with self.writer(key, **kwargs) as out:
+            out.write(data)
+
+
+class _LocalWriter(StorageWriter):
+    def __init__(self, path: Path, size: int | None = None):
+        self._path = path
+        self._file = open(path, "wb")
+        self._preallocated = False
+        if size and hasattr(os, "posix_fallocate"):
+            # Reserving the whole file at once keeps it in one piece on disk
+            # and spares the file system growing it block by block
+            try:
+                os.posix_fallocate(self._file.fileno(), 0, size)
+                self._preallocated = True
+            except OSError:
+                pass  # not supported by every file system
+
+    def write(self, data) -> int:
+        return self._file.write(data)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def close(self):
+        if self._preallocated:
+            # In case less arrived than announced
+            self._file.truncate()
+        self._file.close()
+
+    def abort(self):
+        # Don't leave a truncated file behind
+        self._file.close()
+        self._path.unlink(missing_ok=True)
+
+
+class LocalStorage(Storage):
+    """Files below a folder on the local disk. Parent folders of keys must
+    exist already, the file layout takes care of creating them."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def open(self, key, item_id=None, mtime=None, size=None) -> StorageWriter:
+        return _LocalWriter(self.root / key, size)
+
+    def exists(self, key: str) -> bool:
+        return (self.root / key).exists()
+
+    def local_path(self, key: str) -> Path:
+        return self.root / key
+
+
+def _quote(value: str, safe: str = "-_.~") -> str:
+    return urllib.parse.quote(value, safe=safe)
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def sigv4_headers(
+    method: str,
+    host: str,
+    path: str,
+    query: dict[str, str],
+    headers: dict[str, str],
+    payload_hash: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    now: datetime | None = None,
+) -> dict[str, str]:
+    """Sign an S3 request with AWS Signature Version 4.
+
+    Returns `headers` plus the `Host`, `x-amz-*` and `Authorization` headers
+    to send. `path` is the decoded object path, e.g. `/bucket/some key.jpg`.
+    """
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    date = amz_date[:8]
+
+    headers = dict(headers)
+    headers["Host"] = host
+    headers["x-amz-content-sha256"] = payload_hash
+    headers["x-amz-date"] = amz_date
+
+    canonical_headers = sorted((k.lower(), str(v).strip()) for k, v in headers.items())
+    signed_headers = ";".join(k for k, _ in canonical_headers)
+    canonical_request = "\n".join(
+        [
+            method,
+            _quote(path, safe="-_.~/"),
+            "&".join(f"{_quote(k)}={_quote(v)}" for k, v in sorted(query.items())),
+            "".join(f"{k}:{v}\n" for k, v in canonical_headers),
+            signed_headers,
+            payload_hash,
+        ]
+    )
+
+    scope = f"{date}/{region}/s3/aws4_request"
+    string_to_sign = "\n".join(
+        [
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ]
+    )
+    signing_key = _hmac(
+        _hmac(_hmac(_hmac(f"AWS4{secret_key}".encode(), date), region), "s3"),
+        "aws4_request",
+    )
+    signature = hmac.new(
+        signing_key, string_to_sign.encode(), hashlib.sha256
+    ).hexdigest()
+
+    headers["Authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return headers
+
+
+class _MultipartWriter(StorageWriter):
+    """Upload a stream to S3 as it is written.
+
+    Data is buffered up to one part; small files are sent with a single PUT
+    once closed, larger ones become a multipart upload, part by part."""
+
+    def __init__(self, storage: "S3Storage", key: str):
+        self._storage = storage
+        self._key = key
+        self._buffer = bytearray()
+        self._size = 0
+        self._upload_id: str | None = None
+        self._parts: list[str] = []
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._size += len(data)
+        while len(self._buffer) >= self._storage.part_size:
+            part = bytes(self._buffer[: self._storage.part_size])
+            del self._buffer[: self._storage.part_size]
+            self._upload_part(part)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._size
+
+    def _upload_part(self, part: bytes):
+        if self._upload_id is None:
+            response = self._storage.request("POST", self._key, {"uploads": ""})
+            self._upload_id = _xml_text(response, "UploadId")
+        number = len(self._parts) + 1
+        etag = self._storage.request(
+            "PUT",
+            self._key,
+            {"partNumber": str(number), "uploadId": self._upload_id},
+            body=part,
+            response_header="ETag",
+        )
+        self._parts.append(etag)
+
+    def close(self):
+        if self._upload_id is None:
+            self._storage.request("PUT", self._key, body=bytes(self._buffer))
+            return
+        if self._buffer or not self._parts:
+            self._upload_part(bytes(self._buffer))
+        self._buffer = bytearray()
+        body = "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+            for number, etag in enumerate(self._parts, start=1)
+        )
+        self._storage.request(
+            "POST",
+            self._key,
+            {"uploadId": self._upload_id},
+            body=(
+                f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>"
+            ).encode(),
+        )
+
+    def abort(self):
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            self._storage.request("DELETE", self._key, {"uploadId": self._upload_id})
+
+
+def _xml_text(document: bytes, tag: str) -> str:
+    for element in ET.fromstring(document).iter():
+        # Ignore the S3 namespace
+        if element.tag.rsplit("}", 1)[-1] == tag:
+            return element.text or ""
+    raise ValueError(f"No {tag} in S3 response")
+
+
+class S3Storage(Storage):
+    """Objects in an S3 compatible bucket (AWS, MinIO, Ceph, ...), addressed
+    path-style as `<endpoint>/<bucket>/<prefix>/<key>`.
+
+    Nothing is written to the local disk; data is uploaded while it is being
+    downloaded, in parts of `part_size` bytes."""
+
+    def __init__(
+        self,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        endpoint_url: str = "https://s3.amazonaws.com",
+        region: str = "us-east-1",
+        prefix: str = "",
+        pool: ConnectionPool | None = None,
+        retrier: Retrier | None = None,
+        part_size: int = S3_PART_SIZE,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.region = region
+        self.part_size = part_size
+        self._access_key = access_key
+        self._secret_key = secret_key
+        self._host = urllib.parse.urlsplit(self.endpoint_url).netloc
+        # A pool passed in is shared, and closed by its owner
+        self._owns_pool = pool is None
+        self._pool = pool or ConnectionPool()
+        self._retrier = retrier or Retrier(RetryPolicy())
+
+    @staticmethod
+    def from_url(url: str, **kwargs) -> "S3Storage":
+        """Create the storage for an `s3://bucket/prefix` URL."""
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != "s3" or not parsed.netloc:
+            raise ValueError(f"Not an s3://bucket/prefix URL: {url}")
+        return S3Storage(bucket=parsed.netloc, prefix=parsed.path, **kwargs)
+
+    def _path(self, key: str) -> str:
+        return "/" + "/".join(p for p in (self.bucket, self.prefix, key) if p)
+
+    def request(
+        self,
+        method: str,
+        key: str,
+        query: dict[str, str] | None = None,
+        body: bytes = b"",
+        response_header: str | None = None,
+    ):
+        """Send a signed request for `key`, with retries.
+
+        Returns:
+            The response body, or the value of `response_header`.
+        """
+        query = query or {}
+        path = self._path(key)
+        url = self.endpoint_url + _quote(path, safe="-_.~/")
+        if query:
+            url += "?" + "&".join(
+                f"{_quote(k)}={_quote(v)}" if v else _quote(k) for k, v in query.items()
+            )
+        payload_hash = hashlib.sha256(body).hexdigest() if body else _EMPTY_SHA256
+
+        def send():
+            # Signed per attempt, the signature includes the time
+            headers = sigv4_headers(
+                method,
+                self._host,
+                path,
+                query,
+                {"Content-Length": str(len(body))},
+                payload_hash,
+                self._access_key,
+                self._secret_key,
+                self.region,
+            )
+            with self._pool.urlopen(method, url, body=body, headers=headers) as r:
+                data = r.read()
+                if response_header:
+                    return r.getheader(response_header)
+                return data
+
+        return self._retrier.call(url, send)
+
+    def open(self, key, item_id=None, mtime=None, size=None) -> StorageWriter:
+        return _MultipartWriter(self, key)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.request("HEAD", key)
+        except PermanentError as e:
+            if e.status == 404:
+                return False
+            raise
+        return True
+
+    def write_bytes(self, key: str, data: bytes, **kwargs):
+        if len(data) < self.part_size:
+            self.request("PUT", key, body=data)
+        else:
+            super().write_bytes(key, data, **kwargs)
+
+    def close(self):
+        if self._owns_pool:
+            self._pool.close()
+
+
+class SpoolWriter(StorageWriter):
+    """Collect a file in memory, or in a temporary file beyond `max_size`,
+    and hand it to `commit` once complete."""
+
+    def __init__(self, commit, max_size: int = 32 * 1024 * 1024):
+        self._commit = commit
+        self._spool: BinaryIO = tempfile.SpooledTemporaryFile(max_size)  # type: ignore[assignment]
+
+    def write(self, data) -> int:
+        return self._spool.write(data)
+
+    def tell(self) -> int:
+        return self._spool.tell()
+
+    def close(self):
+        size = self._spool.tell()
+        self._spool.seek(0)
+        try:
+            self._commit(self._spool, size)
+        finally:
+            self._spool.close()
+
+    def abort(self):
+        self._spool.close()
@@ -0,0 +1,178 @@
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import time as dtime
+
+# Chunk sizes for copying media, smaller ones pace a limited rate more smoothly
+COPY_CHUNK_SIZE = 1024 * 1024
+LIMITED_CHUNK_SIZE = 16 * 1024
+
+_RATE = re.compile(r"(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b(?:/s)?)?", re.IGNORECASE)
+_UNITS = {"": 1, "k": 1_000, "m": 1_000_000, "g": 1_000_000_000}
+
+
+def parse_rate(value: str) -> float | None:
+    """Parse a rate in bytes per second, like "500K", "2M" or "1.5MB/s".
+
+    Returns:
+        float | None: The rate, or None for "unlimited".
+    """
+    value = value.strip()
+    if value.lower() in ("unlimited", "none", "off"):
+        return None
+    match = _RATE.fullmatch(value)
+    if not match:
+        raise ValueError(f"Invalid rate {value!r}, expected e.g. 500K or 2M")
+    rate = float(match.group(1)) * _UNITS[match.group(2).lower()]
+    if rate <= 0:
+        raise ValueError(f"Invalid rate {value!r}, use 'unlimited' for no limit")
+    return rate
+
+
+def parse_size(value: str) -> int:
+    """Parse a number of bytes, like "500M", "2G" or "1.5GB"."""
+    match = _RATE.fullmatch(value.strip())
+    if not match:
+        raise ValueError(f"Invalid size {value!r}, expected e.g. 500M or 2G")
+    return int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+
+
+@dataclass
+class RateWindow:
+    start: dtime
+    end: dtime
+    rate: float | None
+
+    def covers(self, t: dtime) -> bool:
+        if self.start <= self.end:
+            return self.start <= t < self.end
+        # Wraps around midnight, e.g. 22:00-06:00
+        return t >= self.start or t < self.end
+
+
+class RateSchedule:
+    """The rate limit by time of day: the first window covering the current
+    local time applies, `default` outside all windows."""
+
+    def __init__(self, default: float | None, windows: list[RateWindow] | None = None):
+        self.default = default
+        self.windows = windows or []
+
+    @staticmethod
+    def parse(spec: str, default: float | None = None) -> "RateSchedule":
+        """Parse windows like "08:00-18:00=200K,22:00-06:00=unlimited"."""
+        windows = []
+        for part in filter(None, (p.strip() for p in spec.split(","))):
+            try:
+                span, rate = part.split("=")
+                start, end = span.split("-")
+                windows.append(
+                    RateWindow(
+                        dtime.fromisoformat(start.strip()),
+                        dtime.fromisoformat(end.strip()),
+                        parse_rate(rate),
+                    )
+                )
+            except ValueError as e:
+                raise ValueError(
+                    f"Invalid schedule entry {part!r}, expected HH:MM-HH:MM=RATE ({e})"
+                ) from None
+        return RateSchedule(default, windows)
+
+    def rate_at(self, now: datetime) -> float | None:
+        t = now.time()
+        for window in self.windows:
+            if window.covers(t):
+                return window.rate
+        return self.default
+
+
+class RateLimiter:
+    """One byte budget shared by all downloads, as a token bucket.
+
+    Tokens flow in at the scheduled rate, up to `burst_seconds` worth. A
+    download takes tokens for every chunk it reads and, when the bucket runs
+    dry, sleeps until its share has flowed in. Reading stops meanwhile, so
+    TCP flow control slows the sender down too.
+    """
+
+    def __init__(self, schedule: RateSchedule, burst_seconds: float = 0.25):
+        self.schedule = schedule
+        self.burst_seconds = burst_seconds
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._rate = schedule.rate_at(datetime.now())
+        self._rate_checked = self._last
+
+    @property
+    def rate(self) -> float | None:
+        return self._rate
+
+    @property
+    def chunk_size(self) -> int:
+        return COPY_CHUNK_SIZE if self._rate is None else LIMITED_CHUNK_SIZE
+
+    def consume(self, n: int):
+        """Take `n` bytes from the budget, waiting if it's used up."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._rate_checked >= 1:
+                self._rate = self.schedule.rate_at(datetime.now())
+                self._rate_checked = now
+            if self._rate is None:
+                self._last = now
+                return
+
+            burst = self._rate * self.burst_seconds
+            self._tokens = min(burst, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            # Going into debt makes the next callers wait for this one too
+            self._tokens -= n
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+_buffers = threading.local()
+
+
+def _copy_buffer(size: int) -> memoryview:
+    """A buffer of `size` bytes, reused by every copy on this thread."""
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None or len(buffer) < size:
+        buffer = _buffers.buffer = memoryview(bytearray(size))
+    return buffer[:size]
+
+
+def copy_stream(src, dst, limiter: RateLimiter | None = None) -> int:
+    """Copy a file-like object to another, within the rate limit.
+
+    Sources with `readinto` (like HTTP responses) are read into a buffer that
+    is reused for every chunk, so a large download doesn't allocate and free
+    a new chunk per read. `dst` must be done with the data when `write`
+    returns.
+
+    Returns:
+        int: The number of bytes copied.
+    """
+    chunk_size = limiter.chunk_size if limiter else COPY_CHUNK_SIZE
+    total = 0
+    readinto = getattr(src, "readinto", None)
+    if readinto is None:
+        while chunk := src.read(chunk_size):
+            if limiter:
+                limiter.consume(len(chunk))
+            dst.write(chunk)
+            total += len(chunk)
+        return total
+
+    buffer = _copy_buffer(chunk_size)
+    while n := readinto(buffer):
+        if limiter:
+            limiter.consume(n)
+        dst.write(buffer[:n])
+        total += n
+    return total
@@ -0,0 +1,314 @@
+import hashlib
+import json
+import mmap
+import os
+from collections.abc import Callable, Collection, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import click
+
+from famly_fetch.layout import FileLayout
+
+JPEG_EXTENSIONS = {".jpg", ".jpeg"}
+
+# Share of the state that may be missing, or of the files that may be
+# unrecognised, before verify suspects the wrong layout and leaves the state
+SUSPICIOUS_SHARE = 0.5
+
+
+def state_files(state_file: Path) -> set[Path]:
+    """The state file and the files kept next to it, which may be in the
+    pictures folder but aren't downloads."""
+    suffixes = (
+        ".ids",
+        ".ids.tmp",
+        ".json.tmp",
+        ".archive.jsonl",
+        ".capped.json",
+        ".failed.json",
+        ".failed.json.tmp",
+        ".hashes.json",
+    )
+    return {state_file} | {state_file.with_suffix(s) for s in suffixes}
+
+
+def is_sidecar(entry: os.DirEntry) -> bool:
+    """Check if a file is the metadata sidecar (`<file>.json`) of the file
+    next to it, rather than e.g. a downloaded JSON attachment."""
+    return entry.name.endswith(".json") and os.path.exists(entry.path[: -len(".json")])
+
+
+def _walk(path: str) -> Iterator[os.DirEntry]:
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def walk_files(root: Path, workers: int) -> list[os.DirEntry]:
+    """List all files below `root`, walking its subfolders in parallel."""
+    files = []
+    subdirs = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                files.append(entry)
+    with ThreadPoolExecutor(workers) as executor:
+        for found in executor.map(lambda d: list(_walk(d)), subdirs):
+            files.extend(found)
+    return files
+
+
+def check_jpeg(data) -> str | None:
+    """Check the structure of a JPEG, without decoding it.
+
+    The segments up to the image data must be complete, an EXIF segment
+    must be present and well-formed, and the file must end with an EOI
+    marker (a truncated download doesn't).
+
+    Returns:
+        str | None: The problem found, or None if the file looks fine.
+    """
+    size = len(data)
+    if size < 4 or data[:2] != b"\xff\xd8":
+        return "not a JPEG"
+
+    exif = False
+    pos = 2
+    while True:
+        if pos + 4 > size or data[pos] != 0xFF:
+            return "corrupt JPEG header"
+        marker = data[pos + 1]
+        if marker == 0xDA:  # start of scan, the image data follows
+            break
+        length = int.from_bytes(data[pos + 2 : pos + 4], "big")
+        if length < 2 or pos + 2 + length > size:
+            return "truncated JPEG header"
+        if marker == 0xE1 and data[pos + 4 : pos + 10] == b"Exif\x00\x00":
+            if data[pos + 10 : pos + 14] not in (b"II*\x00", b"MM\x00*"):
+                return "corrupt EXIF data"
+            exif = True
+        pos += 2 + length
+
+    # Some encoders pad the file after the EOI marker
+    if data.rfind(b"\xff\xd9", max(pos, size - 4096)) == -1:
+        return "truncated image data"
+    if not exif:
+        return "no EXIF data"
+    return None
+
+
+@dataclass
+class FileCheck:
+    path: Path
+    item_id: str
+    problem: str | None = None
+    sha256: str | None = None
+
+
+def check_file(entry: os.DirEntry, item_id: str, hash_files: bool) -> FileCheck:
+    """Check one downloaded file; memory mapped, so large videos aren't read
+    into memory."""
+    result = FileCheck(Path(entry.path), item_id)
+    size = entry.stat().st_size
+    if size == 0:
+        result.problem = "empty file"
+        return result
+
+    is_jpeg = os.path.splitext(entry.name)[1].lower() in JPEG_EXTENSIONS
+    if not is_jpeg and not hash_files:
+        return result
+
+    with open(entry.path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if is_jpeg:
+                result.problem = check_jpeg(data)
+            if hash_files:
+                result.sha256 = hashlib.sha256(data).hexdigest()
+    return result
+
+
+@dataclass
+class VerifyReport:
+    checked: int = 0
+    missing: list[str] = field(default_factory=list)
+    bad: list[FileCheck] = field(default_factory=list)
+    changed: list[FileCheck] = field(default_factory=list)
+    unrecognised: int = 0
+
+    @property
+    def bad_ids(self) -> set[str]:
+        return (
+            set(self.missing)
+            | {c.item_id for c in self.bad}
+            | {c.item_id for c in self.changed}
+        )
+
+
+def verify_files(
+    root: Path,
+    layout: FileLayout,
+    known: Callable[[str], bool],
+    workers: int,
+    hashes: dict[str, list] | None = None,
+    skip: Collection[Path] = (),
+) -> tuple[VerifyReport, set[str]]:
+    """Check the downloaded files below `root`.
+
+    Args:
+        known: Tells whether an id is in the state.
+        hashes: Relative path -> [mtime, sha256] from earlier runs, to hash
+            the files and compare them. Updated in place.
+        skip: Files that aren't downloads, e.g. the state file's sidecars.
+
+    Returns:
+        tuple: The report, and the ids that have at least one file.
+    """
+    report = VerifyReport()
+    jobs = []
+    for entry in walk_files(root, workers):
+        if is_sidecar(entry) or Path(entry.path) in skip:
+            continue
+        item_id = next((i for i in layout.candidate_ids(entry.name) if known(i)), None)
+        if item_id is None:
+            report.unrecognised += 1
+            continue
+        jobs.append((entry, item_id))
+
+    found = set()
+    with ThreadPoolExecutor(workers) as executor:
+        results = executor.map(
+            lambda job: check_file(*job, hash_files=hashes is not None), jobs
+        )
+        for (entry, item_id), result in zip(jobs, results):
+            report.checked += 1
+            found.add(item_id)
+            if result.problem:
+                report.bad.append(result)
+                continue
+            if hashes is None:
+                continue
+
+            key = Path(entry.path).relative_to(root).as_posix()
+            mtime = entry.stat().st_mtime
+            previous = hashes.get(key)
+            # A rewritten file (e.g. an upgraded image) is hashed afresh
+            if previous and previous[0] == mtime and previous[1] != result.sha256:
+                result.problem = "contents changed since the last verify"
+                report.changed.append(result)
+                continue
+            hashes[key] = [mtime, result.sha256]
+    return report, found
+
+
+def verify(
+    pictures_folder: Path,
+    state_file: Path,
+    layout: FileLayout,
+    hash_files: bool = False,
+    workers: int | None = None,
+    force: bool = False,
+) -> VerifyReport:
+    """Check that everything in the state file was downloaded completely, and
+    remove the entries that weren't from it, so the next run fetches them
+    again.
+
+    Items stored in an archive (listed in the archive index next to the state
+    file) aren't checked. When most files aren't recognised or most of the
+    state has no file, the layout is probably wrong and the state is left
+    alone, unless `force` is given.
+    """
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    with open(state_file, "r") as f:
+        state: dict[str, str] = json.load(f)
+
+    archived = set()
+    archive_index = state_file.with_suffix(".archive.jsonl")
+    if archive_index.exists():
+        with open(archive_index, "r") as f:
+            archived = {json.loads(line)["id"] for line in f if line.strip()}
+
+    hash_file = state_file.with_suffix(".hashes.json")
+    hashes = None
+    if hash_files:
+        hashes = {}
+        if hash_file.exists():
+            with open(hash_file, "r") as f:
+                hashes = json.load(f)
+
+    click.echo(f"Verifying {len(state)} items in {pictures_folder}")
+    report, found = verify_files(
+        pictures_folder,
+        layout,
+        state.__contains__,
+        workers,
+        hashes,
+        state_files(state_file),
+    )
+    report.missing = [i for i in state if i not in found and i not in archived]
+
+    for check in report.bad + report.changed:
+        click.secho(f"{check.path}: {check.problem}", fg="yellow")
+    if report.missing:
+        click.secho(f"{len(report.missing)} item(s) have no file.", fg="yellow")
+        if report.unrecognised:
+            click.secho(
+                f"{report.unrecognised} file(s) weren't recognised. If they were "
+                "downloaded with another --filename-pattern, pass that one.",
+                fg="yellow",
+            )
+
+    bad_ids = report.bad_ids
+    files = report.checked + report.unrecognised
+    suspicious = (
+        report.unrecognised > files * SUSPICIOUS_SHARE
+        or len(report.missing) > len(state) * SUSPICIOUS_SHARE
+    )
+    if bad_ids and suspicious and not force:
+        click.secho(
+            f"{len(report.missing)} of {len(state)} item(s) have no file and "
+            f"{report.unrecognised} of {files} file(s) weren't recognised, so "
+            "--filename-pattern or --layout is probably not the one they were "
+            "downloaded with. Not changing the state; pass --force to remove "
+            "the items anyway.",
+            fg="red",
+        )
+        bad_ids = set()
+    elif bad_ids:
+        for item_id in bad_ids:
+            state.pop(item_id, None)
+        with open(state_file, "w") as f:
+            json.dump(state, f)
+        # Stale capped sizes would make the re-download look like an upgrade
+        capped_file = state_file.with_suffix(".capped.json")
+        if capped_file.exists():
+            with open(capped_file, "r") as f:
+                capped = json.load(f)
+            with open(capped_file, "w") as f:
+                json.dump({k: v for k, v in capped.items() if k not in bad_ids}, f)
+
+    if hashes is not None:
+        with open(hash_file, "w") as f:
+            json.dump(hashes, f)
+
+    if bad_ids:
+        outcome = (
+            f"Removed {len(bad_ids)} item(s) from the state, "
+            "the next run downloads them again."
+        )
+    elif report.bad_ids:
+        outcome = "The state wasn't changed."
+    else:
+        outcome = "All good."
+    click.secho(
+        f"Checked {report.checked} files: {len(report.bad)} bad, "
+        f"{len(report.changed)} changed, {len(report.missing)} missing. " + outcome,
+        fg="yellow" if report.bad_ids else "green",
+    )
+    return report
@@ -0,0 +1,124 @@
+import random
+import signal
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import click
+
+from famly_fetch.downloader import FamlyDownloader
+
+
+class _Shutdown(BaseException):
+    """Raised from the signal handler to interrupt a poll in progress.
+
+    Not an Exception, so the per-item error handling doesn't swallow it."""
+
+
+@dataclass
+class PollTask:
+    name: str
+    interval: float
+    # Returns False if a source failed, so the poll doesn't count as complete
+    run: Callable[[], bool | None]
+    # Tasks that walk newest-first sources can stop at the first known item
+    # once the initial backfill is done
+    incremental: bool = True
+    next_run: float = 0.0
+    # Polls that completed without errors
+    runs: int = 0
+
+
+class Watcher:
+    """Keep polling the given sources until SIGTERM/SIGINT.
+
+    The downloader (and with it the API client, its connection pool and the
+    loaded state) stays in memory between polls. Each task is rescheduled
+    after its interval with a random jitter, and the state is flushed to disk
+    every `flush_interval` seconds when something new has been downloaded.
+    """
+
+    def __init__(
+        self,
+        downloader: FamlyDownloader,
+        tasks: list[PollTask],
+        jitter: float = 0.1,
+        flush_interval: float = 60,
+    ):
+        self._downloader = downloader
+        self._tasks = tasks
+        self._jitter = jitter
+        self._flush_interval = flush_interval
+        self._stop = threading.Event()
+        self._polling = False
+
+    def stop(self, signum=None, _frame=None):
+        if not self._stop.is_set():
+            click.secho("Shutting down...", fg="cyan")
+        self._stop.set()
+        if self._polling and signum is not None:
+            raise _Shutdown()
+
+    def _reschedule(self, task: PollTask):
+        spread = task.interval * self._jitter
+        task.next_run = (
+            time.monotonic() + task.interval + random.uniform(-spread, spread)
+        )
+
+    def _run_task(self, task: PollTask):
+        stop_on_existing = self._downloader.stop_on_existing
+        if task.incremental and task.runs > 0:
+            self._downloader.stop_on_existing = True
+
+        click.secho(f"Polling {task.name}...", fg="cyan")
+        self._polling = True
+        try:
+            completed = task.run() is not False
+        except Exception as e:
+            completed = False
+            click.secho(
+                f"An exception occurred while polling {task.name}: {e}", fg="red"
+            )
+        finally:
+            self._polling = False
+            self._downloader.stop_on_existing = stop_on_existing
+            self._downloader.end_poll()
+            self._reschedule(task)
+        if completed:
+            task.runs += 1
+        elif task.incremental and task.runs == 0:
+            click.secho(
+                f"Backfill of {task.name} didn't complete, walking it in full "
+                "again on the next poll.",
+                fg="yellow",
+            )
+
+    def run(self):
+        previous_handlers = {
+            sig: signal.signal(sig, self.stop)
+            for sig in (signal.SIGTERM, signal.SIGINT)
+        }
+        last_flush = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                task = min(self._tasks, key=lambda t: t.next_run)
+                delay = task.next_run - time.monotonic()
+                if delay > 0:
+                    flush_delay = last_flush + self._flush_interval - time.monotonic()
+                    if self._stop.wait(max(0, min(delay, flush_delay))):
+                        break
+                else:
+                    self._run_task(task)
+
+                if time.monotonic() - last_flush >= self._flush_interval:
+                    self._downloader.flush_state()
+                    last_flush = time.monotonic()
+        except _Shutdown:
+            pass
+        finally:
+            for sig, handler in previous_handlers.items():
+                signal.signal(sig, handler)
+            self._downloader.close()
+            self._downloader.print_stats()
+            click.secho("Stopped watching.", fg="cyan")
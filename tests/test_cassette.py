@@ -0,0 +1,108 @@
+import gzip
+import json
+
+from famly_fetch.cassette import CassetteRecorder, Scrubber, request_key
+
+
+def test_pseudonym_keeps_the_length():
+    scrubber = Scrubber()
+    for value in ["a", "Alice", "x" * 300]:
+        pseudonym = scrubber.pseudonym(value)
+        assert len(pseudonym) == len(value)
+        assert pseudonym != value
+    assert scrubber.pseudonym("") == ""
+
+
+def test_pseudonyms_are_consistent_within_a_scrubber():
+    scrubber = Scrubber()
+    assert scrubber.pseudonym("Alice") == scrubber.pseudonym("Alice")
+    assert scrubber.pseudonym("Alice") != scrubber.pseudonym("Bob")
+    assert Scrubber().pseudonym("Alice") != Scrubber().pseudonym("Alice")
+
+
+def test_scrub_replaces_personal_data_in_nested_responses():
+    scrubber = Scrubber()
+    data = {
+        "children": [
+            {"childId": "c1", "name": {"firstName": "Alice", "lastName": "Smith"}},
+        ],
+        "feedItems": [
+            {
+                "body": "Alice had a great day",
+                "createdDate": "2024-01-02T10:20:30+00:00",
+                "likes": 3,
+                "liked": True,
+            }
+        ],
+    }
+    scrubbed = scrubber.scrub(data)
+    name = scrubbed["children"][0]["name"]
+    assert name["firstName"] == scrubber.pseudonym("Alice")
+    assert name["lastName"] == scrubber.pseudonym("Smith")
+    assert scrubbed["children"][0]["childId"] == "c1"
+    item = scrubbed["feedItems"][0]
+    assert item["body"] == scrubber.pseudonym("Alice had a great day")
+    assert item["createdDate"] == "2024-01-02T10:20:30+00:00"
+    assert item["likes"] == 3 and item["liked"] is True
+    # The input is left alone
+    assert data["children"][0]["name"]["firstName"] == "Alice"
+
+
+def test_scrub_keeps_the_extension_of_file_names():
+    scrubber = Scrubber()
+    scrubbed = scrubber.scrub(
+        {
+            "filename": "Alice report.pdf",
+            "fileName": "archive.tar.gz",
+            "originalFilename": "README",
+        }
+    )
+    assert scrubbed["filename"] == scrubber.pseudonym("Alice report") + ".pdf"
+    assert scrubbed["fileName"] == scrubber.pseudonym("archive.tar") + ".gz"
+    assert scrubbed["originalFilename"] == scrubber.pseudonym("README")
+
+
+def test_scrub_removes_access_tokens_from_urls():
+    scrubbed = Scrubber().scrub(
+        {"url": "https://x/file?accessToken=secret&expires=1", "accessToken": "abc"}
+    )
+    assert scrubbed["url"] == "https://x/file?accessToken=scrubbed&expires=1"
+    assert scrubbed["accessToken"] != "abc"
+    assert len(scrubbed["accessToken"]) == 3
+
+
+def test_request_key_ignores_page_sizes():
+    assert request_key(
+        "GET", "/api/feed/feed/feed", {"first": 10, "olderThan": "2024"}
+    ) == request_key("GET", "/api/feed/feed/feed", {"first": 50, "olderThan": "2024"})
+    assert request_key(
+        "POST", "/graphql", body={"variables": {"childId": "c1", "limit": 10}}
+    ) == request_key("POST", "/graphql", body={"variables": {"childId": "c1"}})
+    assert request_key(
+        "POST", "/graphql", body={"variables": {"childId": "c1"}}
+    ) != request_key("POST", "/graphql", body={"variables": {"childId": "c2"}})
+
+
+def test_request_key_ignores_personal_data():
+    assert request_key(
+        "POST", "/graphql", body={"variables": {"email": "a@x", "password": "1"}}
+    ) == request_key(
+        "POST", "/graphql", body={"variables": {"email": "b@x", "password": "2"}}
+    )
+
+
+def test_recorded_api_responses_are_scrubbed(tmp_path):
+    path = tmp_path / "cassette.jsonl.gz"
+    recorder = CassetteRecorder(path)
+    recorder.record_api("k", "GET /a", 200, {"title": "Alice"}, 10, 0.1)
+    recorder.record_api("k", "GET /b", 500, None, 10, 0.1, error="x" * 300)
+    recorder.record_api("k", "GET /c", 403, None, 10, 0.1, error="?accessToken=abc")
+    recorder.close()
+
+    with gzip.open(path, "rt") as f:
+        header, ok, failed, denied = [json.loads(line) for line in f]
+    assert header["media_bodies"] is False
+    assert ok["data"]["title"] != "Alice"
+    assert failed["data"] is None
+    assert failed["error"] == "x" * 200
+    assert denied["error"] == "?accessToken=scrubbed"
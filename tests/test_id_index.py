@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+from famly_fetch.id_index import IdIndex, id_hash
+
+
+def write_state(path, state, indent=None):
+    with open(path, "w") as f:
+        json.dump(state, f, indent=indent)
+
+
+def test_id_hash_is_stable_and_fits_in_8_bytes():
+    assert id_hash("abc") == id_hash("abc")
+    assert id_hash("abc") != id_hash("abd")
+    assert 0 <= id_hash("abc") < 2**64
+
+
+def test_new_state_file(tmp_path):
+    state_file = tmp_path / "state.json"
+    index = IdIndex(state_file)
+    assert len(index) == 0
+    index.add("a")
+    index.add("b")
+    assert "a" in index and "b" in index and "c" not in index
+    index.save()
+
+    assert set(json.loads(state_file.read_text())) == {"a", "b"}
+    reloaded = IdIndex(state_file)
+    assert "a" in reloaded and "b" in reloaded
+    assert len(reloaded) == 2
+
+
+def test_adding_twice_keeps_one_entry(tmp_path):
+    state_file = tmp_path / "state.json"
+    write_state(state_file, {"a": "2024-01-01"})
+    index = IdIndex(state_file)
+    index.add("a")
+    index.add("b")
+    index.add("b")
+    assert len(index) == 2
+    index.save()
+    state = json.loads(state_file.read_text())
+    assert list(state) == ["a", "b"]
+    assert state["a"] == "2024-01-01"
+
+
+def test_non_strings_are_not_contained(tmp_path):
+    index = IdIndex(tmp_path / "state.json")
+    index.add("1")
+    assert 1 not in index
+    assert None not in index
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_save_keeps_existing_entries_and_formatting(tmp_path, indent):
+    state_file = tmp_path / "state.json"
+    write_state(state_file, {"a": "2024-01-01", "b": "2024-01-02"}, indent)
+    index = IdIndex(state_file)
+    index.add("c")
+    index.add("d")
+    index.save()
+
+    text = state_file.read_text()
+    state = json.loads(text)
+    assert list(state) == ["a", "b", "c", "d"]
+    assert state["a"] == "2024-01-01"
+    if indent:
+        assert text == json.dumps(state, indent=indent)
+    else:
+        assert "\n" not in text
+    # Nothing left behind from replacing the file
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["state.ids", "state.json"]
+
+
+@pytest.mark.parametrize("content", ["{}", "{\n}"])
+def test_save_to_empty_object(tmp_path, content):
+    state_file = tmp_path / "state.json"
+    state_file.write_text(content)
+    index = IdIndex(state_file)
+    index.add("a")
+    index.save()
+    assert list(json.loads(state_file.read_text())) == ["a"]
+
+
+def test_save_without_changes_leaves_the_file_alone(tmp_path):
+    state_file = tmp_path / "state.json"
+    write_state(state_file, {"a": "2024-01-01"})
+    before = state_file.stat().st_mtime_ns
+    IdIndex(state_file).save()
+    assert state_file.stat().st_mtime_ns == before
+
+
+def test_index_file_is_used_while_the_state_is_unchanged(tmp_path, monkeypatch):
+    state_file = tmp_path / "state.json"
+    write_state(state_file, {"a": "2024-01-01"})
+    index = IdIndex(state_file)
+    index.add("b")
+    index.save()
+
+    def no_parsing(*args, **kwargs):
+        raise AssertionError("state file parsed again")
+
+    monkeypatch.setattr(json, "load", no_parsing)
+    reloaded = IdIndex(state_file)
+    assert "a" in reloaded and "b" in reloaded
+
+
+def test_index_is_rebuilt_when_the_state_changes(tmp_path):
+    state_file = tmp_path / "state.json"
+    write_state(state_file, {"a": "2024-01-01"})
+    IdIndex(state_file)
+    assert (tmp_path / "state.ids").exists()
+
+    write_state(state_file, {"x": "2024-01-01", "y": "2024-01-02"})
+    reloaded = IdIndex(state_file)
+    assert "a" not in reloaded
+    assert "x" in reloaded and "y" in reloaded
+
+
+def test_broken_index_file_is_ignored(tmp_path):
+    state_file = tmp_path / "state.json"
+    write_state(state_file, {"a": "2024-01-01"})
+    (tmp_path / "state.ids").write_bytes(b"garbage")
+    assert "a" in IdIndex(state_file)
+
+
+def test_state_that_isnt_an_object_is_refused(tmp_path):
+    state_file = tmp_path / "state.json"
+    state_file.write_text("[]")
+    index = IdIndex(state_file)
+    index.add("a")
+    with pytest.raises(ValueError):
+        index.save()
+    assert state_file.read_text() == "[]"
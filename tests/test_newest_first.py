@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from famly_fetch import downloader as downloader_module
+from famly_fetch.downloader import FamlyDownloader
+from famly_fetch.image import Image
+from famly_fetch.media import MediaItem
+
+NOW = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def image_dict(img_id: str, days_ago: float) -> dict:
+    return {
+        "imageId": img_id,
+        "prefix": "https://img.example",
+        "key": f"{img_id}.jpg",
+        "width": 800,
+        "height": 600,
+        "createdAt": (NOW - timedelta(days=days_ago)).isoformat(),
+    }
+
+
+def item(img_id: str, days_ago: float, source: str = "post") -> MediaItem:
+    return MediaItem(Image.from_dict(image_dict(img_id, days_ago)), source, source)
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader_module, "TAGGED_PAUSE", 0)
+    downloader = FamlyDownloader(
+        "",
+        "",
+        "http://127.0.0.1:1",
+        tmp_path / "pictures",
+        stop_on_existing=False,
+        text_comments=False,
+        state_file=tmp_path / "state.json",
+        access_token="x",
+    )
+    downloader.fetched = []
+
+    def fetch_item(item):
+        downloader.fetched.append(item.item_id)
+        downloader.mark_as_downloaded(item.item_id)
+        return True
+
+    monkeypatch.setattr(downloader, "fetch_item", fetch_item)
+    yield downloader
+    downloader.close()
+
+
+def stub_api(downloader, monkeypatch, responses: dict):
+    def make_api_request(method, path, params=None, **kwargs):
+        return responses[path]
+
+    monkeypatch.setattr(downloader._apiClient, "make_api_request", make_api_request)
+
+
+def test_sources_are_merged_newest_first(downloader):
+    sources = {
+        "feed": [item("f1", 1), item("f2", 4), item("f3", 9)],
+        "tagged": [item("t1", 2, "tagged"), item("t2", 3, "tagged")],
+        "notes": [item("n1", 0.5), item("n2", 10)],
+    }
+    assert downloader.download_newest_first(sources) == 7
+    assert downloader.fetched == ["n1", "f1", "t1", "t2", "f2", "f3", "n2"]
+
+
+def test_an_item_in_several_sources_is_fetched_once(downloader):
+    sources = {
+        "feed": [item("a", 1), item("b", 2)],
+        "tagged": [item("a", 1, "tagged"), item("c", 3, "tagged")],
+    }
+    assert downloader.download_newest_first(sources) == 3
+    assert downloader.fetched == ["a", "b", "c"]
+
+
+def test_downloaded_items_are_skipped(downloader):
+    downloader.mark_as_downloaded("b")
+    sources = {"feed": [item("a", 1), item("b", 2), item("c", 3)]}
+    downloader.download_newest_first(sources)
+    assert downloader.fetched == ["a", "c"]
+
+
+def test_stop_on_existing_applies_to_each_source(downloader):
+    downloader.stop_on_existing = True
+    downloader.mark_as_downloaded("f2")
+    sources = {
+        "feed": [item("f1", 1), item("f2", 2), item("f3", 3)],
+        "tagged": [item("t1", 1.5, "tagged"), item("t2", 4, "tagged")],
+    }
+    downloader.download_newest_first(sources)
+    assert downloader.fetched == ["f1", "t1", "t2"]
+
+
+def test_a_failing_source_ends_without_the_others(downloader):
+    def failing():
+        yield item("f1", 1)
+        raise RuntimeError("boom")
+
+    sources = {"feed": failing(), "tagged": [item("t1", 2, "tagged")]}
+    assert downloader.download_newest_first(sources) == 2
+    assert downloader.fetched == ["f1", "t1"]
+
+
+def test_tagged_images_newest_first(downloader, monkeypatch):
+    stub_api(
+        downloader,
+        monkeypatch,
+        {
+            "/api/v2/images/tagged": [
+                image_dict("old", 5),
+                image_dict("new", 1),
+                image_dict("mid", 3),
+            ]
+        },
+    )
+    items = downloader.iter_tagged("c1", "Alice", newest_first=True)
+    assert [i.item_id for i in items] == ["new", "mid", "old"]
+    items = downloader.iter_tagged("c1", "Alice")
+    assert [i.item_id for i in items] == ["old", "new", "mid"]
+
+
+def message(img_id: str, days_ago: float) -> dict:
+    return {
+        "body": "Hello",
+        "author": {"title": "Teacher"},
+        "createdAt": (NOW - timedelta(days=days_ago)).isoformat(),
+        "images": [image_dict(img_id, days_ago)],
+        "files": [],
+    }
+
+
+def test_messages_newest_first_across_conversations(downloader, monkeypatch):
+    # Messages are listed oldest first, conversations by latest activity
+    stub_api(
+        downloader,
+        monkeypatch,
+        {
+            "/api/v2/conversations": [
+                {"conversationId": "c1", "lastActivityAt": NOW.isoformat()},
+                {"conversationId": "c2", "lastActivityAt": NOW.isoformat()},
+            ],
+            "/api/v2/conversations/c1": {
+                "messages": [message("c1-old", 6), message("c1-new", 1)]
+            },
+            "/api/v2/conversations/c2": {
+                "messages": [message("c2-old", 4), message("c2-new", 2)]
+            },
+        },
+    )
+    items = downloader.iter_messages(files=False, newest_first=True)
+    assert [i.item_id for i in items] == ["c1-new", "c2-new", "c2-old", "c1-old"]
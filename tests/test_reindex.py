@@ -0,0 +1,110 @@
+import json
+import os
+from datetime import datetime
+
+from famly_fetch.layout import FileLayout
+from famly_fetch.reindex import file_id, reindex
+
+PATTERN = "%FP-%Y-%m-%d_%H-%M-%S-%ID"
+DATE = datetime(2024, 1, 2, 10, 20, 30)
+UUID = "0f8fad5b-d9cb-469f-a165-70867728950e"
+
+
+def make_layout(root, pattern=PATTERN):
+    return FileLayout(root, pattern, create_dirs=False)
+
+
+def touch(path, content=b""):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+def entry_for(path):
+    with os.scandir(path.parent) as entries:
+        return next(e for e in entries if e.name == path.name)
+
+
+def test_candidate_ids_of_an_image_name(tmp_path):
+    layout = make_layout(tmp_path)
+    path = layout.image_path(UUID, "https://x/y/pic.jpg?expires=1", DATE, "Alice")
+    assert path.name == f"Alice-2024-01-02_10-20-30-{UUID}.jpg"
+    candidates = layout.candidate_ids(path.name)
+    # Read as an attachment name, the parts of the UUID are candidates too
+    assert candidates[0] == UUID
+    assert [c for c in candidates if len(c) == len(UUID)] == [UUID]
+
+
+def test_candidate_ids_of_a_custom_pattern(tmp_path):
+    layout = make_layout(tmp_path, "%ID_%Y%m%d")
+    name = layout.image_path("abc", "https://x/pic.png", DATE, "Alice").name
+    assert name == "abc_20240102.png"
+    assert layout.candidate_ids(name) == ["abc"]
+
+
+def test_candidate_ids_of_an_attachment_name(tmp_path):
+    layout = make_layout(tmp_path)
+    path = layout.attachment_path(
+        UUID, "https://x/file", DATE, "Alice", "My report.pdf"
+    )
+    assert path.name == f"Alice-2024-01-02_10-20-30-{UUID}-My_report.pdf"
+    assert UUID in layout.candidate_ids(path.name)
+
+
+def test_candidate_ids_of_an_unrelated_name(tmp_path):
+    assert make_layout(tmp_path).candidate_ids("holiday.jpg") == []
+
+
+def test_file_id_of_an_image(tmp_path):
+    layout = make_layout(tmp_path)
+    path = touch(layout.image_path(UUID, "https://x/pic.jpg", DATE, "Alice"))
+    assert file_id(entry_for(path), layout) == UUID
+
+
+def test_file_id_picks_the_uuid_of_an_attachment(tmp_path):
+    layout = make_layout(tmp_path)
+    path = touch(
+        layout.attachment_path(UUID, "https://x/f", DATE, "Alice", "a-b-c.pdf")
+    )
+    assert file_id(entry_for(path), layout) == UUID
+
+
+def test_file_id_of_an_ambiguous_name_is_unknown(tmp_path):
+    layout = make_layout(tmp_path)
+    path = touch(tmp_path / "post-2024-01-01_10-00-00-fid-1-My_report.pdf")
+    assert len(set(layout.candidate_ids(path.name))) > 1
+    assert file_id(entry_for(path), layout) is None
+
+
+def test_file_id_of_an_ambiguous_name_falls_back_to_the_sidecar(tmp_path):
+    layout = make_layout(tmp_path)
+    path = touch(tmp_path / "post-2024-01-01_10-00-00-fid-1-My_report.pdf")
+    (tmp_path / (path.name + ".json")).write_text(json.dumps({"id": "fid-1"}))
+    assert file_id(entry_for(path), layout) == "fid-1"
+
+
+def test_file_id_of_a_single_non_uuid_candidate(tmp_path):
+    layout = make_layout(tmp_path)
+    path = touch(layout.image_path("fid1", "https://x/pic.png", DATE, "Alice"))
+    assert layout.candidate_ids(path.name) == ["fid1"]
+    assert file_id(entry_for(path), layout) == "fid1"
+
+
+def test_file_id_of_an_unrelated_file(tmp_path):
+    path = touch(tmp_path / "notes.txt")
+    assert file_id(entry_for(path), make_layout(tmp_path)) is None
+
+
+def test_reindex_adds_recognised_files(tmp_path):
+    pictures = tmp_path / "pictures"
+    layout = make_layout(pictures)
+    touch(layout.image_path(UUID, "https://x/pic.jpg", DATE, "Alice"))
+    touch(pictures / "post-2024-01-01_10-00-00-fid-1-My_report.pdf")
+    touch(pictures / "holiday.txt")
+    state_file = pictures / "state.json"
+    state_file.write_text(json.dumps({"old": "2023-01-01"}))
+
+    assert reindex(pictures, state_file, layout, workers=2) == 1
+    state = json.loads(state_file.read_text())
+    assert set(state) == {"old", UUID}
+    assert state["old"] == "2023-01-01"